@@ -0,0 +1,129 @@
+import io
+import time
+from datetime import date, datetime
+
+DEFAULT_CHUNK_SIZE = 50000
+
+USERS_COLUMNS = ('user_id', 'email', 'password_hash', 'full_name', 'registration_date', 'subscription_type')
+PAYMENT_METHODS_COLUMNS = ('user_id', 'method_type', 'card_last_digits', 'is_default', 'added_date', 'expiry_date')
+MOVIES_COLUMNS = ('title', 'director', 'release_year', 'genres', 'duration_minutes', 'imdb_rating')
+DEVICES_COLUMNS = ('user_id', 'device_type', 'device_name', 'last_login_date', 'app_version', 'is_active')
+VIEWING_HISTORY_COLUMNS = ('user_id', 'movie_id', 'device_id', 'start_time', 'end_time', 'viewed_percentage')
+
+MOVIES_COLUMNS_WITH_ID = ('movie_id',) + MOVIES_COLUMNS
+DEVICES_COLUMNS_WITH_ID = ('device_id',) + DEVICES_COLUMNS
+PAYMENT_METHODS_COLUMNS_WITH_ID = ('payment_method_id',) + PAYMENT_METHODS_COLUMNS
+VIEWING_HISTORY_COLUMNS_WITH_ID = ('view_id',) + VIEWING_HISTORY_COLUMNS
+
+_COPY_ESCAPES = str.maketrans({
+    '\\': '\\\\',
+    '\t': '\\t',
+    '\n': '\\n',
+    '\r': '\\r',
+})
+
+
+def format_copy_value(value):
+    if value is None:
+        return '\\N'
+    if value is True:
+        return 't'
+    if value is False:
+        return 'f'
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, str):
+        return value.translate(_COPY_ESCAPES)
+    return str(value)
+
+
+def dict_rows(data, columns):
+    for record in data:
+        yield tuple(record[column] for column in columns)
+
+
+def reserve_ids(cursor, table, id_column, count):
+    # один запрос резервирует сразу весь блок значений последовательности
+    cursor.execute("""
+        SELECT nextval(pg_get_serial_sequence(%s, %s))
+        FROM generate_series(1, %s)
+    """, (table, id_column, count))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def assign_ids(records, id_column, ids):
+    if len(ids) != len(records):
+        raise ValueError(f"Зарезервировано {len(ids)} id для {len(records)} записей")
+
+    for record, new_id in zip(records, ids):
+        record[id_column] = new_id
+
+
+def _write_chunk(cursor, copy_query, lines):
+    buffer = io.StringIO()
+    buffer.write('\n'.join(lines))
+    buffer.write('\n')
+    buffer.seek(0)
+    cursor.copy_expert(copy_query, buffer)
+
+
+def copy_rows(cursor, table, columns, rows, chunk_size=DEFAULT_CHUNK_SIZE):
+    copy_query = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+
+    total = 0
+    lines = []
+    for row in rows:
+        lines.append('\t'.join(format_copy_value(value) for value in row))
+        if len(lines) >= chunk_size:
+            _write_chunk(cursor, copy_query, lines)
+            total += len(lines)
+            lines = []
+
+    if lines:
+        _write_chunk(cursor, copy_query, lines)
+        total += len(lines)
+
+    return total
+
+
+def report_rate(table, count, elapsed):
+    rate = count / elapsed if elapsed > 0 else float('inf')
+    print(f"{table}: {count} строк за {elapsed:.2f} с ({rate:.0f} строк/с)")
+
+
+def copy_table(conn, table, columns, rows, chunk_size=DEFAULT_CHUNK_SIZE):
+    started = time.perf_counter()
+    with conn.cursor() as cursor:
+        count = copy_rows(cursor, table, columns, rows, chunk_size)
+    conn.commit()
+    report_rate(table, count, time.perf_counter() - started)
+    return count
+
+
+def copy_table_returning_ids(conn, table, columns, rows, id_column, chunk_size=DEFAULT_CHUNK_SIZE):
+    # id резервируются одним запросом к последовательности и передаются в COPY
+    # вместе со строками, поэтому после загрузки таблицу не нужно перечитывать
+    started = time.perf_counter()
+    rows = list(rows)
+    with conn.cursor() as cursor:
+        ids = reserve_ids(cursor, table, id_column, len(rows))
+        count = copy_rows(cursor, table, (id_column,) + tuple(columns),
+                          ((new_id,) + tuple(row) for new_id, row in zip(ids, rows)), chunk_size)
+    conn.commit()
+    report_rate(table, count, time.perf_counter() - started)
+    return ids
+
+
+def copy_column_batches(conn, table, columns, batches, to_text):
+    # колоночные пачки сразу превращаются в текст COPY, без словаря на каждую строку
+    copy_query = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+
+    started = time.perf_counter()
+    count = 0
+    with conn.cursor() as cursor:
+        for batch in batches:
+            cursor.copy_expert(copy_query, io.StringIO(to_text(batch, columns)))
+            count += len(batch[columns[0]])
+    conn.commit()
+    report_rate(table, count, time.perf_counter() - started)
+    return count
@@ -0,0 +1,192 @@
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from load_pipeline import TABLE_DEPENDENCIES
+
+# Быстрая загрузка повторяет порядок create.sql -> alter.sql: первичные ключи,
+# уникальные ограничения, внешние ключи и обычные индексы загружаемых таблиц
+# снимаются, данные загружаются в "голые" таблицы, после чего ключи и индексы
+# строятся параллельно, а внешние ключи добавляются как NOT VALID и проверяются
+# один раз через VALIDATE CONSTRAINT. CHECK и NOT NULL остаются на месте.
+STATE_FILE = 'fast_load_state.json'
+
+CAPTURE_CONSTRAINTS_QUERY = """
+    SELECT c.conrelid::regclass::text, c.conname, c.contype, pg_get_constraintdef(c.oid),
+           cl.relkind = 'p'
+    FROM pg_constraint c
+    JOIN pg_class cl ON cl.oid = c.conrelid
+    WHERE c.contype IN ('p', 'u', 'f')
+      AND c.conparentid = 0
+      AND (c.conrelid = ANY(%(tables)s::regclass[]) OR c.confrelid = ANY(%(tables)s::regclass[]))
+    ORDER BY c.contype = 'f' DESC
+"""
+
+CAPTURE_INDEXES_QUERY = """
+    SELECT i.indrelid::regclass::text, i.indexrelid::regclass::text, pg_get_indexdef(i.indexrelid),
+           t.relkind = 'p'
+    FROM pg_index i
+    JOIN pg_class cl ON cl.oid = i.indexrelid
+    JOIN pg_class t ON t.oid = i.indrelid
+    WHERE i.indrelid = ANY(%(tables)s::regclass[])
+      AND NOT cl.relispartition
+      AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid)
+"""
+
+# pg_get_indexdef индекса секционированной таблицы даёт "ON ONLY": такой индекс
+# создаётся только на родителе и остаётся недействительным без индексов секций
+ON_ONLY = re.compile(r'^(CREATE (?:UNIQUE )?INDEX .+? ON )ONLY ')
+
+
+def index_statement(definition):
+    # индексы секций при удалении родительского индекса удаляются вместе с ним
+    # и не сохраняются, поэтому индекс пересоздаётся сразу на всех секциях
+    statement = ON_ONLY.sub(r'\1', definition, count=1)
+    return (statement.replace('CREATE INDEX', 'CREATE INDEX IF NOT EXISTS', 1)
+            .replace('CREATE UNIQUE INDEX', 'CREATE UNIQUE INDEX IF NOT EXISTS', 1))
+
+
+class FastLoad:
+    def __init__(self, pipeline, tables=tuple(TABLE_DEPENDENCIES), state_file=STATE_FILE):
+        self.pipeline = pipeline
+        self.tables = ['cinema.' + table for table in tables]
+        self.state_file = state_file
+        self.timings = {}
+
+    def run(self, load):
+        if os.path.exists(self.state_file):
+            # предыдущая быстрая загрузка прервалась до восстановления ограничений
+            print(f"Найден {self.state_file}, восстанавливаются ограничения прошлой загрузки")
+            self.rebuild(self._read_state())
+
+        state = self._timed('capture', self.capture)
+        self._timed('drop', self.drop, state)
+        try:
+            result = self._timed('load', load)
+        finally:
+            self.rebuild(state)
+
+        self.report()
+        return result
+
+    def rebuild(self, state):
+        self._timed('keys_and_indexes', self.create_keys_and_indexes, state)
+        self._timed('foreign_keys', self.add_foreign_keys, state)
+        self._timed('validate', self.validate_foreign_keys, state)
+        os.remove(self.state_file)
+
+    def capture(self):
+        with self.pipeline.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(CAPTURE_CONSTRAINTS_QUERY, {'tables': self.tables})
+                constraints = [
+                    {'table': table, 'name': name, 'type': contype,
+                     'definition': definition.replace(' NOT VALID', ''), 'partitioned': partitioned}
+                    for table, name, contype, definition, partitioned in cursor.fetchall()
+                ]
+                cursor.execute(CAPTURE_INDEXES_QUERY, {'tables': self.tables})
+                indexes = [
+                    {'table': table, 'name': name, 'definition': definition, 'partitioned': partitioned}
+                    for table, name, definition, partitioned in cursor.fetchall()
+                ]
+            conn.commit()
+
+        state = {'constraints': constraints, 'indexes': indexes}
+        with open(self.state_file, 'w', encoding='utf-8') as file:
+            json.dump(state, file, ensure_ascii=False, indent=2)
+        return state
+
+    def _read_state(self):
+        with open(self.state_file, 'r', encoding='utf-8') as file:
+            return json.load(file)
+
+    def drop(self, state):
+        with self.pipeline.connection() as conn:
+            with conn.cursor() as cursor:
+                # внешние ключи идут первыми: от них зависят первичные ключи
+                for constraint in state['constraints']:
+                    cursor.execute(f"ALTER TABLE {constraint['table']} DROP CONSTRAINT IF EXISTS {constraint['name']}")
+                for index in state['indexes']:
+                    cursor.execute(f"DROP INDEX IF EXISTS {index['name']}")
+            conn.commit()
+
+    def _parallel(self, tasks):
+        # tasks: список списков SQL-команд; каждый список выполняется на своём соединении
+        def execute(statements):
+            with self.pipeline.connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("SET maintenance_work_mem = '512MB'")
+                    for statement in statements:
+                        cursor.execute(statement)
+                conn.commit()
+
+        with ThreadPoolExecutor(max_workers=self.pipeline.max_connections) as executor:
+            for future in [executor.submit(execute, statements) for statements in tasks if statements]:
+                future.result()
+
+    def _existing(self, cursor, constraint):
+        cursor.execute("SELECT 1 FROM pg_constraint WHERE conrelid = %s::regclass AND conname = %s",
+                       (constraint['table'], constraint['name']))
+        return cursor.fetchone() is not None
+
+    def create_keys_and_indexes(self, state):
+        # ADD PRIMARY KEY блокирует таблицу целиком, поэтому ключи одной таблицы
+        # строятся последовательно, а разные таблицы и обычные индексы - параллельно
+        per_table = {}
+        with self.pipeline.connection() as conn:
+            with conn.cursor() as cursor:
+                for constraint in state['constraints']:
+                    if constraint['type'] == 'f' or self._existing(cursor, constraint):
+                        continue
+                    per_table.setdefault(constraint['table'], []).append(
+                        f"ALTER TABLE {constraint['table']} ADD CONSTRAINT {constraint['name']} {constraint['definition']}"
+                    )
+            conn.commit()
+
+        # индексы секционированной таблицы строятся по очереди: индексы секций
+        # получают имена автоматически, и параллельные построения на одних
+        # столбцах конфликтуют из-за одинаковых имён
+        index_tasks = []
+        partitioned_indexes = {}
+        for index in state['indexes']:
+            if index.get('partitioned'):
+                partitioned_indexes.setdefault(index['table'], []).append(index_statement(index['definition']))
+            else:
+                index_tasks.append([index_statement(index['definition'])])
+        self._parallel(list(per_table.values()) + index_tasks + list(partitioned_indexes.values()))
+
+    def add_foreign_keys(self, state):
+        with self.pipeline.connection() as conn:
+            with conn.cursor() as cursor:
+                for constraint in state['constraints']:
+                    if constraint['type'] != 'f' or self._existing(cursor, constraint):
+                        continue
+                    # NOT VALID не поддерживается для секционированных таблиц,
+                    # там ключ проверяется сразу при добавлении
+                    not_valid = '' if constraint['partitioned'] else ' NOT VALID'
+                    cursor.execute(
+                        f"ALTER TABLE {constraint['table']} ADD CONSTRAINT {constraint['name']} "
+                        f"{constraint['definition']}{not_valid}"
+                    )
+            conn.commit()
+
+    def validate_foreign_keys(self, state):
+        self._parallel([
+            [f"ALTER TABLE {constraint['table']} VALIDATE CONSTRAINT {constraint['name']}"]
+            for constraint in state['constraints']
+            if constraint['type'] == 'f' and not constraint['partitioned']
+        ])
+
+    def _timed(self, phase, function, *args):
+        started = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            self.timings[phase] = self.timings.get(phase, 0) + time.perf_counter() - started
+
+    def report(self):
+        print("\nФаза быстрой загрузки     время, с")
+        for phase, seconds in self.timings.items():
+            print(f"{phase:<24} {seconds:>9.2f}")
@@ -2,7 +2,16 @@ from generate_users import generate_users_data
 from generate_payment_methods import generate_payment_methods_data
 from generate_movies import generate_movies_data
 from generate_devices import generate_devices_data
-from generate_viewing_history import generate_viewing_history_data
+from generate_viewing_history import generate_viewing_history_data, iter_viewing_history_batches, merge_by_start_time
+from copy_loader import (
+    DEFAULT_CHUNK_SIZE, USERS_COLUMNS, PAYMENT_METHODS_COLUMNS, MOVIES_COLUMNS,
+    DEVICES_COLUMNS, VIEWING_HISTORY_COLUMNS, MOVIES_COLUMNS_WITH_ID, DEVICES_COLUMNS_WITH_ID,
+    dict_rows, copy_table, copy_table_returning_ids, reserve_ids, assign_ids,
+)
+from generate_viewing_history_vectorized import generate_viewing_history_columns, columns_to_copy_text
+from load_pipeline import LoadPipeline, load_generated_data
+from fast_load import FastLoad
+from partitions import copy_viewing_history, copy_viewing_history_columns, fold_aggregates
 
 import psycopg2
 
@@ -215,6 +224,7 @@ def insert_viewing_history_to_db(viewing_history_data, movie_id_mapping, device_
             ))
         
         conn.commit()
+        fold_aggregates(conn)
         print(f"Успешно добавлено {len(viewing_history_data)} записей истории просмотров")
         
     except Exception as e:
@@ -225,6 +235,181 @@ def insert_viewing_history_to_db(viewing_history_data, movie_id_mapping, device_
             cursor.close()
             conn.close()
 
+def copy_users_to_db(users_data, db_params, chunk_size=DEFAULT_CHUNK_SIZE):
+    conn = None
+    try:
+        conn = psycopg2.connect(**db_params)
+        copy_table(conn, 'cinema.users', USERS_COLUMNS, dict_rows(users_data, USERS_COLUMNS), chunk_size)
+        print(f"Успешно добавлено {len(users_data)} пользователей")
+
+    except Exception as e:
+        print(f"Ошибка при вставке данных: {e}")
+        if conn:
+            conn.rollback()
+    finally:
+        if conn:
+            conn.close()
+
+def copy_payment_methods_to_db(payment_methods_data, db_params, chunk_size=DEFAULT_CHUNK_SIZE):
+    conn = None
+    try:
+        conn = psycopg2.connect(**db_params)
+        copy_table(conn, 'cinema.payment_methods', PAYMENT_METHODS_COLUMNS,
+                   dict_rows(payment_methods_data, PAYMENT_METHODS_COLUMNS), chunk_size)
+        print(f"Успешно добавлено {len(payment_methods_data)} способов оплаты")
+
+    except Exception as e:
+        print(f"Ошибка при вставке данных: {e}")
+        if conn:
+            conn.rollback()
+    finally:
+        if conn:
+            conn.close()
+
+def reserve_db_ids(movies_data, devices_data, db_params):
+    conn = None
+    try:
+        conn = psycopg2.connect(**db_params)
+        with conn.cursor() as cursor:
+            assign_ids(movies_data, 'movie_id', reserve_ids(cursor, 'cinema.movies', 'movie_id', len(movies_data)))
+            assign_ids(devices_data, 'device_id', reserve_ids(cursor, 'cinema.devices', 'device_id', len(devices_data)))
+        conn.commit()
+        print(f"Зарезервировано {len(movies_data)} id фильмов и {len(devices_data)} id устройств")
+        return True
+
+    except Exception as e:
+        print(f"Ошибка при резервировании id: {e}")
+        if conn:
+            conn.rollback()
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+def copy_movies_with_ids_to_db(movies_data, db_params, chunk_size=DEFAULT_CHUNK_SIZE):
+    conn = None
+    try:
+        conn = psycopg2.connect(**db_params)
+        copy_table(conn, 'cinema.movies', MOVIES_COLUMNS_WITH_ID,
+                   dict_rows(movies_data, MOVIES_COLUMNS_WITH_ID), chunk_size)
+        print(f"Успешно добавлено {len(movies_data)} фильмов")
+
+    except Exception as e:
+        print(f"Ошибка при вставке данных: {e}")
+        if conn:
+            conn.rollback()
+    finally:
+        if conn:
+            conn.close()
+
+def copy_devices_with_ids_to_db(devices_data, db_params, chunk_size=DEFAULT_CHUNK_SIZE):
+    conn = None
+    try:
+        conn = psycopg2.connect(**db_params)
+        copy_table(conn, 'cinema.devices', DEVICES_COLUMNS_WITH_ID,
+                   dict_rows(devices_data, DEVICES_COLUMNS_WITH_ID), chunk_size)
+        print(f"Успешно добавлено {len(devices_data)} устройств")
+
+    except Exception as e:
+        print(f"Ошибка при вставке данных: {e}")
+        if conn:
+            conn.rollback()
+    finally:
+        if conn:
+            conn.close()
+
+def copy_movies_to_db(movies_data, db_params, chunk_size=DEFAULT_CHUNK_SIZE):
+    conn = None
+    try:
+        conn = psycopg2.connect(**db_params)
+        db_movie_ids = copy_table_returning_ids(conn, 'cinema.movies', MOVIES_COLUMNS,
+                                                dict_rows(movies_data, MOVIES_COLUMNS), 'movie_id', chunk_size)
+        movie_id_mapping = {movie['movie_id']: db_movie_id for movie, db_movie_id in zip(movies_data, db_movie_ids)}
+        print(f"Успешно добавлено {len(movies_data)} фильмов")
+        return movie_id_mapping
+
+    except Exception as e:
+        print(f"Ошибка при вставке данных: {e}")
+        if conn:
+            conn.rollback()
+        return {}
+    finally:
+        if conn:
+            conn.close()
+
+def copy_devices_to_db(devices_data, db_params, chunk_size=DEFAULT_CHUNK_SIZE):
+    conn = None
+    try:
+        conn = psycopg2.connect(**db_params)
+        db_device_ids = copy_table_returning_ids(conn, 'cinema.devices', DEVICES_COLUMNS,
+                                                 dict_rows(devices_data, DEVICES_COLUMNS), 'device_id', chunk_size)
+        device_id_mapping = {device['device_id']: db_device_id for device, db_device_id in zip(devices_data, db_device_ids)}
+        print(f"Успешно добавлено {len(devices_data)} устройств")
+        return device_id_mapping
+
+    except Exception as e:
+        print(f"Ошибка при вставке данных: {e}")
+        if conn:
+            conn.rollback()
+        return {}
+    finally:
+        if conn:
+            conn.close()
+
+def map_viewing_history_rows(viewing_history_data, movie_id_mapping, device_id_mapping):
+    for record in viewing_history_data:
+        db_movie_id = movie_id_mapping.get(record['movie_id'])
+        db_device_id = device_id_mapping.get(record['device_id'])
+
+        if db_movie_id is None or db_device_id is None:
+            print(f"Warning: Skipping viewing record - movie_id {record['movie_id']} or device_id {record['device_id']} not found in mapping")
+            continue
+
+        yield (
+            record['user_id'],
+            db_movie_id,
+            db_device_id,
+            record['start_time'],
+            record['end_time'],
+            record['viewed_percentage']
+        )
+
+def copy_viewing_history_to_db(viewing_history_data, db_params, chunk_size=DEFAULT_CHUNK_SIZE,
+                               movie_id_mapping=None, device_id_mapping=None):
+    conn = None
+    try:
+        conn = psycopg2.connect(**db_params)
+        if movie_id_mapping is None and device_id_mapping is None:
+            # id уже назначены на клиенте, сопоставление не нужно
+            rows = dict_rows(viewing_history_data, VIEWING_HISTORY_COLUMNS)
+        else:
+            rows = map_viewing_history_rows(viewing_history_data, movie_id_mapping, device_id_mapping)
+        count = copy_viewing_history(conn, rows, chunk_size)
+        print(f"Успешно добавлено {count} записей истории просмотров")
+
+    except Exception as e:
+        print(f"Ошибка при вставке данных: {e}")
+        if conn:
+            conn.rollback()
+    finally:
+        if conn:
+            conn.close()
+
+def copy_viewing_history_columns_to_db(column_batches, db_params):
+    conn = None
+    try:
+        conn = psycopg2.connect(**db_params)
+        count = copy_viewing_history_columns(conn, column_batches, columns_to_copy_text)
+        print(f"Успешно добавлено {count} записей истории просмотров")
+
+    except Exception as e:
+        print(f"Ошибка при вставке данных: {e}")
+        if conn:
+            conn.rollback()
+    finally:
+        if conn:
+            conn.close()
+
 def main():
     db_params = {
         'host': 'localhost',
@@ -240,14 +425,61 @@ def main():
     
     data_count = 1000
 
+    response = input("\nВставить данные в базу? (y/n): ")
+    insert = response.lower() == 'y'
+    bulk = insert and input("Использовать COPY? (y/n): ").lower() == 'y'
+    client_ids = bulk and input("Назначать id фильмов и устройств на клиенте? (y/n): ").lower() == 'y'
+    vectorized = client_ids and input("Генерировать историю просмотров через numpy? (y/n): ").lower() == 'y'
+    parallel = client_ids and input("Загружать независимые таблицы параллельно? (y/n): ").lower() == 'y'
+    fast = parallel and input("Снять ключи и индексы на время загрузки? (y/n): ").lower() == 'y'
+    if bulk:
+        chunk_size = int(input(f"Размер пачки COPY [{DEFAULT_CHUNK_SIZE}]: ") or DEFAULT_CHUNK_SIZE)
+
     users_data = generate_users_data(data_count)
     payment_methods_data = generate_payment_methods_data(users_data)
     movies_data = generate_movies_data(data_count)
     devices_data = generate_devices_data(users_data)
-    viewing_history_data = generate_viewing_history_data(users_data, movies_data, devices_data)
+    if client_ids:
+        # история просмотров генерируется уже с итоговыми id из базы
+        client_ids = reserve_db_ids(movies_data, devices_data, db_params)
+    if vectorized and client_ids:
+        viewing_history_data = generate_viewing_history_columns(users_data, movies_data, devices_data)
+    elif client_ids:
+        # история генерируется пачками прямо во время COPY, порядок по start_time
+        # восстанавливается внешним слиянием без материализации всего списка
+        viewing_history_data = merge_by_start_time(
+            iter_viewing_history_batches(users_data, movies_data, devices_data)
+        )
+    else:
+        viewing_history_data = generate_viewing_history_data(users_data, movies_data, devices_data)
     
-    response = input("\nВставить данные в базу? (y/n): ")
-    if response.lower() == 'y':
+    if client_ids and parallel:
+        pipeline = LoadPipeline(db_params, chunk_size=chunk_size)
+        try:
+            load = lambda: load_generated_data(pipeline, users_data, payment_methods_data, movies_data, devices_data,
+                                               viewing_history_data, columns_to_copy_text if vectorized else None)
+            if fast:
+                FastLoad(pipeline).run(load)
+            else:
+                load()
+        finally:
+            pipeline.close()
+    elif client_ids:
+        copy_users_to_db(users_data, db_params, chunk_size)
+        copy_payment_methods_to_db(payment_methods_data, db_params, chunk_size)
+        copy_movies_with_ids_to_db(movies_data, db_params, chunk_size)
+        copy_devices_with_ids_to_db(devices_data, db_params, chunk_size)
+        if vectorized:
+            copy_viewing_history_columns_to_db(viewing_history_data, db_params)
+        else:
+            copy_viewing_history_to_db(viewing_history_data, db_params, chunk_size)
+    elif bulk:
+        copy_users_to_db(users_data, db_params, chunk_size)
+        copy_payment_methods_to_db(payment_methods_data, db_params, chunk_size)
+        movie_id_mapping = copy_movies_to_db(movies_data, db_params, chunk_size)
+        device_id_mapping = copy_devices_to_db(devices_data, db_params, chunk_size)
+        copy_viewing_history_to_db(viewing_history_data, db_params, chunk_size, movie_id_mapping, device_id_mapping)
+    elif insert:
         insert_users_to_db(users_data, db_params)
         insert_payment_methods_to_db(payment_methods_data, db_params)
         movie_id_mapping = insert_movies_to_db(movies_data, db_params)
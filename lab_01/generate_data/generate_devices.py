@@ -1,9 +1,9 @@
 import random
 from datetime import datetime, timedelta, date
 
-def generate_devices_data(users_data, num_devices_per_user=2):
+def generate_devices_data(users_data, num_devices_per_user=2, start_id=1):
     devices_data = []
-    device_id_counter = 1
+    device_id_counter = start_id
     
     device_types = {
         'phone': ['iPhone 14', 'iPhone 13', 'iPhone 12', 'Samsung Galaxy S23', 'Samsung Galaxy S22', 
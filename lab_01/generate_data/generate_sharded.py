@@ -0,0 +1,225 @@
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import psycopg2
+from faker import Faker
+
+from generate_users import generate_users_data, generate_users_data_fast, build_name_pool
+from generate_payment_methods import generate_payment_methods_data
+from generate_movies import generate_movies_data
+from generate_devices import generate_devices_data
+from generate_viewing_history import generate_viewing_history_data
+from copy_loader import (
+    DEFAULT_CHUNK_SIZE, USERS_COLUMNS, PAYMENT_METHODS_COLUMNS_WITH_ID, MOVIES_COLUMNS_WITH_ID,
+    DEVICES_COLUMNS_WITH_ID, VIEWING_HISTORY_COLUMNS_WITH_ID, dict_rows, copy_table,
+)
+from partitions import is_partitioned, prepare_partitions, finish_load, fold_aggregates, copy_viewing_history
+
+# Размер шарда фиксирован и не зависит от числа процессов: шард с номером N
+# всегда содержит одних и тех же пользователей и генерируется из одного и того же
+# зерна, поэтому результат при заданном seed одинаков для любого числа воркеров.
+# Ключи всех таблиц тоже берутся из диапазона шарда (по верхней границе числа
+# строк на пользователя), а не из последовательностей: id не зависят от того,
+# какой воркер первым дошёл до базы.
+SHARD_SIZE = 10000
+MAX_DEVICES_PER_USER = 4
+MAX_PAYMENT_METHODS_PER_USER = 3
+MAX_VIEWS_PER_USER = 80
+
+# пул имён строится один раз на процесс и зерно, а не на каждый шард
+_name_pools = {}
+
+SEQUENCES = (
+    ('cinema.users', 'user_id'),
+    ('cinema.movies', 'movie_id'),
+    ('cinema.devices', 'device_id'),
+    ('cinema.payment_methods', 'payment_method_id'),
+    ('cinema.viewing_history', 'view_id'),
+)
+
+
+def shard_seed(seed, shard_index):
+    return f"{seed}:{shard_index}"
+
+
+def split_into_shards(total_users):
+    return [
+        (shard_index, min(SHARD_SIZE, total_users - shard_index * SHARD_SIZE))
+        for shard_index in range((total_users + SHARD_SIZE - 1) // SHARD_SIZE)
+    ]
+
+
+def name_pool(seed):
+    # своё зерно у пула: имена одинаковы в любом процессе при любом числе воркеров
+    pool = _name_pools.get(seed)
+    if pool is None:
+        Faker.seed(shard_seed(seed, 'names'))
+        pool = _name_pools[seed] = build_name_pool()
+    return pool
+
+
+def assign_shard_ids(records, id_column, shard_index, per_user):
+    first_id = shard_index * SHARD_SIZE * per_user + 1
+    if len(records) > SHARD_SIZE * per_user:
+        raise ValueError(f"Шард {shard_index}: {len(records)} строк не помещаются в диапазон {id_column}")
+    for offset, record in enumerate(records):
+        record[id_column] = first_id + offset
+
+
+def generate_shard(shard_index, num_users, movies_data, seed, fast_users=False):
+    pool = name_pool(seed) if fast_users else None
+    random.seed(shard_seed(seed, shard_index))
+    Faker.seed(shard_seed(seed, shard_index))
+
+    if fast_users:
+        users_data = generate_users_data_fast(num_users, start_id=shard_index * SHARD_SIZE + 1, name_pool=pool)
+    else:
+        users_data = generate_users_data(
+            num_users,
+            start_id=shard_index * SHARD_SIZE + 1,
+            email_suffix=f".{shard_index}",
+        )
+    payment_methods_data = generate_payment_methods_data(users_data)
+    devices_data = generate_devices_data(
+        users_data,
+        start_id=shard_index * SHARD_SIZE * MAX_DEVICES_PER_USER + 1,
+    )
+    viewing_history_data = generate_viewing_history_data(users_data, movies_data, devices_data)
+    assign_shard_ids(payment_methods_data, 'payment_method_id', shard_index, MAX_PAYMENT_METHODS_PER_USER)
+    assign_shard_ids(viewing_history_data, 'view_id', shard_index, MAX_VIEWS_PER_USER)
+
+    return users_data, payment_methods_data, devices_data, viewing_history_data
+
+
+def load_shard(shard_index, num_users, movies_data, seed, db_params, chunk_size=DEFAULT_CHUNK_SIZE, fast_users=False):
+    started = time.perf_counter()
+    users_data, payment_methods_data, devices_data, viewing_history_data = generate_shard(
+        shard_index, num_users, movies_data, seed, fast_users
+    )
+    generated = time.perf_counter()
+
+    conn = psycopg2.connect(**db_params)
+    try:
+        copy_table(conn, 'cinema.users', USERS_COLUMNS, dict_rows(users_data, USERS_COLUMNS), chunk_size)
+        copy_table(conn, 'cinema.payment_methods', PAYMENT_METHODS_COLUMNS_WITH_ID,
+                   dict_rows(payment_methods_data, PAYMENT_METHODS_COLUMNS_WITH_ID), chunk_size)
+        copy_table(conn, 'cinema.devices', DEVICES_COLUMNS_WITH_ID,
+                   dict_rows(devices_data, DEVICES_COLUMNS_WITH_ID), chunk_size)
+        # секции создаются до запуска шардов, агрегаты пересчитываются после всех
+        copy_viewing_history(conn, dict_rows(viewing_history_data, VIEWING_HISTORY_COLUMNS_WITH_ID), chunk_size,
+                             period=None, finish=False, columns=VIEWING_HISTORY_COLUMNS_WITH_ID)
+    finally:
+        conn.close()
+
+    return {
+        'shard': shard_index,
+        'users': len(users_data),
+        'payment_methods': len(payment_methods_data),
+        'devices': len(devices_data),
+        'viewing_history': len(viewing_history_data),
+        'generate_seconds': generated - started,
+        'load_seconds': time.perf_counter() - generated,
+    }
+
+
+def _load_shard_task(args):
+    return load_shard(*args)
+
+
+def prepare_tables(movies_data, db_params, chunk_size=DEFAULT_CHUNK_SIZE):
+    conn = psycopg2.connect(**db_params)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                TRUNCATE TABLE cinema.users, cinema.movies, cinema.devices,
+                               cinema.payment_methods, cinema.viewing_history
+                RESTART IDENTITY CASCADE
+            """)
+        conn.commit()
+        copy_table(conn, 'cinema.movies', MOVIES_COLUMNS_WITH_ID,
+                   dict_rows(movies_data, MOVIES_COLUMNS_WITH_ID), chunk_size)
+        if is_partitioned(conn):
+            prepare_partitions(conn)
+    finally:
+        conn.close()
+
+
+def sync_sequences(db_params):
+    conn = psycopg2.connect(**db_params)
+    try:
+        with conn.cursor() as cursor:
+            for table, id_column in SEQUENCES:
+                cursor.execute(f"""
+                    SELECT setval(pg_get_serial_sequence(%s, %s), coalesce(max({id_column}), 0) + 1, false)
+                    FROM {table}
+                """, (table, id_column))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def finish_viewing_history_load(db_params):
+    conn = psycopg2.connect(**db_params)
+    try:
+        if is_partitioned(conn):
+            finish_load(conn)
+        else:
+            fold_aggregates(conn)
+    finally:
+        conn.close()
+
+
+def run_sharded(total_users, num_movies, seed, db_params, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, fast_users=False):
+    started = time.perf_counter()
+
+    random.seed(shard_seed(seed, 'movies'))
+    movies_data = generate_movies_data(num_movies)
+    prepare_tables(movies_data, db_params, chunk_size)
+
+    tasks = [
+        (shard_index, num_users, movies_data, seed, db_params, chunk_size, fast_users)
+        for shard_index, num_users in split_into_shards(total_users)
+    ]
+
+    totals = {'users': 0, 'payment_methods': 0, 'devices': 0, 'viewing_history': 0}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for stats in pool.map(_load_shard_task, tasks):
+            for key in totals:
+                totals[key] += stats[key]
+            print(f"Шард {stats['shard']}: {stats['users']} пользователей, "
+                  f"генерация {stats['generate_seconds']:.2f} с, загрузка {stats['load_seconds']:.2f} с")
+
+    sync_sequences(db_params)
+    finish_viewing_history_load(db_params)
+
+    elapsed = time.perf_counter() - started
+    print(f"Загружено {len(tasks)} шардов за {elapsed:.2f} с: " +
+          ", ".join(f"{table} {count}" for table, count in totals.items()))
+    return totals
+
+
+def main():
+    db_params = {
+        'host': 'localhost',
+        'database': 'streaming_service',
+        'user': 'postgres',
+        'password': 'postgres',
+        'port': '5432'
+    }
+
+    total_users = int(input("Количество пользователей [100000]: ") or 100000)
+    num_movies = int(input("Количество фильмов [1000]: ") or 1000)
+    seed = int(input("Зерно генератора [42]: ") or 42)
+    workers = int(input("Количество процессов [по числу ядер]: ") or 0) or None
+    fast_users = input("Быстрая генерация пользователей? (y/n): ").lower() == 'y'
+
+    response = input("\nТаблицы будут очищены. Продолжить? (y/n): ")
+    if response.lower() == 'y':
+        run_sharded(total_users, num_movies, seed, db_params, workers, fast_users=fast_users)
+    else:
+        print("Данные не были вставлены в базу")
+
+
+if __name__ == "__main__":
+    main()
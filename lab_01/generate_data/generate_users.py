@@ -1,10 +1,15 @@
 from faker import Faker
 import random
+import re
 from datetime import datetime, timedelta
 import hashlib
 from transliterate import translit
 
-def generate_users_data(num_records=1000):
+NAME_POOL_SIZE = 5000
+EMAIL_DOMAINS = ['gmail.com', 'mail.ru', 'yandex.ru', 'yahoo.com', 'icloud.com']
+SUBSCRIPTION_TYPES = ['basic', 'standard', 'premium']
+
+def generate_users_data(num_records=1000, start_id=1, email_suffix=''):
     fake = Faker('ru_RU')
     users_data = []
     used_emails = set()
@@ -13,13 +18,13 @@ def generate_users_data(num_records=1000):
     
     for i in range(num_records):
         full_name = fake.name()
-        email = generate_unique_email(full_name, used_emails)
+        email = generate_unique_email(full_name, used_emails, email_suffix)
         password_hash = generate_password_hash()
         registration_date = generate_registration_date()
         subscription_type = random.choice(subscription_types)
         
         users_data.append({
-            'user_id': i + 1,
+            'user_id': start_id + i,
             'email': email,
             'password_hash': password_hash,
             'full_name': full_name,
@@ -29,9 +34,12 @@ def generate_users_data(num_records=1000):
     
     return users_data
 
-def generate_unique_email(full_name, used_emails):
+def generate_unique_email(full_name, used_emails, email_suffix=''):
     while True:
         email = generate_email(full_name)
+        if email_suffix:
+            username, domain = email.split('@')
+            email = f"{username}{email_suffix}@{domain}"
         if email not in used_emails:
             used_emails.add(email)
             return email
@@ -58,6 +66,51 @@ def generate_email(full_name):
     
     return f"{username}@{domain}"
 
+def build_name_pool(size=NAME_POOL_SIZE):
+    # Faker и транслитерация вызываются один раз на имя из пула, а не на пользователя
+    fake = Faker('ru_RU')
+    name_pool = []
+    for _ in range(size):
+        full_name = fake.name()
+        name_parts = [re.sub(r'[^a-z0-9]', '', part)
+                      for part in translit(full_name, language_code='ru', reversed=True).lower().split()]
+        name_parts = [part for part in name_parts if part]
+        if len(name_parts) < 2:
+            name_parts = ['user', 'name']
+        name_pool.append((full_name, f"{name_parts[0]}.{name_parts[1]}"))
+    return name_pool
+
+def generate_users_data_fast(num_records=1000, start_id=1, name_pool=None):
+    if name_pool is None:
+        name_pool = build_name_pool()
+    
+    start_date = datetime(2020, 1, 1).date()
+    registration_dates = [start_date + timedelta(days=d)
+                          for d in range((datetime.now().date() - start_date).days + 1)]
+    
+    names = random.choices(name_pool, k=num_records)
+    dates = random.choices(registration_dates, k=num_records)
+    subscriptions = random.choices(SUBSCRIPTION_TYPES, k=num_records)
+    # 32 случайных байта на пользователя дают строку того же вида, что и sha256().hexdigest()
+    hashes = random.randbytes(32 * num_records).hex()
+    
+    users_data = []
+    for i in range(num_records):
+        user_id = start_id + i
+        full_name, username = names[i]
+        
+        users_data.append({
+            'user_id': user_id,
+            # user_id в адресе делает email уникальным без проверки коллизий
+            'email': f"{username}.{user_id}@{EMAIL_DOMAINS[user_id % len(EMAIL_DOMAINS)]}",
+            'password_hash': hashes[64 * i:64 * (i + 1)],
+            'full_name': full_name,
+            'registration_date': dates[i],
+            'subscription_type': subscriptions[i]
+        })
+    
+    return users_data
+
 def generate_password_hash():
     password = ''.join(random.choices('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789', k=12))
     return hashlib.sha256(password.encode()).hexdigest()
@@ -1,94 +1,195 @@
+import heapq
+import pickle
 import random
+import tempfile
+from itertools import islice
 from datetime import datetime, timedelta, date
 
-def generate_viewing_history_data(users_data, movies_data, devices_data, num_records_per_user=15):
-    viewing_history_data = []
-    
+RUN_SIZE = 200000
+RUN_BLOCK_SIZE = 1000
+# сколько серий сливается за один проход
+MERGE_FAN_IN = 64
+
+# начала просмотров равномерно распределены по HISTORY_DAYS дням с HISTORY_START
+HISTORY_START = datetime(2024, 1, 1)
+HISTORY_DAYS = 365
+
+def group_devices_by_user(devices_data):
     user_devices = {}
     for device in devices_data:
         user_id = device['user_id']
         if user_id not in user_devices:
             user_devices[user_id] = []
         user_devices[user_id].append(device)
+    return user_devices
+
+def generate_viewing_history_data(users_data, movies_data, devices_data, num_records_per_user=15):
+    viewing_history_data = []
+    
+    for batch in iter_viewing_history_batches(users_data, movies_data, devices_data):
+        viewing_history_data.extend(batch)
+    
+    viewing_history_data.sort(key=_start_time_key)
     
+    return viewing_history_data
+
+def iter_viewing_history_batches(users_data, movies_data, devices_data, batch_size=10000):
+    user_devices = group_devices_by_user(devices_data)
     movie_durations = {movie['movie_id']: movie.get('duration_minutes') or 120 for movie in movies_data}
     
+    batch = []
     for user in users_data:
-        user_id = user['user_id']
-        reg_date = user['registration_date']
+        batch.extend(generate_user_viewing_history(user, movies_data, user_devices.get(user['user_id'], []), movie_durations))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    
+    if batch:
+        yield batch
+
+def generate_user_viewing_history(user, movies_data, user_device_list, movie_durations):
+    user_history = []
+    
+    user_id = user['user_id']
+    reg_date = user['registration_date']
+    
+    active_devices = [d for d in user_device_list if d['is_active']]
+    all_devices = user_device_list
+    
+    if not all_devices:
+        return user_history
+    
+    days_since_reg = (date.today() - reg_date).days
+    if days_since_reg <= 0:
+        return user_history
+    
+    activity_level = random.choices(['low', 'medium', 'high'], weights=[0.3, 0.5, 0.2])[0]
+    
+    if activity_level == 'low':
+        num_views = random.randint(5, 15)
+    elif activity_level == 'medium':
+        num_views = random.randint(15, 40)
+    else:
+        num_views = random.randint(40, 80)
+    
+    num_views = min(num_views, days_since_reg * 2)
+    
+    for _ in range(num_views):
+        movie = random.choice(movies_data)
+        movie_id = movie['movie_id']
+        movie_duration = movie_durations.get(movie_id, 120)
+        
+        if movie_duration is None:
+            movie_duration = 120
         
-        user_device_list = user_devices.get(user_id, [])
-        active_devices = [d for d in user_device_list if d['is_active']]
-        all_devices = user_device_list
+        if random.random() < 0.8 and active_devices:
+            device = random.choice(active_devices)
+        else:
+            device = random.choice(all_devices)
         
-        if not all_devices:
-            continue
+        device_id = device['device_id']
         
-        days_since_reg = (date.today() - reg_date).days
-        if days_since_reg <= 0:
-            continue
+        start_time = HISTORY_START + timedelta(
+            days=random.randint(0, HISTORY_DAYS - 1),
+            hours=random.randint(0, 23),
+            minutes=random.randint(0, 59)
+        )
         
-        activity_level = random.choices(['low', 'medium', 'high'], weights=[0.3, 0.5, 0.2])[0]
+        viewed_percentage = generate_viewed_percentage()
         
-        if activity_level == 'low':
-            num_views = random.randint(5, 15)
-        elif activity_level == 'medium':
-            num_views = random.randint(15, 40)
+        if viewed_percentage == 100:
+            end_time = start_time + timedelta(minutes=movie_duration)
+        elif viewed_percentage == 0:
+            end_time = start_time + timedelta(minutes=random.randint(1, 5))
         else:
-            num_views = random.randint(40, 80)
+            watched_minutes = int((viewed_percentage / 100) * movie_duration)
+            end_time = start_time + timedelta(minutes=watched_minutes)
+        
+        current_time = datetime.now()
+        if end_time > current_time:
+            end_time = current_time - timedelta(hours=1)
         
-        num_views = min(num_views, days_since_reg * 2)
+        if end_time <= start_time:
+            end_time = start_time + timedelta(minutes=1)
         
-        for _ in range(num_views):
-            movie = random.choice(movies_data)
-            movie_id = movie['movie_id']
-            movie_duration = movie_durations.get(movie_id, 120)
-            
-            if movie_duration is None:
-                movie_duration = 120
-            
-            if random.random() < 0.8 and active_devices:
-                device = random.choice(active_devices)
-            else:
-                device = random.choice(all_devices)
-            
-            device_id = device['device_id']
-            
-            start_time = datetime(2024, 1, 1) + timedelta(
-                days=random.randint(0, 364),
-                hours=random.randint(0, 23),
-                minutes=random.randint(0, 59)
-            )
-            
-            viewed_percentage = generate_viewed_percentage()
-            
-            if viewed_percentage == 100:
-                end_time = start_time + timedelta(minutes=movie_duration)
-            elif viewed_percentage == 0:
-                end_time = start_time + timedelta(minutes=random.randint(1, 5))
-            else:
-                watched_minutes = int((viewed_percentage / 100) * movie_duration)
-                end_time = start_time + timedelta(minutes=watched_minutes)
-            
-            current_time = datetime.now()
-            if end_time > current_time:
-                end_time = current_time - timedelta(hours=1)
-            
-            if end_time <= start_time:
-                end_time = start_time + timedelta(minutes=1)
-            
-            viewing_history_data.append({
-                'user_id': user_id,
-                'movie_id': movie_id,
-                'device_id': device_id,
-                'start_time': start_time,
-                'end_time': end_time,
-                'viewed_percentage': viewed_percentage
-            })
-    
-    viewing_history_data.sort(key=lambda x: x['start_time'])
+        user_history.append({
+            'user_id': user_id,
+            'movie_id': movie_id,
+            'device_id': device_id,
+            'start_time': start_time,
+            'end_time': end_time,
+            'viewed_percentage': viewed_percentage
+        })
     
-    return viewing_history_data
+    return user_history
+
+def merge_by_start_time(batches, run_size=RUN_SIZE, fan_in=MERGE_FAN_IN):
+    # внешняя сортировка: отсортированные серии по run_size записей сбрасываются
+    # во временные файлы и сливаются heapq.merge не больше fan_in за раз, поэтому
+    # открытых файлов и блоков в памяти не больше fan_in на уровень слияния
+    levels = []
+    buffer = []
+    for batch in batches:
+        buffer.extend(batch)
+        if len(buffer) >= run_size:
+            _add_run(levels, _write_run(buffer), fan_in)
+            buffer = []
+    
+    buffer.sort(key=_start_time_key)
+    if not levels:
+        yield from buffer
+        return
+    
+    if buffer:
+        _add_run(levels, _write_run(buffer), fan_in)
+    
+    runs = [run for level in levels for run in level]
+    while len(runs) > fan_in:
+        runs = [_spill(_merge_runs(runs[:fan_in]))] + runs[fan_in:]
+    
+    yield from _merge_runs(runs)
+
+def _add_run(levels, run, fan_in, level=0):
+    # когда на уровне набирается fan_in серий, они сливаются в одну серию следующего уровня
+    while True:
+        if len(levels) == level:
+            levels.append([])
+        levels[level].append(run)
+        if len(levels[level]) < fan_in:
+            return
+        run = _spill(_merge_runs(levels[level]))
+        levels[level] = []
+        level += 1
+
+def _merge_runs(runs):
+    return heapq.merge(*(_read_run(run) for run in runs), key=_start_time_key)
+
+def _start_time_key(record):
+    return record['start_time']
+
+def _write_run(records):
+    records.sort(key=_start_time_key)
+    return _spill(records)
+
+def _spill(records):
+    # records уже упорядочены; пишутся блоками по RUN_BLOCK_SIZE
+    run = tempfile.TemporaryFile()
+    records = iter(records)
+    while block := list(islice(records, RUN_BLOCK_SIZE)):
+        pickle.dump(block, run, pickle.HIGHEST_PROTOCOL)
+    run.seek(0)
+    return run
+
+def _read_run(run):
+    try:
+        while True:
+            try:
+                block = pickle.load(run)
+            except EOFError:
+                return
+            yield from block
+    finally:
+        run.close()
 
 def generate_viewed_percentage():
     category = random.choices(
@@ -0,0 +1,144 @@
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from generate_viewing_history import HISTORY_START as FIRST_VIEW, HISTORY_DAYS
+
+COLUMNS = ('user_id', 'movie_id', 'device_id', 'start_time', 'end_time', 'viewed_percentage')
+
+ACTIVITY_WEIGHTS = [0.3, 0.5, 0.2]
+ACTIVITY_LOW = np.array([5, 15, 40])
+ACTIVITY_HIGH = np.array([15, 40, 80])
+
+PERCENTAGE_WEIGHTS = [0.4, 0.2, 0.15, 0.25]
+DEFAULT_DURATION = 120
+HISTORY_START = np.datetime64(FIRST_VIEW, 's')
+
+
+class _DeviceLookup:
+    # CSR-представление: устройства отсортированы по user_id, для каждого
+    # пользователя известны смещение первого устройства и их количество
+    def __init__(self, devices_data):
+        user_ids = np.array([device['user_id'] for device in devices_data], dtype=np.int64)
+        ids = np.array([device['device_id'] for device in devices_data], dtype=np.int64)
+        order = np.argsort(user_ids, kind='stable')
+        self._user_ids = user_ids[order]
+        self._ids = ids[order]
+
+    def lookup(self, user_ids):
+        starts = np.searchsorted(self._user_ids, user_ids, side='left')
+        counts = np.searchsorted(self._user_ids, user_ids, side='right') - starts
+        return self._ids, starts, counts
+
+
+def _pick(ids, starts, counts, uniform):
+    if len(ids) == 0:
+        return np.zeros(len(starts), dtype=np.int64)
+
+    # для пользователей без устройств значение отбрасывается, но индекс должен быть допустимым
+    offsets = np.minimum((uniform * counts).astype(np.int64), np.maximum(counts - 1, 0))
+    return ids[np.minimum(starts + offsets, len(ids) - 1)]
+
+
+def generate_viewing_history_columns(users_data, movies_data, devices_data, seed=None, batch_size=100000):
+    rng = np.random.default_rng(seed)
+
+    movie_ids = np.array([movie['movie_id'] for movie in movies_data], dtype=np.int64)
+    movie_durations = np.array([movie.get('duration_minutes') or DEFAULT_DURATION for movie in movies_data], dtype=np.int64)
+
+    all_devices = _DeviceLookup(devices_data)
+    active_devices = _DeviceLookup([device for device in devices_data if device['is_active']])
+
+    today = date.today().toordinal()
+    latest_end = np.datetime64(datetime.now().replace(microsecond=0) - timedelta(hours=1), 's')
+
+    for batch_start in range(0, len(users_data), batch_size):
+        users = users_data[batch_start:batch_start + batch_size]
+        user_ids = np.array([user['user_id'] for user in users], dtype=np.int64)
+        days_since_reg = today - np.array([user['registration_date'].toordinal() for user in users], dtype=np.int64)
+
+        all_ids, all_starts, all_counts = all_devices.lookup(user_ids)
+        active_ids, active_starts, active_counts = active_devices.lookup(user_ids)
+
+        activity_level = rng.choice(3, size=len(users), p=ACTIVITY_WEIGHTS)
+        num_views = rng.integers(ACTIVITY_LOW[activity_level], ACTIVITY_HIGH[activity_level] + 1)
+        num_views = np.minimum(num_views, days_since_reg * 2)
+        num_views[(all_counts == 0) | (days_since_reg <= 0)] = 0
+
+        view_user = np.repeat(np.arange(len(users)), num_views)
+        total = len(view_user)
+        if total == 0:
+            continue
+
+        movie_index = rng.integers(0, len(movie_ids), size=total)
+        durations = movie_durations[movie_index]
+
+        use_active = (rng.random(total) < 0.8) & (active_counts[view_user] > 0)
+        device_uniform = rng.random(total)
+        device_id = np.where(
+            use_active,
+            _pick(active_ids, active_starts[view_user], active_counts[view_user], device_uniform),
+            _pick(all_ids, all_starts[view_user], all_counts[view_user], device_uniform),
+        )
+
+        start_minutes = (rng.integers(0, HISTORY_DAYS, size=total) * 1440
+                         + rng.integers(0, 24, size=total) * 60
+                         + rng.integers(0, 60, size=total))
+        start_time = HISTORY_START + (start_minutes * 60).astype('timedelta64[s]')
+
+        category = rng.choice(4, size=total, p=PERCENTAGE_WEIGHTS)
+        viewed_percentage = np.select(
+            [category == 0, category == 1, category == 2],
+            [100, rng.integers(80, 100, size=total), rng.integers(40, 80, size=total)],
+            rng.integers(0, 40, size=total),
+        )
+
+        watched_minutes = np.select(
+            [viewed_percentage == 100, viewed_percentage == 0],
+            [durations, rng.integers(1, 6, size=total)],
+            np.floor(viewed_percentage / 100 * durations).astype(np.int64),
+        )
+        end_time = start_time + (watched_minutes * 60).astype('timedelta64[s]')
+        end_time = np.where(end_time > latest_end, latest_end, end_time)
+        end_time = np.where(end_time <= start_time, start_time + np.timedelta64(60, 's'), end_time)
+
+        yield {
+            'user_id': user_ids[view_user],
+            'movie_id': movie_ids[movie_index],
+            'device_id': device_id,
+            'start_time': start_time,
+            'end_time': end_time,
+            'viewed_percentage': viewed_percentage,
+        }
+
+
+def columns_to_copy_text(batch, columns=COLUMNS):
+    formatted = []
+    for column in columns:
+        values = batch[column]
+        if np.issubdtype(values.dtype, np.datetime64):
+            formatted.append(np.datetime_as_string(values, unit='s'))
+        else:
+            formatted.append(values.astype(str))
+
+    return '\n'.join(map('\t'.join, zip(*formatted))) + '\n'
+
+
+if __name__ == "__main__":
+    sample_users = [
+        {'user_id': 1, 'registration_date': date(2023, 1, 15)},
+        {'user_id': 2, 'registration_date': date(2024, 6, 10)},
+    ]
+    sample_movies = [
+        {'movie_id': 1, 'title': 'Movie 1', 'duration_minutes': 120},
+        {'movie_id': 2, 'title': 'Movie 2', 'duration_minutes': 90},
+        {'movie_id': 3, 'title': 'Movie 3', 'duration_minutes': None},
+    ]
+    sample_devices = [
+        {'device_id': 1, 'user_id': 1, 'is_active': True},
+        {'device_id': 2, 'user_id': 1, 'is_active': False},
+        {'device_id': 3, 'user_id': 2, 'is_active': True},
+    ]
+
+    for batch in generate_viewing_history_columns(sample_users, sample_movies, sample_devices, seed=1):
+        print(columns_to_copy_text(batch)[:300])
@@ -0,0 +1,131 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+
+from psycopg2.pool import ThreadedConnectionPool
+
+from copy_loader import (
+    DEFAULT_CHUNK_SIZE, USERS_COLUMNS, PAYMENT_METHODS_COLUMNS, MOVIES_COLUMNS_WITH_ID,
+    DEVICES_COLUMNS_WITH_ID, VIEWING_HISTORY_COLUMNS, dict_rows, copy_table,
+)
+from partitions import copy_viewing_history, copy_viewing_history_columns
+
+# Внешние ключи из alter.sql: таблица загружается только после тех, на которые ссылается
+TABLE_DEPENDENCIES = {
+    'users': (),
+    'movies': (),
+    'payment_methods': ('users',),
+    'devices': ('users',),
+    'viewing_history': ('users', 'movies', 'devices'),
+}
+
+
+class LoadPipeline:
+    def __init__(self, db_params, max_connections=4, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.max_connections = max_connections
+        self.chunk_size = chunk_size
+        self.pool = ThreadedConnectionPool(1, max_connections, **db_params)
+        self.timings = {}
+
+    def close(self):
+        self.pool.closeall()
+
+    @contextmanager
+    def connection(self):
+        conn = self.pool.getconn()
+        try:
+            yield conn
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn)
+
+    def truncate(self, tables=tuple(TABLE_DEPENDENCIES)):
+        with self.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(f"TRUNCATE TABLE {', '.join('cinema.' + table for table in tables)} CASCADE")
+            conn.commit()
+        print(f"Таблицы успешно очищены")
+
+    def run(self, stages, dependencies=TABLE_DEPENDENCIES):
+        # stages: имя таблицы -> функция(conn), возвращающая число загруженных строк.
+        # Этап запускается, как только загружены все таблицы, от которых он зависит.
+        pending = dict(stages)
+        done = set()
+        failed = set()
+        running = {}
+        started = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=self.max_connections) as executor:
+            while pending or running:
+                for name in list(pending):
+                    deps = [dep for dep in dependencies.get(name, ()) if dep in stages]
+                    if any(dep in failed for dep in deps):
+                        print(f"Этап {name} пропущен: не загружены зависимости")
+                        failed.add(name)
+                        del pending[name]
+                    elif all(dep in done for dep in deps):
+                        running[executor.submit(self._run_stage, name, pending.pop(name), started)] = name
+
+                if not running:
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        future.result()
+                        done.add(name)
+                    except Exception as e:
+                        print(f"Ошибка при загрузке {name}: {e}")
+                        failed.add(name)
+
+        self.report(time.perf_counter() - started)
+        return not failed
+
+    def _run_stage(self, name, stage, pipeline_started):
+        stage_started = time.perf_counter()
+        with self.connection() as conn:
+            rows = stage(conn)
+        finished = time.perf_counter()
+        self.timings[name] = {
+            'start': stage_started - pipeline_started,
+            'seconds': finished - stage_started,
+            'rows': rows,
+        }
+
+    def report(self, wall_seconds):
+        print("\nЭтап               старт, с   время, с      строк")
+        for name, timing in sorted(self.timings.items(), key=lambda item: item[1]['start']):
+            print(f"{name:<18} {timing['start']:>8.2f} {timing['seconds']:>10.2f} {timing['rows']:>10}")
+        total = sum(timing['seconds'] for timing in self.timings.values())
+        print(f"Общее время {wall_seconds:.2f} с (сумма этапов {total:.2f} с)")
+
+
+def load_generated_data(pipeline, users_data, payment_methods_data, movies_data, devices_data,
+                        viewing_history_data, to_text=None):
+    # id фильмов и устройств уже назначены на клиенте (reserve_db_ids), поэтому
+    # независимые таблицы не ждут друг друга. Если передан to_text, история
+    # просмотров - колоночные пачки векторизованного генератора.
+    chunk_size = pipeline.chunk_size
+
+    def viewing_history_stage(conn):
+        # секционированная история копируется прямо в месячные секции
+        if to_text is not None:
+            return copy_viewing_history_columns(conn, viewing_history_data, to_text)
+        return copy_viewing_history(conn, dict_rows(viewing_history_data, VIEWING_HISTORY_COLUMNS), chunk_size)
+
+    stages = {
+        'users': lambda conn: copy_table(conn, 'cinema.users', USERS_COLUMNS,
+                                         dict_rows(users_data, USERS_COLUMNS), chunk_size),
+        'movies': lambda conn: copy_table(conn, 'cinema.movies', MOVIES_COLUMNS_WITH_ID,
+                                          dict_rows(movies_data, MOVIES_COLUMNS_WITH_ID), chunk_size),
+        'payment_methods': lambda conn: copy_table(conn, 'cinema.payment_methods', PAYMENT_METHODS_COLUMNS,
+                                                   dict_rows(payment_methods_data, PAYMENT_METHODS_COLUMNS), chunk_size),
+        'devices': lambda conn: copy_table(conn, 'cinema.devices', DEVICES_COLUMNS_WITH_ID,
+                                           dict_rows(devices_data, DEVICES_COLUMNS_WITH_ID), chunk_size),
+        'viewing_history': viewing_history_stage,
+    }
+
+    return pipeline.run(stages)
@@ -0,0 +1,167 @@
+import csv
+import mmap
+import os
+import struct
+import tempfile
+
+# Формат кэша: заголовок, массив смещений (row_count + 1 чисел uint64) и блок записей.
+# Запись - уже нормализованные поля фильма в utf-8, разделённые FIELD_SEPARATOR.
+MAGIC = b'MOVCAT01'
+HEADER = struct.Struct('<8sQqQ')
+OFFSET = struct.Struct('<Q')
+FIELD_SEPARATOR = '\x1f'
+NULL = '\\N'
+
+FIELDS = ('title', 'director', 'release_year', 'genres', 'duration_minutes', 'imdb_rating')
+
+_catalogs = {}
+
+
+def parse_movie(movie):
+    title = movie.get('title', '').strip()
+    director = movie.get('director', '').strip()
+
+    release_year = movie.get('release_year')
+    if release_year == '\\N':
+        release_year = None
+    else:
+        release_year = int(release_year)
+
+    duration_minutes = movie.get('duration_minutes')
+    if duration_minutes == '\\N':
+        duration_minutes = None
+    else:
+        duration_minutes = int(duration_minutes)
+
+    imdb_rating = movie.get('imdb_rating')
+    if imdb_rating == '\\N':
+        imdb_rating = None
+    else:
+        imdb_rating = float(imdb_rating)
+
+    genres = movie.get('genres')
+    if genres == '\\N':
+        genres = None
+    else:
+        genres = ', '.join([g.strip().lower() for g in movie['genres'].split(',') if g.strip()])
+
+    return {
+        'title': title,
+        'director': director,
+        'release_year': release_year,
+        'genres': genres,
+        'duration_minutes': duration_minutes,
+        'imdb_rating': imdb_rating
+    }
+
+
+def _encode_movie(movie):
+    fields = [NULL if movie[field] is None else str(movie[field]).replace(FIELD_SEPARATOR, ' ') for field in FIELDS]
+    return FIELD_SEPARATOR.join(fields).encode('utf-8')
+
+
+def _decode_movie(record):
+    title, director, release_year, genres, duration_minutes, imdb_rating = record.decode('utf-8').split(FIELD_SEPARATOR)
+    return {
+        'title': title,
+        'director': director,
+        'release_year': None if release_year == NULL else int(release_year),
+        'genres': None if genres == NULL else genres,
+        'duration_minutes': None if duration_minutes == NULL else int(duration_minutes),
+        'imdb_rating': None if imdb_rating == NULL else float(imdb_rating)
+    }
+
+
+def catalog_path(csv_file_path):
+    return os.path.splitext(csv_file_path)[0] + '.catalog'
+
+
+def build_catalog(csv_file_path, cache_file_path):
+    source = os.stat(csv_file_path)
+    # временные файлы с уникальными именами рядом с кэшем: параллельные сборки
+    # не пишут в один файл, а os.replace остаётся в пределах одной файловой системы
+    directory = os.path.dirname(os.path.abspath(cache_file_path))
+    records_fd, records_path = tempfile.mkstemp(dir=directory, suffix='.records.tmp')
+    tmp_fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    offsets = [0]
+
+    try:
+        with open(csv_file_path, 'r', encoding='utf-8') as file, open(records_fd, 'wb') as records:
+            for movie in csv.DictReader(file):
+                try:
+                    record = _encode_movie(parse_movie(movie))
+                except (ValueError, KeyError, TypeError) as e:
+                    print(f"Warning: Skipping movie '{movie.get('title', 'Unknown')}' due to data error: {e}")
+                    continue
+                records.write(record)
+                offsets.append(offsets[-1] + len(record))
+
+        with open(tmp_fd, 'wb') as cache, open(records_path, 'rb') as records:
+            cache.write(HEADER.pack(MAGIC, source.st_size, source.st_mtime_ns, len(offsets) - 1))
+            for offset in offsets:
+                cache.write(OFFSET.pack(offset))
+            while chunk := records.read(1 << 20):
+                cache.write(chunk)
+
+        # переименование атомарно, параллельные процессы видят либо старый, либо готовый кэш
+        os.replace(tmp_path, cache_file_path)
+    finally:
+        os.remove(records_path)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class MovieCatalog:
+    def __init__(self, cache_file_path):
+        with open(cache_file_path, 'rb') as file:
+            self._data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.source_size, self.source_mtime_ns, self.row_count = HEADER.unpack_from(self._data, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Unknown movie catalog format: {cache_file_path}")
+
+        self._offsets_start = HEADER.size
+        self._records_start = HEADER.size + OFFSET.size * (self.row_count + 1)
+
+    def __len__(self):
+        return self.row_count
+
+    def _offset(self, index):
+        return OFFSET.unpack_from(self._data, self._offsets_start + OFFSET.size * index)[0]
+
+    def get(self, index):
+        start = self._records_start + self._offset(index)
+        end = self._records_start + self._offset(index + 1)
+        return _decode_movie(self._data[start:end])
+
+    def is_fresh(self, csv_file_path):
+        source = os.stat(csv_file_path)
+        return source.st_size == self.source_size and source.st_mtime_ns == self.source_mtime_ns
+
+
+def load_catalog(csv_file_path):
+    catalog = _catalogs.get(csv_file_path)
+    if catalog is not None and catalog.is_fresh(csv_file_path):
+        return catalog
+
+    cache_file_path = catalog_path(csv_file_path)
+    catalog = None
+    if os.path.exists(cache_file_path):
+        try:
+            catalog = MovieCatalog(cache_file_path)
+        except (ValueError, struct.error) as e:
+            print(f"Warning: Rebuilding movie catalog: {e}")
+
+    if catalog is None or not catalog.is_fresh(csv_file_path):
+        build_catalog(csv_file_path, cache_file_path)
+        catalog = MovieCatalog(cache_file_path)
+
+    _catalogs[csv_file_path] = catalog
+    return catalog
+
+
+if __name__ == "__main__":
+    csv_file_path = os.path.join(os.path.dirname(__file__), 'data', 'movies.csv')
+    catalog = load_catalog(csv_file_path)
+    print(f"{len(catalog)} movies in {catalog_path(csv_file_path)}")
+    print(catalog.get(0))
@@ -0,0 +1,175 @@
+import bisect
+import io
+import time
+from datetime import timedelta
+
+import numpy as np
+
+from copy_loader import (
+    DEFAULT_CHUNK_SIZE, VIEWING_HISTORY_COLUMNS, format_copy_value, report_rate, copy_table, copy_column_batches,
+)
+from generate_viewing_history import HISTORY_START, HISTORY_DAYS
+
+# cinema.viewing_history может быть секционирована по месяцам start_time
+# (sql_scripts/partition.sql). Тогда строки раскладываются по секциям на клиенте
+# и копируются прямо в них: сервер не ищет секцию для каждой строки. Строки
+# месяцев без секции идут через родительскую таблицу в секцию по умолчанию
+# и после загрузки переносятся в собственные секции.
+VIEWING_HISTORY = 'cinema.viewing_history'
+
+# период, который покрывают сгенерированные просмотры
+GENERATED_PERIOD = (HISTORY_START, HISTORY_START + timedelta(days=HISTORY_DAYS))
+
+IS_PARTITIONED_QUERY = "SELECT relkind = 'p' FROM pg_class WHERE oid = %s::regclass"
+HAS_GENRE_STATISTICS_QUERY = "SELECT to_regprocedure('cinema.fold_genre_statistics(integer)') IS NOT NULL"
+PARTITIONS_QUERY = "SELECT partition_name::text, range_start, range_end FROM cinema.viewing_history_partitions()"
+
+
+def is_partitioned(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(IS_PARTITIONED_QUERY, (VIEWING_HISTORY,))
+        partitioned = cursor.fetchone()[0]
+    conn.commit()
+    return partitioned
+
+
+def prepare_partitions(conn, period=GENERATED_PERIOD):
+    # отдельная короткая транзакция: создание секции блокирует родительскую
+    # таблицу, и держать блокировку всё время загрузки незачем
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM cinema.create_viewing_history_partitions(%s, %s)", period)
+        cursor.execute("SELECT count(*) FROM cinema.create_upcoming_viewing_history_partitions()")
+    conn.commit()
+
+
+def split_default_partition(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT partition_name FROM cinema.split_viewing_history_default() AS partition_name")
+        created = [row[0] for row in cursor.fetchall()]
+    conn.commit()
+    if created:
+        print(f"Строки перенесены из секции по умолчанию в {len(created)} новых секций")
+
+
+def fold_aggregates(conn):
+    # без pg_cron изменения, накопленные триггерами агрегатов по жанрам
+    # (lab_06/aggregates.sql), переносятся в конце каждой загрузки
+    with conn.cursor() as cursor:
+        cursor.execute(HAS_GENRE_STATISTICS_QUERY)
+        if cursor.fetchone()[0]:
+            cursor.execute("SELECT cinema.fold_genre_statistics()")
+    conn.commit()
+
+
+def finish_load(conn, split_default=True):
+    # COPY в секцию не вызывает триггеры уровня оператора родительской таблицы,
+    # поэтому зависящие от истории агрегаты пересчитываются целиком
+    if split_default:
+        split_default_partition(conn)
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT cinema.refresh_viewing_history_dependents()")
+    conn.commit()
+    fold_aggregates(conn)
+
+
+class PartitionRouter:
+    def __init__(self, cursor, columns=VIEWING_HISTORY_COLUMNS, chunk_size=DEFAULT_CHUNK_SIZE):
+        cursor.execute(PARTITIONS_QUERY)
+        partitions = cursor.fetchall()
+        self.cursor = cursor
+        self.columns = columns
+        self.chunk_size = chunk_size
+        self.names = [name for name, _, _ in partitions]
+        self.starts = [start for _, start, _ in partitions]
+        self.ends = [end for _, _, end in partitions]
+        self.key_index = columns.index('start_time')
+        self.buffers = {}
+        self.buffered = 0
+        self.counts = {}
+
+    def partition(self, start_time):
+        index = bisect.bisect_right(self.starts, start_time) - 1
+        if index >= 0 and start_time < self.ends[index]:
+            return self.names[index]
+        return VIEWING_HISTORY
+
+    def add(self, row):
+        self.buffers.setdefault(self.partition(row[self.key_index]), []).append(
+            '\t'.join(format_copy_value(value) for value in row)
+        )
+        self.buffered += 1
+        # порог общий для всех секций, поэтому память не растёт с их числом
+        if self.buffered >= self.chunk_size:
+            self.flush()
+
+    def add_columns(self, batch, to_text):
+        # колоночная пачка делится по месяцам; секции помесячные, поэтому
+        # все строки месяца попадают в одну секцию
+        months = batch['start_time'].astype('datetime64[M]')
+        for month in np.unique(months):
+            mask = months == month
+            part = {column: values[mask] for column, values in batch.items()}
+            self.write(self.partition(month.astype('datetime64[s]').item()), to_text(part, self.columns),
+                       int(mask.sum()))
+
+    def flush(self):
+        for name, lines in self.buffers.items():
+            self.write(name, '\n'.join(lines) + '\n', len(lines))
+        self.buffers = {}
+        self.buffered = 0
+
+    def write(self, name, text, count):
+        self.cursor.copy_expert(f"COPY {name} ({', '.join(self.columns)}) FROM STDIN", io.StringIO(text))
+        self.counts[name] = self.counts.get(name, 0) + count
+
+    def total(self):
+        return sum(self.counts.values())
+
+
+def _copy_routed(conn, fill, chunk_size, period, finish, columns=VIEWING_HISTORY_COLUMNS):
+    if period is not None:
+        prepare_partitions(conn, period)
+
+    started = time.perf_counter()
+    with conn.cursor() as cursor:
+        router = PartitionRouter(cursor, columns, chunk_size)
+        fill(router)
+        router.flush()
+    conn.commit()
+    count = router.total()
+    report_rate(f"{VIEWING_HISTORY} ({len(router.counts)} секций)", count, time.perf_counter() - started)
+
+    # параллельные загрузки (generate_sharded.py) вызывают finish_load один раз в конце
+    if finish:
+        finish_load(conn, VIEWING_HISTORY in router.counts)
+    return count
+
+
+def copy_viewing_history(conn, rows, chunk_size=DEFAULT_CHUNK_SIZE, period=GENERATED_PERIOD, finish=True,
+                         columns=VIEWING_HISTORY_COLUMNS):
+    # rows - кортежи в порядке columns
+    if not is_partitioned(conn):
+        count = copy_table(conn, VIEWING_HISTORY, columns, rows, chunk_size)
+        if finish:
+            fold_aggregates(conn)
+        return count
+
+    def fill(router):
+        for row in rows:
+            router.add(row)
+
+    return _copy_routed(conn, fill, chunk_size, period, finish, columns)
+
+
+def copy_viewing_history_columns(conn, batches, to_text, period=GENERATED_PERIOD, finish=True):
+    if not is_partitioned(conn):
+        count = copy_column_batches(conn, VIEWING_HISTORY, VIEWING_HISTORY_COLUMNS, batches, to_text)
+        if finish:
+            fold_aggregates(conn)
+        return count
+
+    def fill(router):
+        for batch in batches:
+            router.add_columns(batch, to_text)
+
+    return _copy_routed(conn, fill, DEFAULT_CHUNK_SIZE, period, finish)
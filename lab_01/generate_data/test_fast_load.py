@@ -0,0 +1,26 @@
+from fast_load import index_statement
+
+
+def test_partitioned_index_is_built_on_partitions():
+    # определение, которое CAPTURE_INDEXES_QUERY сохраняет для секционированной viewing_history
+    captured = "CREATE INDEX viewing_history_start_time_idx ON ONLY cinema.viewing_history USING btree (start_time)"
+
+    assert index_statement(captured) == (
+        "CREATE INDEX IF NOT EXISTS viewing_history_start_time_idx ON cinema.viewing_history USING btree (start_time)"
+    )
+
+
+def test_unique_partitioned_index():
+    captured = "CREATE UNIQUE INDEX users_email_idx ON ONLY cinema.users USING btree (email)"
+
+    assert index_statement(captured) == (
+        "CREATE UNIQUE INDEX IF NOT EXISTS users_email_idx ON cinema.users USING btree (email)"
+    )
+
+
+def test_plain_table_index_unchanged():
+    captured = "CREATE INDEX devices_user_id_idx ON cinema.devices USING btree (user_id)"
+
+    assert index_statement(captured) == (
+        "CREATE INDEX IF NOT EXISTS devices_user_id_idx ON cinema.devices USING btree (user_id)"
+    )
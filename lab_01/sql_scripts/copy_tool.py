@@ -0,0 +1,291 @@
+import argparse
+import glob
+import gzip
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DB_PARAMS = {
+    'host': 'localhost',
+    'database': 'streaming_service',
+    'user': 'postgres',
+    'password': 'postgres',
+    'port': '5432'
+}
+
+# Таблицы одной волны не ссылаются друг на друга и загружаются параллельно,
+# следующая волна начинается после загрузки предыдущей (внешние ключи из alter.sql)
+IMPORT_WAVES = (
+    ('users', 'movies'),
+    ('devices', 'payment_methods'),
+    ('viewing_history',),
+)
+TABLES = tuple(table for wave in IMPORT_WAVES for table in wave)
+
+# большие таблицы делятся на диапазоны ключа, каждый диапазон - отдельный файл и COPY
+CHUNKED_TABLES = {'viewing_history': 'view_id'}
+
+SERIAL_COLUMNS = {
+    'users': 'user_id',
+    'movies': 'movie_id',
+    'devices': 'device_id',
+    'payment_methods': 'payment_method_id',
+    'viewing_history': 'view_id',
+}
+
+EXTENSIONS = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}
+
+COPY_OPTIONS = "(FORMAT csv, HEADER true, DELIMITER ',', ENCODING 'utf8')"
+
+# Каждый файл импортируется в своей транзакции, чтобы файлы загружались
+# параллельно. Загруженный файл записывается в журнал в той же транзакции,
+# что и COPY, поэтому после сбоя повторный запуск пропускает загруженные файлы
+# и не дублирует строки. Журнал очищается после успешного импорта.
+IMPORT_JOURNAL = 'cinema.copy_tool_imports'
+
+CREATE_JOURNAL_QUERY = f"""
+    CREATE TABLE IF NOT EXISTS {IMPORT_JOURNAL} (
+        file_name TEXT PRIMARY KEY,
+        file_size BIGINT NOT NULL,
+        row_count BIGINT NOT NULL,
+        imported_at TIMESTAMP NOT NULL DEFAULT now()
+    )
+"""
+
+
+class CountingFile:
+    # считает несжатые байты, прошедшие через COPY
+    def __init__(self, file):
+        self.file = file
+        self.bytes = 0
+
+    def write(self, data):
+        self.bytes += len(data)
+        return self.file.write(data)
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        self.bytes += len(data)
+        return data
+
+    def readline(self, size=-1):
+        data = self.file.readline(size)
+        self.bytes += len(data)
+        return data
+
+
+def open_stream(path, mode, compress):
+    if compress == 'gzip':
+        return gzip.open(path, mode + 'b')
+    if compress == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("Для сжатия zstd нужен пакет zstandard")
+        raw = open(path, mode + 'b')
+        if mode == 'w':
+            return zstandard.ZstdCompressor().stream_writer(raw, closefd=True)
+        return zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+    return open(path, mode + 'b')
+
+
+def compression_of(path):
+    for compress, extension in EXTENSIONS.items():
+        if extension and path.endswith(extension):
+            return compress
+    return 'none'
+
+
+def report(action, name, rows, size, elapsed):
+    elapsed = max(elapsed, 1e-9)
+    print(f"{action} {name}: {rows} строк, {size / 2 ** 20:.1f} МБ за {elapsed:.2f} с "
+          f"({size / 2 ** 20 / elapsed:.1f} МБ/с, {rows / elapsed:.0f} строк/с)")
+
+
+def key_ranges(conn, table, key, chunks):
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT min({key}), max({key}) FROM cinema.{table}")
+        low, high = cursor.fetchone()
+    if low is None:
+        return [(None, None)]
+
+    step = (high - low) // chunks + 1
+    return [(start, start + step) for start in range(low, high + 1, step)]
+
+
+def export_file(table, path, compress, key=None, key_range=(None, None)):
+    # COPY TO из секционированной таблицы (viewing_history после partition.sql)
+    # не поддерживается, поэтому источник всегда запрос
+    source = f"(SELECT * FROM cinema.{table})"
+    if key is not None and key_range[0] is not None:
+        source = f"(SELECT * FROM cinema.{table} WHERE {key} >= {int(key_range[0])} AND {key} < {int(key_range[1])})"
+
+    started = time.perf_counter()
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        with open_stream(path, 'w', compress) as stream, conn.cursor() as cursor:
+            counter = CountingFile(stream)
+            cursor.copy_expert(f"COPY {source} TO STDOUT WITH {COPY_OPTIONS}", counter)
+            rows = cursor.rowcount
+    finally:
+        conn.close()
+
+    report("Экспорт", os.path.basename(path), rows, counter.bytes, time.perf_counter() - started)
+    return rows, counter.bytes
+
+
+def import_file(table, path):
+    started = time.perf_counter()
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        with open_stream(path, 'r', compression_of(path)) as stream, conn.cursor() as cursor:
+            counter = CountingFile(stream)
+            cursor.copy_expert(f"COPY cinema.{table} FROM STDIN WITH {COPY_OPTIONS}", counter)
+            rows = cursor.rowcount
+            cursor.execute(f"INSERT INTO {IMPORT_JOURNAL} (file_name, file_size, row_count) VALUES (%s, %s, %s)",
+                           (os.path.basename(path), os.path.getsize(path), rows))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    report("Импорт", os.path.basename(path), rows, counter.bytes, time.perf_counter() - started)
+    return rows, counter.bytes
+
+
+def table_files(directory, table):
+    return sorted(glob.glob(os.path.join(directory, f"{table}.csv*")) +
+                  glob.glob(os.path.join(directory, f"{table}.part*.csv*")))
+
+
+def run_tasks(tasks, jobs):
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(function, *args) for function, args in tasks]
+        return [future.result() for future in futures]
+
+
+def export_tables(directory, compress='none', chunks=4, jobs=4):
+    os.makedirs(directory, exist_ok=True)
+    extension = EXTENSIONS[compress]
+
+    tasks = []
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        for table in TABLES:
+            for old_file in table_files(directory, table):
+                os.remove(old_file)
+
+            key = CHUNKED_TABLES.get(table)
+            if key is None or chunks <= 1:
+                tasks.append((export_file, (table, os.path.join(directory, f"{table}.csv{extension}"), compress)))
+                continue
+
+            for part, key_range in enumerate(key_ranges(conn, table, key, chunks)):
+                path = os.path.join(directory, f"{table}.part{part:03d}.csv{extension}")
+                tasks.append((export_file, (table, path, compress, key, key_range)))
+    finally:
+        conn.close()
+
+    started = time.perf_counter()
+    results = run_tasks(tasks, jobs)
+    report("Экспорт", "всего", sum(r[0] for r in results), sum(r[1] for r in results), time.perf_counter() - started)
+
+
+def sync_sequences():
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        with conn.cursor() as cursor:
+            for table, column in SERIAL_COLUMNS.items():
+                cursor.execute(f"""
+                    SELECT setval(pg_get_serial_sequence('cinema.{table}', '{column}'),
+                                  coalesce(max({column}), 0) + 1, false)
+                    FROM cinema.{table}
+                """)
+            # изменения агрегатов по жанрам (lab_06/aggregates.sql), накопленные
+            # триггерами за время импорта, переносятся сразу, а не по pg_cron
+            cursor.execute("SELECT to_regprocedure('cinema.fold_genre_statistics(integer)') IS NOT NULL")
+            if cursor.fetchone()[0]:
+                cursor.execute("SELECT cinema.fold_genre_statistics()")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def imported_files():
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(CREATE_JOURNAL_QUERY)
+            cursor.execute(f"SELECT file_name, file_size FROM {IMPORT_JOURNAL}")
+            journal = dict(cursor.fetchall())
+        conn.commit()
+    finally:
+        conn.close()
+    return journal
+
+
+def clear_journal():
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP TABLE {IMPORT_JOURNAL}")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def import_tables(directory, jobs=4):
+    started = time.perf_counter()
+    journal = imported_files()
+    results = []
+    for wave in IMPORT_WAVES:
+        tasks = []
+        for table in wave:
+            for path in table_files(directory, table):
+                name = os.path.basename(path)
+                if name not in journal:
+                    tasks.append((import_file, (table, path)))
+                    continue
+                if journal[name] != os.path.getsize(path):
+                    raise RuntimeError(f"{name} изменился после прерванного импорта, "
+                                       f"удалите загруженные строки и таблицу {IMPORT_JOURNAL}")
+                print(f"Импорт {name}: пропущен, загружен при прошлом запуске")
+        results.extend(run_tasks(tasks, jobs))
+    sync_sequences()
+    clear_journal()
+    report("Импорт", "всего", sum(r[0] for r in results), sum(r[1] for r in results), time.perf_counter() - started)
+
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        with conn.cursor() as cursor:
+            for table in TABLES:
+                cursor.execute(f"SELECT count(*) FROM cinema.{table}")
+                print(f"{table}_count: {cursor.fetchone()[0]}")
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Параллельный импорт и экспорт таблиц cinema через COPY")
+    parser.add_argument('action', choices=['import', 'export'])
+    parser.add_argument('--dir', default='/tmp', help="каталог с csv-файлами")
+    parser.add_argument('--compress', choices=list(EXTENSIONS), default='none', help="сжатие при экспорте")
+    parser.add_argument('--chunks', type=int, default=4, help="число диапазонов ключа для больших таблиц")
+    parser.add_argument('--jobs', type=int, default=4, help="число одновременных соединений")
+    args = parser.parse_args()
+
+    if args.action == 'export':
+        export_tables(args.dir, args.compress, args.chunks, args.jobs)
+    else:
+        import_tables(args.dir, args.jobs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+set search_path to cinema;
+
+-- Секционирование истории просмотров по месяцам start_time.
+-- Выполняется после alter.sql; повторный запуск ничего не меняет.
+-- Секция месяца называется viewing_history_ГГГГ_ММ, строки без своей секции
+-- попадают в viewing_history_default и переносятся в секцию при её создании.
+
+create or replace function cinema.viewing_history_partition_name(p_month timestamp)
+returns text as $$
+    select 'viewing_history_' || to_char(p_month, 'YYYY_MM');
+$$ language sql stable;
+
+-- секции таблицы с границами; секция по умолчанию не входит
+-- (имя родителя - текст: значение regclass по умолчанию запомнило бы oid таблицы)
+create or replace function cinema.viewing_history_partitions(p_parent text default 'cinema.viewing_history')
+returns table (partition_name regclass, range_start timestamp, range_end timestamp) as $$
+    select c.oid::regclass, bounds[1]::timestamp, bounds[2]::timestamp
+    from pg_inherits i
+    join pg_class c on c.oid = i.inhrelid
+    cross join lateral regexp_match(pg_get_expr(c.relpartbound, c.oid), 'FROM \(''(.*)''\) TO \(''(.*)''\)') as bounds
+    where i.inhparent = p_parent::regclass
+      and bounds is not null
+    order by 2;
+$$ language sql stable;
+
+create or replace function cinema.create_viewing_history_partition(p_month timestamp)
+returns regclass as $$
+declare
+    range_start timestamp := date_trunc('month', p_month);
+    range_end timestamp := date_trunc('month', p_month) + interval '1 month';
+    partition_name text := cinema.viewing_history_partition_name(p_month);
+    existing regclass;
+begin
+    -- параллельные загрузчики создают одни и те же секции: проверка и создание
+    -- выполняются под одной блокировкой
+    perform pg_advisory_xact_lock('cinema.viewing_history'::regclass::oid::bigint);
+    existing := to_regclass(format('cinema.%I', partition_name));
+
+    if existing is not null then
+        if not exists (select 1 from pg_inherits
+                       where inhrelid = existing and inhparent = 'cinema.viewing_history'::regclass) then
+            raise exception 'Таблица % существует, но не является секцией cinema.viewing_history', existing;
+        end if;
+        return existing;
+    end if;
+
+    if to_regclass('cinema.viewing_history_default') is not null and exists (
+        select 1 from cinema.viewing_history_default
+        where start_time >= range_start and start_time < range_end
+    ) then
+        -- строки месяца уже лежат в секции по умолчанию: с ними новая секция
+        -- не создаётся, поэтому строки переносятся в отдельную таблицу,
+        -- которая затем подключается
+        execute format('create table cinema.%I (like cinema.viewing_history including defaults including constraints)',
+                       partition_name);
+        execute format('with moved as (
+                            delete from cinema.viewing_history_default
+                            where start_time >= $1 and start_time < $2
+                            returning *
+                        )
+                        insert into cinema.%I select * from moved', partition_name)
+            using range_start, range_end;
+        execute format('alter table cinema.viewing_history attach partition cinema.%I for values from (%L) to (%L)',
+                       partition_name, range_start, range_end);
+    else
+        execute format('create table cinema.%I partition of cinema.viewing_history for values from (%L) to (%L)',
+                       partition_name, range_start, range_end);
+    end if;
+
+    return format('cinema.%I', partition_name)::regclass;
+end;
+$$ language plpgsql;
+
+-- секции всех месяцев, пересекающихся с [p_from, p_to)
+create or replace function cinema.create_viewing_history_partitions(p_from timestamp, p_to timestamp)
+returns setof regclass as $$
+    select cinema.create_viewing_history_partition(month)
+    from generate_series(date_trunc('month', p_from), p_to, interval '1 month') as month
+    where month < p_to
+    order by month;
+$$ language sql;
+
+-- текущий месяц и p_months следующих
+create or replace function cinema.create_upcoming_viewing_history_partitions(p_months integer default 3)
+returns setof regclass as $$
+    select cinema.create_viewing_history_partitions(
+        date_trunc('month', localtimestamp),
+        date_trunc('month', localtimestamp) + make_interval(months => p_months + 1)
+    );
+$$ language sql;
+
+-- Перевод существующей таблицы в секционированную. Первичный ключ секционированной
+-- таблицы обязан содержать ключ секционирования, поэтому он становится (view_id, start_time);
+-- view_id по-прежнему выдаётся последовательностью. Внешние ключи, индексы и триггеры
+-- (в том числе статистики жанров из lab_06) переносятся по определениям старой таблицы.
+do $$
+declare
+    foreign_keys text[];
+    indexes text[];
+    triggers text[];
+    old_name text;
+    definition text;
+    data_from timestamp;
+    data_to timestamp;
+begin
+    if (select relkind from pg_class where oid = 'cinema.viewing_history'::regclass) = 'p' then
+        raise notice 'cinema.viewing_history уже секционирована';
+        return;
+    end if;
+
+    -- определения с полными именами, чтобы они не зависели от search_path
+    perform set_config('search_path', 'pg_catalog', true);
+
+    select coalesce(array_agg(format('alter table cinema.viewing_history add constraint %I %s',
+                                     conname, replace(pg_get_constraintdef(oid), ' NOT VALID', ''))), '{}')
+    into foreign_keys
+    from pg_constraint
+    where conrelid = 'cinema.viewing_history'::regclass and contype = 'f';
+
+    select coalesce(array_agg(pg_get_indexdef(i.indexrelid)), '{}')
+    into indexes
+    from pg_index i
+    where i.indrelid = 'cinema.viewing_history'::regclass
+      and not exists (select 1 from pg_constraint c where c.conindid = i.indexrelid);
+
+    select coalesce(array_agg(pg_get_triggerdef(oid)), '{}')
+    into triggers
+    from pg_trigger
+    where tgrelid = 'cinema.viewing_history'::regclass and not tgisinternal;
+
+    alter table cinema.viewing_history rename to viewing_history_heap;
+
+    -- имена индексов уникальны в схеме, старые освобождают их для новой таблицы
+    for old_name in
+        select c.relname from pg_index i join pg_class c on c.oid = i.indexrelid
+        where i.indrelid = 'cinema.viewing_history_heap'::regclass
+    loop
+        execute format('alter index cinema.%I rename to %I', old_name, left(old_name, 58) || '_heap');
+    end loop;
+
+    create table cinema.viewing_history (like cinema.viewing_history_heap including defaults including constraints)
+        partition by range (start_time);
+    create table cinema.viewing_history_default partition of cinema.viewing_history default;
+
+    -- последовательность иначе удалится вместе со старой таблицей
+    execute format('alter sequence %s owned by cinema.viewing_history.view_id',
+                   pg_get_serial_sequence('cinema.viewing_history_heap', 'view_id'));
+
+    select min(start_time), max(start_time) into data_from, data_to from cinema.viewing_history_heap;
+    if data_from is not null then
+        perform cinema.create_viewing_history_partitions(data_from, data_to + interval '1 second');
+    end if;
+    perform cinema.create_upcoming_viewing_history_partitions();
+
+    insert into cinema.viewing_history select * from cinema.viewing_history_heap;
+
+    alter table cinema.viewing_history add constraint pk_view_id primary key (view_id, start_time);
+    foreach definition in array foreign_keys || indexes || triggers loop
+        execute definition;
+    end loop;
+
+    drop table cinema.viewing_history_heap;
+end $$;
+
+analyze cinema.viewing_history;
+
+-- архив целых месяцев: отсоединённые секции подключаются сюда без копирования строк
+create table if not exists cinema.viewing_history_archive_monthly (
+    like cinema.viewing_history including constraints,
+    primary key (view_id, start_time)
+) partition by range (start_time);
+
+-- месяцы, строки которых попали в секцию по умолчанию, получают свои секции
+create or replace function cinema.split_viewing_history_default()
+returns setof regclass as $$
+    select cinema.create_viewing_history_partition(month)
+    from (select distinct date_trunc('month', start_time) as month from cinema.viewing_history_default) months
+    order by month;
+$$ language sql;
+
+-- Отсоединение и подключение секции не вызывают триггеры таблицы, поэтому
+-- зависящие от истории агрегаты (если они созданы) после них пересчитываются:
+-- статистика по жанрам целиком, дневная активность пользователей - только
+-- за дни [p_from, p_to), а без границ - тоже целиком.
+drop function if exists cinema.refresh_viewing_history_dependents();
+
+create or replace function cinema.refresh_viewing_history_dependents(p_from date default null, p_to date default null)
+returns void as $$
+begin
+    if to_regprocedure('cinema.refresh_genre_statistics()') is not null then
+        perform cinema.refresh_genre_statistics();
+    end if;
+    if to_regprocedure('cinema.refresh_user_daily_activity(date, date)') is not null then
+        perform cinema.refresh_user_daily_activity(p_from, p_to);
+    end if;
+end;
+$$ language plpgsql;
+
+-- перенос месяца в архив: секция отсоединяется и подключается к viewing_history_archive_monthly
+create or replace function cinema.archive_viewing_history_partition(p_month timestamp, p_refresh boolean default true)
+returns bigint as $$
+declare
+    range_start timestamp := date_trunc('month', p_month);
+    live_partition regclass := to_regclass(format('cinema.%I', cinema.viewing_history_partition_name(p_month)));
+    archive_name text := 'viewing_history_archive_' || to_char(p_month, 'YYYY_MM');
+    archived bigint;
+begin
+    if live_partition is null or not exists (select 1 from pg_inherits
+                                             where inhrelid = live_partition
+                                               and inhparent = 'cinema.viewing_history'::regclass) then
+        raise exception 'Секция истории просмотров за % не найдена', to_char(p_month, 'YYYY-MM');
+    end if;
+
+    execute format('select count(*) from %s', live_partition) into archived;
+    execute format('alter table cinema.viewing_history detach partition %s', live_partition);
+    execute format('alter table %s rename to %I', live_partition, archive_name);
+    execute format('alter table cinema.viewing_history_archive_monthly attach partition cinema.%I for values from (%L) to (%L)',
+                   archive_name, range_start, range_start + interval '1 month');
+
+    if p_refresh then
+        perform cinema.refresh_viewing_history_dependents(range_start::date, (range_start + interval '1 month')::date);
+    end if;
+    return archived;
+end;
+$$ language plpgsql;
+
+-- обратная операция: месяц из архива снова становится секцией viewing_history
+create or replace function cinema.restore_viewing_history_partition(p_month timestamp, p_refresh boolean default true)
+returns bigint as $$
+declare
+    range_start timestamp := date_trunc('month', p_month);
+    archive_partition regclass := to_regclass(format('cinema.%I', 'viewing_history_archive_' || to_char(p_month, 'YYYY_MM')));
+    restored bigint;
+begin
+    if archive_partition is null then
+        raise exception 'Месяц % в архиве не найден', to_char(p_month, 'YYYY-MM');
+    end if;
+
+    execute format('select count(*) from %s', archive_partition) into restored;
+    execute format('alter table cinema.viewing_history_archive_monthly detach partition %s', archive_partition);
+    execute format('alter table %s rename to %I', archive_partition, cinema.viewing_history_partition_name(p_month));
+    execute format('alter table cinema.viewing_history attach partition cinema.%I for values from (%L) to (%L)',
+                   cinema.viewing_history_partition_name(p_month), range_start, range_start + interval '1 month');
+
+    if p_refresh then
+        perform cinema.refresh_viewing_history_dependents(range_start::date, (range_start + interval '1 month')::date);
+    end if;
+    return restored;
+end;
+$$ language plpgsql;
+
+-- С pg_cron будущие секции создаются каждый день; без него их создают загрузчик
+-- generate.py и archive_viewing_history.py, а строки без секции попадают в секцию по умолчанию.
+do $$
+begin
+    if exists (select 1 from pg_extension where extname = 'pg_cron') then
+        perform cron.schedule('viewing_history_partitions', '0 3 * * *',
+                              'select cinema.create_upcoming_viewing_history_partitions()');
+    end if;
+end $$;
+
+select partition_name, range_start, range_end from cinema.viewing_history_partitions();
@@ -0,0 +1,257 @@
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+
+import psycopg2
+
+DB_PARAMS = {
+    'host': 'localhost',
+    'database': 'streaming_service',
+    'user': 'postgres',
+    'password': 'postgres',
+    'port': '5432'
+}
+
+STATE_FILE = 'archive_state.json'
+DEFAULT_BATCH_SIZE = 5000
+REPORT_EVERY = 20
+LOCK_RETRY_DELAY = 1.0
+
+# та же таблица, что создаёт archive_viewing_history_by_range в scripts.sql;
+# viewed_percentage добавляется, чтобы архив хранил строку целиком
+# (процедура вставляет по именам столбцов и продолжает работать)
+CREATE_ARCHIVE_TABLE = """
+    CREATE TABLE IF NOT EXISTS cinema.viewing_history_archive (
+        archive_id SERIAL PRIMARY KEY,
+        view_id INT,
+        user_id INT,
+        movie_id INT,
+        device_id INT,
+        start_time TIMESTAMP,
+        end_time TIMESTAMP,
+        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    ALTER TABLE cinema.viewing_history_archive ADD COLUMN IF NOT EXISTS viewed_percentage INT;
+"""
+
+# Одна пачка: следующие batch_size строк диапазона по возрастанию view_id
+# удаляются и вставляются в архив одним запросом. Строки, уже перенесённые
+# до сбоя, из viewing_history удалены, поэтому повтор пачки безопасен.
+# Ключ секционированной таблицы - (view_id, start_time); условие на start_time
+# в DELETE оставляет в плане только секции диапазона.
+MOVE_BATCH = """
+    WITH batch AS (
+        SELECT view_id, start_time
+        FROM cinema.viewing_history
+        WHERE start_time >= %(start)s
+          AND start_time < %(end)s
+          AND view_id > %(after)s
+        ORDER BY view_id
+        LIMIT %(batch_size)s
+        FOR UPDATE
+    ),
+    moved AS (
+        DELETE FROM cinema.viewing_history vh
+        USING batch b
+        WHERE vh.view_id = b.view_id
+          AND vh.start_time = b.start_time
+          AND vh.start_time >= %(start)s
+          AND vh.start_time < %(end)s
+        RETURNING vh.view_id, vh.user_id, vh.movie_id, vh.device_id, vh.start_time, vh.end_time,
+                  vh.viewed_percentage
+    ),
+    archived AS (
+        INSERT INTO cinema.viewing_history_archive
+            (view_id, user_id, movie_id, device_id, start_time, end_time, viewed_percentage)
+        SELECT view_id, user_id, movie_id, device_id, start_time, end_time, viewed_percentage
+        FROM moved
+        RETURNING view_id
+    )
+    SELECT count(*), max(view_id) FROM archived
+"""
+
+# Если viewing_history секционирована (lab_01/sql_scripts/partition.sql), целые
+# месяцы периода не переносятся по строкам: секция отсоединяется и подключается
+# к viewing_history_archive_monthly, пачками переносятся только неполные месяцы.
+# Поэтому архив одного периода лежит в двух таблицах: края - в
+# viewing_history_archive (с archive_id и archived_at), целые месяцы - в
+# viewing_history_archive_monthly (столбцы viewing_history). Представление
+# viewing_history_archived объединяет их общими столбцами; restore_viewing_history_partition
+# возвращает только целые месяцы.
+IS_PARTITIONED = "SELECT relkind = 'p' FROM pg_class WHERE oid = 'cinema.viewing_history'::regclass"
+CREATE_UPCOMING_PARTITIONS = "SELECT count(*) FROM cinema.create_upcoming_viewing_history_partitions()"
+WHOLE_MONTH_PARTITIONS = """
+    SELECT partition_name::text, range_start
+    FROM cinema.viewing_history_partitions()
+    WHERE range_start >= %(start)s AND range_end <= %(end)s
+"""
+ARCHIVE_PARTITION = "SELECT cinema.archive_viewing_history_partition(%s, false)"
+CREATE_ARCHIVE_VIEW = """
+    CREATE OR REPLACE VIEW cinema.viewing_history_archived AS
+    SELECT view_id, user_id, movie_id, device_id, start_time, end_time, viewed_percentage, archived_at
+    FROM cinema.viewing_history_archive
+    UNION ALL
+    SELECT view_id, user_id, movie_id, device_id, start_time, end_time, viewed_percentage, NULL::timestamp
+    FROM cinema.viewing_history_archive_monthly
+"""
+REFRESH_DEPENDENTS = "SELECT cinema.refresh_viewing_history_dependents(%(start)s::date, %(end)s::date)"
+
+
+def load_state(state_file, start, end, restart):
+    if restart or not os.path.exists(state_file):
+        return {'start': start, 'end': end, 'after': 0, 'archived': 0, 'seconds': 0.0, 'partitions': []}
+
+    with open(state_file, 'r', encoding='utf-8') as file:
+        state = json.load(file)
+    if (state['start'], state['end']) != (start, end):
+        raise SystemExit(f"{state_file} относится к диапазону {state['start']} - {state['end']}, "
+                         f"запустите с --restart или с тем же диапазоном")
+
+    print(f"Продолжение с view_id > {state['after']}, уже перенесено {state['archived']} строк")
+    state.setdefault('partitions', [])
+    return state
+
+
+def save_state(state_file, state):
+    # запись через временный файл: прерывание не оставит испорченную контрольную точку
+    tmp_file = state_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as file:
+        json.dump(state, file, indent=2)
+    os.replace(tmp_file, state_file)
+
+
+def report(state, batch_rows, batch_seconds):
+    total_rate = state['archived'] / state['seconds'] if state['seconds'] else 0
+    batch_rate = batch_rows / batch_seconds if batch_seconds else 0
+    print(f"Перенесено {state['archived']} строк, view_id <= {state['after']} "
+          f"({batch_rate:.0f} строк/с сейчас, {total_rate:.0f} строк/с в среднем)")
+
+
+def with_lock_retry(conn, function, *args):
+    # шаг не ждёт чужие блокировки дольше lock_timeout, а повторяется позже
+    while True:
+        try:
+            with conn.cursor() as cursor:
+                result = function(cursor, *args)
+            conn.commit()
+            return result
+        except psycopg2.errors.LockNotAvailable:
+            conn.rollback()
+            print(f"Блокировка не получена, повтор через {LOCK_RETRY_DELAY} с")
+            time.sleep(LOCK_RETRY_DELAY)
+
+
+def move_batch(cursor, params):
+    cursor.execute(MOVE_BATCH, params)
+    return cursor.fetchone()
+
+
+def archive_partition(cursor, month):
+    cursor.execute(ARCHIVE_PARTITION, (month,))
+    return cursor.fetchone()[0]
+
+
+def archive_partitions(conn, state_file, state):
+    with conn.cursor() as cursor:
+        cursor.execute(IS_PARTITIONED)
+        if not cursor.fetchone()[0]:
+            conn.commit()
+            return
+        cursor.execute(CREATE_ARCHIVE_VIEW)
+        cursor.execute(CREATE_UPCOMING_PARTITIONS)
+        cursor.execute(WHOLE_MONTH_PARTITIONS, {'start': state['start'], 'end': state['end']})
+        partitions = cursor.fetchall()
+    conn.commit()
+
+    for name, month in partitions:
+        # отсоединение секции - короткая блокировка всей таблицы вместо удаления строк
+        started = time.perf_counter()
+        rows = with_lock_retry(conn, archive_partition, month)
+        elapsed = time.perf_counter() - started
+
+        state['partitions'].append(name)
+        state['archived'] += rows
+        state['seconds'] += elapsed
+        save_state(state_file, state)
+        print(f"Секция {name} перенесена в архив целиком: {rows} строк за {elapsed:.2f} с")
+
+
+def archive_range(start, end, batch_size=DEFAULT_BATCH_SIZE, pause=0.0, lock_timeout=5,
+                  state_file=STATE_FILE, restart=False):
+    state = load_state(state_file, start, end, restart)
+
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(CREATE_ARCHIVE_TABLE)
+            cursor.execute("SET lock_timeout = %s", (f"{lock_timeout}s",))
+        conn.commit()
+
+        archive_partitions(conn, state_file, state)
+
+        window_rows, window_seconds, batches = 0, 0.0, 0
+        while True:
+            started = time.perf_counter()
+            rows, last_view_id = with_lock_retry(conn, move_batch, {
+                'start': start, 'end': end, 'after': state['after'], 'batch_size': batch_size,
+            })
+            elapsed = time.perf_counter() - started
+            if rows == 0:
+                break
+
+            state['after'] = last_view_id
+            state['archived'] += rows
+            state['seconds'] += elapsed
+            save_state(state_file, state)
+
+            batches += 1
+            window_rows += rows
+            window_seconds += elapsed
+            if batches % REPORT_EVERY == 0:
+                report(state, window_rows, window_seconds)
+                window_rows, window_seconds = 0, 0.0
+
+            if pause:
+                time.sleep(pause)
+
+        if state['partitions']:
+            # отсоединение секций не вызывает триггеры viewing_history; целые
+            # месяцы периода лежат внутри [start::date, end::date)
+            with conn.cursor() as cursor:
+                cursor.execute(REFRESH_DEPENDENTS, {'start': start, 'end': end})
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    report(state, window_rows, window_seconds)
+    if os.path.exists(state_file):
+        os.remove(state_file)
+    print(f"Архивация {start} - {end} завершена")
+    return state['archived']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перенос истории просмотров за период в viewing_history_archive пачками")
+    parser.add_argument('start', type=datetime.fromisoformat, help="начало периода, включительно")
+    parser.add_argument('end', type=datetime.fromisoformat, help="конец периода, не включительно")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--pause', type=float, default=0.0, help="пауза между пачками, с")
+    parser.add_argument('--lock-timeout', type=int, default=5, help="ожидание блокировок одной пачкой, с")
+    parser.add_argument('--state-file', default=STATE_FILE, help="контрольная точка для продолжения")
+    parser.add_argument('--restart', action='store_true', help="начать заново, игнорируя контрольную точку")
+    args = parser.parse_args()
+
+    if args.start >= args.end:
+        parser.error("начало периода должно быть раньше конца")
+
+    archive_range(args.start.isoformat(sep=' '), args.end.isoformat(sep=' '), args.batch_size, args.pause,
+                  args.lock_timeout, args.state_file, args.restart)
+
+
+if __name__ == "__main__":
+    main()
@@ -40,6 +40,8 @@ $$ LANGUAGE plpgsql;
 SELECT * FROM get_users_by_subscription('premium');
 
 -- многооператорная табличная функция
+-- один проход по истории: просмотры агрегируются по (пользователь, устройство),
+-- из этих же сумм берутся итоги пользователя и любимое устройство (DISTINCT ON)
 CREATE OR REPLACE FUNCTION get_user_viewing_stats()
 RETURNS TABLE (
     user_id INT,
@@ -48,41 +50,42 @@ RETURNS TABLE (
     total_watch_time INTERVAL,
     favorite_device TEXT
 ) AS $$
-DECLARE
-    user_record RECORD;
-    fav_device TEXT;
-BEGIN
-    CREATE TEMP TABLE temp_stats AS
-    SELECT 
+    WITH device_views AS (
+        SELECT
+            vh.user_id,
+            vh.device_id,
+            COUNT(*) AS views,
+            SUM(vh.end_time - vh.start_time) AS watch_time
+        FROM cinema.viewing_history vh
+        GROUP BY vh.user_id, vh.device_id
+    ),
+    user_views AS (
+        SELECT
+            dv.user_id,
+            SUM(dv.views)::BIGINT AS total_views,
+            SUM(dv.watch_time) AS total_watch_time
+        FROM device_views dv
+        GROUP BY dv.user_id
+    ),
+    favorite_devices AS (
+        SELECT DISTINCT ON (dv.user_id)
+            dv.user_id,
+            d.device_name::TEXT AS device_name
+        FROM device_views dv
+        JOIN cinema.devices d ON d.device_id = dv.device_id
+        ORDER BY dv.user_id, dv.views DESC, dv.device_id
+    )
+    SELECT
         u.user_id,
         u.full_name,
-        COUNT(vh.view_id) as total_views,
-        SUM(vh.end_time - vh.start_time) as total_watch_time,
-        NULL::TEXT as favorite_device
+        COALESCE(uv.total_views, 0),
+        uv.total_watch_time,
+        COALESCE(fd.device_name, 'No views')
     FROM cinema.users u
-    LEFT JOIN cinema.viewing_history vh ON u.user_id = vh.user_id
-    GROUP BY u.user_id, u.full_name;
-    
-    FOR user_record IN SELECT * FROM temp_stats 
-    LOOP
-        SELECT d.device_name INTO fav_device
-        FROM cinema.devices d
-        JOIN cinema.viewing_history vh ON d.device_id = vh.device_id
-        WHERE vh.user_id = user_record.user_id
-        GROUP BY d.device_id, d.device_name
-        ORDER BY COUNT(*) DESC
-        LIMIT 1;
-        
-        UPDATE temp_stats 
-        SET favorite_device = COALESCE(fav_device, 'No views')
-        WHERE temp_stats.user_id = user_record.user_id;
-    END LOOP;
-    
-    RETURN QUERY SELECT * FROM temp_stats;
-    
-    DROP TABLE temp_stats;
-END;
-$$ LANGUAGE plpgsql;
+    LEFT JOIN user_views uv ON uv.user_id = u.user_id
+    LEFT JOIN favorite_devices fd ON fd.user_id = u.user_id
+    ORDER BY u.user_id;
+$$ LANGUAGE sql STABLE;
 
 select * from get_user_viewing_stats();
 
@@ -170,55 +173,98 @@ call update_user_subscription(1, 'aaa');
 
 -- рекурсивная хранимая процедура или хранимая процедура с рекурсивным ОТВ
 -- статистика по месяцам для определенных пользователей
-CREATE OR REPLACE PROCEDURE generate_monthly_stats(p_year INT) AS $$
-DECLARE
-    month_record RECORD;
-BEGIN
-    CREATE TEMP TABLE monthly_stats (
-        month_num INT,
-        month_name TEXT,
-        new_users BIGINT,
-        total_views BIGINT
-    );
-    
+
+-- Каждая таблица агрегируется отдельно по date_trunc('month', ...) с условием
+-- на полуоткрытый диапазон года: условие использует индексы (и отсечение
+-- секций viewing_history), а регистрации и просмотры не перемножаются
+-- перед подсчётом. Время работы пропорционально данным одного года.
+-- Индексы строятся CONCURRENTLY и не останавливают запись. Секционированной
+-- viewing_history (lab_01/sql_scripts/partition.sql) так индексироваться
+-- нельзя: индекс создаётся на ней самой (ON ONLY, без построения), на секциях -
+-- CONCURRENTLY, затем подключается к ним. \gexec выполняет каждую строку
+-- результата отдельным запросом вне транзакции.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS users_registration_date_idx ON cinema.users (registration_date);
+
+SELECT CASE relkind
+           WHEN 'p' THEN 'CREATE INDEX IF NOT EXISTS viewing_history_start_time_idx ON ONLY cinema.viewing_history (start_time)'
+           ELSE 'CREATE INDEX CONCURRENTLY IF NOT EXISTS viewing_history_start_time_idx ON cinema.viewing_history (start_time)'
+       END
+FROM pg_class
+WHERE oid = 'cinema.viewing_history'::regclass
+\gexec
+
+-- секции, у которых ещё нет индекса, подключённого к индексу таблицы
+CREATE OR REPLACE TEMP VIEW unindexed_viewing_history_partitions AS
+SELECT c.oid::regclass AS partition_name,
+       'viewing_history_start_time_idx' || substr(c.relname, length('viewing_history') + 1) AS index_name
+FROM pg_inherits i
+JOIN pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent = 'cinema.viewing_history'::regclass
+  AND NOT EXISTS (SELECT 1
+                  FROM pg_inherits ii
+                  JOIN pg_index x ON x.indexrelid = ii.inhrelid
+                  WHERE ii.inhparent = to_regclass('cinema.viewing_history_start_time_idx')
+                    AND x.indrelid = c.oid);
+
+SELECT format('CREATE INDEX CONCURRENTLY IF NOT EXISTS %I ON %s (start_time)', index_name, partition_name)
+FROM unindexed_viewing_history_partitions
+\gexec
+
+SELECT format('ALTER INDEX cinema.viewing_history_start_time_idx ATTACH PARTITION cinema.%I', index_name)
+FROM unindexed_viewing_history_partitions
+\gexec
+
+CREATE OR REPLACE FUNCTION get_monthly_stats(p_year INT)
+RETURNS TABLE (
+    month_num INT,
+    month_name TEXT,
+    new_users BIGINT,
+    total_views BIGINT
+) AS $$
     WITH RECURSIVE months AS (
-        SELECT 1 as month_num, 'January' as month_name
-        
+        SELECT 1 AS month_num, make_date(p_year, 1, 1)::TIMESTAMP AS month_start
+
         UNION ALL
-        
-        SELECT month_num + 1, 
-               CASE month_num + 1
-                   WHEN 2 THEN 'February'
-                   WHEN 3 THEN 'March'
-                   WHEN 4 THEN 'April'
-                   WHEN 5 THEN 'May'
-                   WHEN 6 THEN 'June'
-                   WHEN 7 THEN 'July'
-                   WHEN 8 THEN 'August'
-                   WHEN 9 THEN 'September'
-                   WHEN 10 THEN 'October'
-                   WHEN 11 THEN 'November'
-                   WHEN 12 THEN 'December'
-               END
+
+        SELECT month_num + 1, month_start + INTERVAL '1 month'
         FROM months
         WHERE month_num < 12
+    ),
+    registrations AS (
+        SELECT date_trunc('month', registration_date::TIMESTAMP) AS month_start,
+               COUNT(*) AS new_users
+        FROM cinema.users
+        WHERE registration_date >= make_date(p_year, 1, 1)
+          AND registration_date < make_date(p_year + 1, 1, 1)
+        GROUP BY 1
+    ),
+    views AS (
+        SELECT date_trunc('month', start_time) AS month_start,
+               COUNT(*) AS total_views
+        FROM cinema.viewing_history
+        WHERE start_time >= make_date(p_year, 1, 1)
+          AND start_time < make_date(p_year + 1, 1, 1)
+        GROUP BY 1
     )
-    INSERT INTO monthly_stats
-    SELECT 
+    SELECT
         m.month_num,
-        m.month_name,
-        COUNT(DISTINCT u.user_id) as new_users,
-        COUNT(vh.view_id) as total_views
+        to_char(m.month_start, 'FMMonth'),
+        COALESCE(r.new_users, 0),
+        COALESCE(v.total_views, 0)
     FROM months m
-    LEFT JOIN cinema.users u ON EXTRACT(MONTH FROM u.registration_date) = m.month_num 
-                             AND EXTRACT(YEAR FROM u.registration_date) = p_year
-    LEFT JOIN cinema.viewing_history vh ON EXTRACT(MONTH FROM vh.start_time) = m.month_num 
-                                        AND EXTRACT(YEAR FROM vh.start_time) = p_year
-    GROUP BY m.month_num, m.month_name
+    LEFT JOIN registrations r ON r.month_start = m.month_start
+    LEFT JOIN views v ON v.month_start = m.month_start
     ORDER BY m.month_num;
-    
+$$ LANGUAGE sql STABLE;
+
+select * from get_monthly_stats(2024);
+
+CREATE OR REPLACE PROCEDURE generate_monthly_stats(p_year INT) AS $$
+DECLARE
+    month_record RECORD;
+BEGIN
     RAISE NOTICE 'Monthly statistics for year %:', p_year;
-    FOR month_record IN SELECT * FROM monthly_stats ORDER BY month_num
+    FOR month_record IN SELECT * FROM get_monthly_stats(p_year)
     LOOP
         RAISE NOTICE 'Month % (%): New Users: %, Total Views: %', 
             month_record.month_num, 
@@ -226,8 +272,6 @@ BEGIN
             month_record.new_users,
             month_record.total_views;
     END LOOP;
-    
-    DROP TABLE monthly_stats;
 END;
 $$ LANGUAGE plpgsql;
 
@@ -278,7 +322,9 @@ BEGIN
             (view_record.view_id, view_record.user_id, view_record.movie_id, 
              view_record.device_id, view_record.start_time, view_record.end_time);
         
-        DELETE FROM cinema.viewing_history WHERE view_id = view_record.view_id;
+        -- start_time ограничивает поиск одной секцией, если таблица секционирована
+        DELETE FROM cinema.viewing_history
+        WHERE view_id = view_record.view_id AND start_time = view_record.start_time;
         
         archived_count := archived_count + 1;
     END LOOP;
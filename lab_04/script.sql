@@ -62,28 +62,33 @@ select director, filtered_avg_rating(imdb_rating) as avg_rating
 from cinema.movies 
 group by director;
 
+-- дневная активность пользователей (user_daily_activity) и поддерживающие её
+-- триггеры определены в lab_06/aggregates.sql вместе с остальными агрегатами
+\ir ../lab_06/aggregates.sql
+
 -- табличная функция
 -- активность пользователя по дням
+-- читает готовые дневные итоги из user_daily_activity; план запроса
+-- готовится один раз на сессию и хранится в SD
 create or replace function get_user_activity_periods(user_id integer)
 returns table(period_date date, view_count bigint, total_duration interval, avg_completion numeric)
 as $$
-query = """
-select 
-    date(vh.start_time) as view_date,
-    count(*) as view_count,
-    sum(vh.end_time - vh.start_time) as total_duration,
-    avg(vh.viewed_percentage) as avg_completion
-from cinema.viewing_history vh
-where vh.user_id = $1
-group by date(vh.start_time)
-order by view_date desc
-"""
-
-plan = plpy.prepare(query, ["integer"])
-result = plpy.execute(plan, [user_id])
+if "activity_plan" not in SD:
+    SD["activity_plan"] = plpy.prepare("""
+select
+    activity_date,
+    view_count,
+    case when timed_view_count > 0 then total_duration end as total_duration,
+    sum_viewed_percentage::numeric / view_count as avg_completion
+from cinema.user_daily_activity
+where user_id = $1
+order by activity_date desc
+""", ["integer"])
+
+result = plpy.execute(SD["activity_plan"], [user_id])
 
 for row in result:
-    yield (row["view_date"], row["view_count"], row["total_duration"], float(row["avg_completion"]) if row["avg_completion"] else 0)
+    yield (row["activity_date"], row["view_count"], row["total_duration"], float(row["avg_completion"]) if row["avg_completion"] else 0)
 $$ language plpython3u;
 
 select * from get_user_activity_periods(1);
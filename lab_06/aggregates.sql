@@ -0,0 +1,527 @@
+-- Агрегаты для отчётов StreamingServiceDB: статистика по жанрам (movies_rating)
+-- и дневная активность пользователей (user_activity_periods). Скрипт заполняет
+-- агрегаты по всей истории просмотров, поэтому клиенты выполняют его при
+-- подключении, только если его объектов в базе нет (routines.py). Выполняется
+-- после lab_01/sql_scripts (и partition.sql, если история секционирована);
+-- повторный запуск через psql пересоздаёт функции и триггеры и пересчитывает
+-- агрегаты целиком.
+-- lab_04/script.sql подключает этот файл ради user_daily_activity, на которой
+-- построена get_user_activity_periods.
+
+-- Нормализованные жанры и агрегаты по жанрам для movies_rating.
+-- Триггеры уровня оператора получают изменённые строки целиком
+-- (transition tables), поэтому пачка COPY обрабатывается одним запросом.
+-- Жанров мало, поэтому триггеры не обновляют их строки (все писатели ждали бы
+-- друг друга), а дописывают изменения в genre_statistics_delta; просмотры
+-- так же дописываются в movie_view_stats_delta без блокировок строк фильмов.
+-- fold_genre_statistics() переносит их в movie_view_stats и genre_statistics пачкой.
+create table if not exists cinema.movie_genres (
+    movie_id integer not null,
+    genre text not null,
+    primary key (movie_id, genre)
+);
+create index if not exists movie_genres_genre_idx on cinema.movie_genres (genre);
+
+create table if not exists cinema.movie_view_stats (
+    movie_id integer primary key,
+    view_count bigint not null default 0,
+    sum_viewed_percentage bigint not null default 0
+);
+
+-- просмотры, ещё не перенесённые в movie_view_stats
+create table if not exists cinema.movie_view_stats_delta (
+    movie_id integer not null,
+    view_count bigint not null,
+    sum_viewed_percentage bigint not null
+);
+
+create table if not exists cinema.genre_statistics (
+    genre text primary key,
+    movie_count bigint not null default 0,
+    rated_movie_count bigint not null default 0,
+    sum_imdb_rating numeric not null default 0,
+    viewed_movie_count bigint not null default 0,
+    sum_completion_rate numeric not null default 0,
+    total_views bigint not null default 0
+);
+
+create table if not exists cinema.genre_statistics_delta (
+    genre text not null,
+    movie_count bigint not null default 0,
+    rated_movie_count bigint not null default 0,
+    sum_imdb_rating numeric not null default 0,
+    viewed_movie_count bigint not null default 0,
+    sum_completion_rate numeric not null default 0,
+    total_views bigint not null default 0
+);
+
+create or replace function cinema.split_genres(p_genres text)
+returns setof text as $$
+    select distinct lower(btrim(genre))
+    from regexp_split_to_table(p_genres, ',') as genre
+    where btrim(genre) <> ''
+$$ language sql immutable;
+
+-- вклад изменений просмотров в агрегаты жанров. Число просмотренных фильмов
+-- и средняя досмотренность зависят от итогов фильма, поэтому изменения
+-- сравниваются с перенесёнными итогами из movie_view_stats.
+create or replace function cinema.view_changes_by_genre(
+    p_movie_ids integer[], p_view_counts bigint[], p_percentages bigint[]
+) returns table (genre text, viewed_movie_count bigint, sum_completion_rate numeric, total_views bigint) as $$
+    with delta as (
+        select v.movie_id, sum(v.view_count) as views, sum(v.percentage) as percentage
+        from unnest(p_movie_ids, p_view_counts, p_percentages) as v(movie_id, view_count, percentage)
+        group by v.movie_id
+    ),
+    changed as (
+        select
+            d.movie_id,
+            d.views,
+            coalesce(s.view_count, 0) as old_count,
+            coalesce(s.view_count, 0) + d.views as new_count,
+            coalesce(s.sum_viewed_percentage::numeric / nullif(s.view_count, 0), 0) as old_rate,
+            coalesce((coalesce(s.sum_viewed_percentage, 0) + d.percentage)::numeric
+                     / nullif(coalesce(s.view_count, 0) + d.views, 0), 0) as new_rate
+        from delta d
+        left join cinema.movie_view_stats s on s.movie_id = d.movie_id
+    )
+    select
+        mg.genre,
+        count(*) filter (where c.old_count = 0 and c.new_count > 0)
+            - count(*) filter (where c.old_count > 0 and c.new_count = 0),
+        sum(c.new_rate - c.old_rate),
+        sum(c.views)::bigint
+    from changed c
+    join cinema.movie_genres mg on mg.movie_id = c.movie_id
+    group by mg.genre
+$$ language sql stable;
+
+-- агрегаты с ещё не перенесёнными изменениями; movies_rating читает отсюда
+create or replace view cinema.genre_statistics_current as
+select
+    genre,
+    sum(movie_count) as movie_count,
+    sum(rated_movie_count) as rated_movie_count,
+    sum(sum_imdb_rating) as sum_imdb_rating,
+    sum(viewed_movie_count) as viewed_movie_count,
+    sum(sum_completion_rate) as sum_completion_rate,
+    sum(total_views) as total_views
+from (
+    select genre, movie_count, rated_movie_count, sum_imdb_rating,
+           viewed_movie_count, sum_completion_rate, total_views
+    from cinema.genre_statistics
+    union all
+    select genre, movie_count, rated_movie_count, sum_imdb_rating,
+           viewed_movie_count, sum_completion_rate, total_views
+    from cinema.genre_statistics_delta
+    union all
+    select v.genre, 0, 0, 0, v.viewed_movie_count, v.sum_completion_rate, v.total_views
+    from (
+        select array_agg(movie_id) as movie_ids, array_agg(view_count) as view_counts,
+               array_agg(sum_viewed_percentage) as percentages
+        from cinema.movie_view_stats_delta
+    ) d
+    cross join lateral cinema.view_changes_by_genre(d.movie_ids, d.view_counts, d.percentages) v
+) s
+group by genre
+having sum(movie_count) > 0;
+
+create or replace function cinema.refresh_genre_statistics()
+returns void as $$
+begin
+    -- ждёт транзакции, уже записавшие изменения, и не пускает новые до конца
+    -- пересчёта: иначе их изменения учлись бы дважды или потерялись
+    lock table cinema.genre_statistics_delta in exclusive mode;
+    lock table cinema.movie_view_stats_delta in exclusive mode;
+
+    delete from cinema.genre_statistics_delta;
+    delete from cinema.movie_view_stats_delta;
+    delete from cinema.movie_genres;
+    delete from cinema.movie_view_stats;
+    delete from cinema.genre_statistics;
+
+    insert into cinema.movie_genres (movie_id, genre)
+    select distinct m.movie_id, g.genre
+    from cinema.movies m, cinema.split_genres(m.genres) as g(genre);
+
+    insert into cinema.movie_view_stats (movie_id, view_count, sum_viewed_percentage)
+    select movie_id, count(*), sum(viewed_percentage)
+    from cinema.viewing_history
+    group by movie_id;
+
+    insert into cinema.genre_statistics
+    select
+        mg.genre,
+        count(*),
+        count(m.imdb_rating),
+        coalesce(sum(m.imdb_rating), 0),
+        count(*) filter (where s.view_count > 0),
+        coalesce(sum(s.sum_viewed_percentage::numeric / nullif(s.view_count, 0)), 0),
+        coalesce(sum(s.view_count), 0)
+    from cinema.movie_genres mg
+    join cinema.movies m on m.movie_id = mg.movie_id
+    left join cinema.movie_view_stats s on s.movie_id = mg.movie_id
+    group by mg.genre;
+end;
+$$ language plpgsql;
+
+-- вклад фильмов в агрегаты жанров: p_sign = 1 при добавлении, -1 при удалении
+create or replace function cinema.apply_movie_changes(
+    p_sign integer, p_movie_ids integer[], p_genres text[], p_ratings numeric[]
+) returns void as $$
+begin
+    -- до блокировок строк, в том же порядке, что и refresh_genre_statistics
+    lock table cinema.genre_statistics_delta in row exclusive mode;
+
+    if p_sign < 0 then
+        delete from cinema.movie_genres where movie_id = any(p_movie_ids);
+    else
+        insert into cinema.movie_genres (movie_id, genre)
+        select distinct c.movie_id, g.genre
+        from unnest(p_movie_ids, p_genres) as c(movie_id, genres),
+             cinema.split_genres(c.genres) as g(genre)
+        on conflict do nothing;
+    end if;
+
+    -- вклад просмотров считается по перенесённым итогам фильма: ещё не
+    -- перенесённые genre_statistics_current добавляет по текущим жанрам
+    insert into cinema.genre_statistics_delta
+    select
+        g.genre,
+        p_sign * count(*),
+        p_sign * count(c.imdb_rating),
+        p_sign * coalesce(sum(c.imdb_rating), 0),
+        p_sign * count(*) filter (where s.view_count > 0),
+        p_sign * coalesce(sum(s.sum_viewed_percentage::numeric / nullif(s.view_count, 0)), 0),
+        p_sign * coalesce(sum(s.view_count), 0)
+    from unnest(p_movie_ids, p_genres, p_ratings) as c(movie_id, genres, imdb_rating)
+    cross join lateral (select distinct genre from cinema.split_genres(c.genres) as genre) g
+    left join cinema.movie_view_stats s on s.movie_id = c.movie_id
+    group by g.genre;
+end;
+$$ language plpgsql;
+
+-- изменения просмотров: p_sign = 1 для новых строк, -1 для удалённых
+create or replace function cinema.apply_view_changes(
+    p_sign integer, p_movie_ids integer[], p_percentages integer[]
+) returns void as $$
+begin
+    -- в том же порядке, что и refresh_genre_statistics; строки фильмов
+    -- не блокируются, поэтому параллельные загрузки не ждут друг друга
+    lock table cinema.genre_statistics_delta in row exclusive mode;
+
+    insert into cinema.movie_view_stats_delta (movie_id, view_count, sum_viewed_percentage)
+    select v.movie_id, p_sign * count(*), p_sign * sum(v.viewed_percentage)
+    from unnest(p_movie_ids, p_percentages) as v(movie_id, viewed_percentage)
+    group by v.movie_id;
+end;
+$$ language plpgsql;
+
+-- перенос накопленных изменений в movie_view_stats и genre_statistics;
+-- возвращает число строк изменений. Если их меньше p_min_changes, перенос
+-- откладывается: так его можно вызывать перед каждым чтением агрегатов.
+drop function if exists cinema.fold_genre_statistics();
+
+create or replace function cinema.fold_genre_statistics(p_min_changes integer default 0)
+returns bigint as $$
+declare
+    folded bigint;
+    moved_views bigint;
+    movie_ids integer[];
+    view_counts bigint[];
+    percentages bigint[];
+begin
+    if p_min_changes > 0 and (
+        select count(*) from (
+            (select 1 from cinema.genre_statistics_delta limit p_min_changes)
+            union all
+            (select 1 from cinema.movie_view_stats_delta limit p_min_changes)
+        ) pending
+    ) < p_min_changes then
+        return 0;
+    end if;
+
+    -- одновременно работает один перенос, остальные сразу выходят
+    if not pg_try_advisory_xact_lock('cinema.genre_statistics_delta'::regclass::oid::bigint) then
+        return 0;
+    end if;
+
+    -- изменения фильмов ждут конца переноса: вклад просмотров в жанры
+    -- считается по их текущему составу
+    lock table cinema.genre_statistics_delta in row exclusive mode;
+    lock table cinema.movie_genres in share mode;
+
+    with moved as (
+        delete from cinema.movie_view_stats_delta
+        returning movie_id, view_count, sum_viewed_percentage
+    )
+    select count(*), array_agg(movie_id), array_agg(view_count), array_agg(sum_viewed_percentage)
+    into moved_views, movie_ids, view_counts, percentages
+    from moved;
+
+    -- вклад в жанры считается до обновления итогов фильмов
+    insert into cinema.genre_statistics_delta (genre, viewed_movie_count, sum_completion_rate, total_views)
+    select * from cinema.view_changes_by_genre(movie_ids, view_counts, percentages);
+
+    insert into cinema.movie_view_stats as s (movie_id, view_count, sum_viewed_percentage)
+    select v.movie_id, sum(v.view_count), sum(v.percentage)
+    from unnest(movie_ids, view_counts, percentages) as v(movie_id, view_count, percentage)
+    group by v.movie_id
+    order by v.movie_id
+    on conflict (movie_id) do update set
+        view_count = s.view_count + excluded.view_count,
+        sum_viewed_percentage = s.sum_viewed_percentage + excluded.sum_viewed_percentage;
+
+    with moved as (
+        delete from cinema.genre_statistics_delta
+        returning *
+    ),
+    upserted as (
+        insert into cinema.genre_statistics as gs
+        select
+            genre,
+            sum(movie_count),
+            sum(rated_movie_count),
+            sum(sum_imdb_rating),
+            sum(viewed_movie_count),
+            sum(sum_completion_rate),
+            sum(total_views)
+        from moved
+        group by genre
+        order by genre
+        on conflict (genre) do update set
+            movie_count = gs.movie_count + excluded.movie_count,
+            rated_movie_count = gs.rated_movie_count + excluded.rated_movie_count,
+            sum_imdb_rating = gs.sum_imdb_rating + excluded.sum_imdb_rating,
+            viewed_movie_count = gs.viewed_movie_count + excluded.viewed_movie_count,
+            sum_completion_rate = gs.sum_completion_rate + excluded.sum_completion_rate,
+            total_views = gs.total_views + excluded.total_views
+    )
+    select count(*) into folded from moved;
+
+    delete from cinema.genre_statistics where movie_count <= 0;
+    return folded + moved_views;
+end;
+$$ language plpgsql;
+
+create or replace function cinema.movies_genre_statistics_trigger()
+returns trigger as $$
+begin
+    if tg_op in ('UPDATE', 'DELETE') then
+        perform cinema.apply_movie_changes(-1,
+            array(select movie_id from old_movies),
+            array(select genres from old_movies),
+            array(select imdb_rating from old_movies));
+    end if;
+    if tg_op in ('UPDATE', 'INSERT') then
+        perform cinema.apply_movie_changes(1,
+            array(select movie_id from new_movies),
+            array(select genres from new_movies),
+            array(select imdb_rating from new_movies));
+    end if;
+    return null;
+end;
+$$ language plpgsql;
+
+create or replace function cinema.viewing_history_genre_statistics_trigger()
+returns trigger as $$
+begin
+    if tg_op in ('UPDATE', 'DELETE') then
+        perform cinema.apply_view_changes(-1,
+            array(select movie_id from old_views),
+            array(select viewed_percentage from old_views));
+    end if;
+    if tg_op in ('UPDATE', 'INSERT') then
+        perform cinema.apply_view_changes(1,
+            array(select movie_id from new_views),
+            array(select viewed_percentage from new_views));
+    end if;
+    return null;
+end;
+$$ language plpgsql;
+
+create or replace function cinema.genre_statistics_truncate_trigger()
+returns trigger as $$
+begin
+    perform cinema.refresh_genre_statistics();
+    return null;
+end;
+$$ language plpgsql;
+
+create or replace trigger movies_genre_statistics_insert
+    after insert on cinema.movies
+    referencing new table as new_movies
+    for each statement execute function cinema.movies_genre_statistics_trigger();
+create or replace trigger movies_genre_statistics_update
+    after update on cinema.movies
+    referencing old table as old_movies new table as new_movies
+    for each statement execute function cinema.movies_genre_statistics_trigger();
+create or replace trigger movies_genre_statistics_delete
+    after delete on cinema.movies
+    referencing old table as old_movies
+    for each statement execute function cinema.movies_genre_statistics_trigger();
+create or replace trigger movies_genre_statistics_truncate
+    after truncate on cinema.movies
+    for each statement execute function cinema.genre_statistics_truncate_trigger();
+
+create or replace trigger viewing_history_genre_statistics_insert
+    after insert on cinema.viewing_history
+    referencing new table as new_views
+    for each statement execute function cinema.viewing_history_genre_statistics_trigger();
+create or replace trigger viewing_history_genre_statistics_update
+    after update on cinema.viewing_history
+    referencing old table as old_views new table as new_views
+    for each statement execute function cinema.viewing_history_genre_statistics_trigger();
+create or replace trigger viewing_history_genre_statistics_delete
+    after delete on cinema.viewing_history
+    referencing old table as old_views
+    for each statement execute function cinema.viewing_history_genre_statistics_trigger();
+create or replace trigger viewing_history_genre_statistics_truncate
+    after truncate on cinema.viewing_history
+    for each statement execute function cinema.genre_statistics_truncate_trigger();
+
+-- с pg_cron изменения переносятся каждую минуту; без него - в конце загрузок
+-- lab_01 (generate_data, copy_tool.py), в movies_rating при большом числе
+-- накопленных изменений и при полном пересчёте
+do $$
+begin
+    if exists (select 1 from pg_extension where extname = 'pg_cron') then
+        perform cron.schedule('genre_statistics_fold', '* * * * *',
+                              'select cinema.fold_genre_statistics()');
+    end if;
+end $$;
+
+select cinema.refresh_genre_statistics();
+
+-- Дневная активность пользователей: одна строка на (пользователь, день).
+-- Триггеры уровня оператора обновляют только затронутые дни, поэтому
+-- выборка активности пользователя читает O(дней), а не O(просмотров).
+create table if not exists cinema.user_daily_activity (
+    user_id integer not null,
+    activity_date date not null,
+    view_count bigint not null default 0,
+    -- просмотры с известным end_time: sum() по одним null даёт null
+    timed_view_count bigint not null default 0,
+    total_duration interval not null default interval '0',
+    sum_viewed_percentage bigint not null default 0,
+    primary key (user_id, activity_date)
+);
+
+-- пересчёт дней [p_from, p_to) по viewing_history, без границ - целиком
+create or replace function cinema.refresh_user_daily_activity(p_from date default null, p_to date default null)
+returns void as $$
+begin
+    delete from cinema.user_daily_activity
+    where (p_from is null or activity_date >= p_from)
+      and (p_to is null or activity_date < p_to);
+
+    insert into cinema.user_daily_activity
+    select
+        user_id,
+        start_time::date,
+        count(*),
+        count(end_time),
+        coalesce(sum(end_time - start_time), interval '0'),
+        sum(viewed_percentage)
+    from cinema.viewing_history
+    where (p_from is null or start_time >= p_from)
+      and (p_to is null or start_time < p_to)
+    group by 1, 2;
+end;
+$$ language plpgsql;
+
+-- изменения просмотров: p_sign = 1 для новых строк, -1 для удалённых
+create or replace function cinema.apply_activity_changes(
+    p_sign integer, p_user_ids integer[], p_start_times timestamp[], p_end_times timestamp[], p_percentages integer[]
+) returns void as $$
+begin
+    -- строки дней создаются и блокируются в порядке ключа, чтобы параллельные
+    -- загрузки не попадали во взаимоблокировку
+    insert into cinema.user_daily_activity (user_id, activity_date)
+    select distinct v.user_id, v.start_time::date
+    from unnest(p_user_ids, p_start_times) as v(user_id, start_time)
+    order by 1, 2
+    on conflict do nothing;
+
+    perform 1 from cinema.user_daily_activity a
+    where (a.user_id, a.activity_date) in (
+        select v.user_id, v.start_time::date from unnest(p_user_ids, p_start_times) as v(user_id, start_time)
+    )
+    order by a.user_id, a.activity_date
+    for update;
+
+    with delta as (
+        select
+            v.user_id,
+            v.start_time::date as activity_date,
+            p_sign * count(*) as views,
+            p_sign * count(v.end_time) as timed_views,
+            p_sign * coalesce(sum(v.end_time - v.start_time), interval '0') as duration,
+            p_sign * sum(v.viewed_percentage) as percentage
+        from unnest(p_user_ids, p_start_times, p_end_times, p_percentages)
+             as v(user_id, start_time, end_time, viewed_percentage)
+        group by 1, 2
+    )
+    update cinema.user_daily_activity a
+    set view_count = a.view_count + d.views,
+        timed_view_count = a.timed_view_count + d.timed_views,
+        total_duration = a.total_duration + d.duration,
+        sum_viewed_percentage = a.sum_viewed_percentage + d.percentage
+    from delta d
+    where a.user_id = d.user_id and a.activity_date = d.activity_date;
+
+    if p_sign < 0 then
+        delete from cinema.user_daily_activity a
+        using unnest(p_user_ids, p_start_times) as v(user_id, start_time)
+        where a.user_id = v.user_id and a.activity_date = v.start_time::date
+          and a.view_count <= 0;
+    end if;
+end;
+$$ language plpgsql;
+
+create or replace function cinema.viewing_history_user_activity_trigger()
+returns trigger as $$
+begin
+    if tg_op in ('UPDATE', 'DELETE') then
+        perform cinema.apply_activity_changes(-1,
+            array(select user_id from old_views),
+            array(select start_time from old_views),
+            array(select end_time from old_views),
+            array(select viewed_percentage from old_views));
+    end if;
+    if tg_op in ('UPDATE', 'INSERT') then
+        perform cinema.apply_activity_changes(1,
+            array(select user_id from new_views),
+            array(select start_time from new_views),
+            array(select end_time from new_views),
+            array(select viewed_percentage from new_views));
+    end if;
+    return null;
+end;
+$$ language plpgsql;
+
+create or replace function cinema.user_activity_truncate_trigger()
+returns trigger as $$
+begin
+    truncate cinema.user_daily_activity;
+    return null;
+end;
+$$ language plpgsql;
+
+create or replace trigger viewing_history_user_activity_insert
+    after insert on cinema.viewing_history
+    referencing new table as new_views
+    for each statement execute function cinema.viewing_history_user_activity_trigger();
+create or replace trigger viewing_history_user_activity_update
+    after update on cinema.viewing_history
+    referencing old table as old_views new table as new_views
+    for each statement execute function cinema.viewing_history_user_activity_trigger();
+create or replace trigger viewing_history_user_activity_delete
+    after delete on cinema.viewing_history
+    referencing old table as old_views
+    for each statement execute function cinema.viewing_history_user_activity_trigger();
+create or replace trigger viewing_history_user_activity_truncate
+    after truncate on cinema.viewing_history
+    for each statement execute function cinema.user_activity_truncate_trigger();
+
+select cinema.refresh_user_daily_activity();
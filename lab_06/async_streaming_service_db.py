@@ -0,0 +1,234 @@
+import asyncio
+import itertools
+
+import pandas as pd
+import psycopg
+from psycopg_pool import AsyncConnectionPool
+
+import queries
+import routines
+import user_reviews
+
+CONNINFO = "host=localhost dbname=streaming_service user=postgres password=postgres port=5432"
+DEFAULT_POOL_SIZE = 4
+DEFAULT_CHUNK_SIZE = 10000
+
+# Отчёты панели не зависят друг от друга и выполняются одновременно
+DASHBOARD_REPORTS = ('users_statistic', 'movies_rating', 'database_size', 'table_columns_information')
+
+
+class AsyncStreamingServiceDB:
+    # Те же методы, что и у StreamingServiceDB, но каждый запрос берёт своё
+    # соединение из асинхронного пула, поэтому независимые отчёты можно
+    # запускать через asyncio.gather. Курсоры клиентские (AsyncClientCursor):
+    # EXECUTE подготовленных операторов принимает параметры так же, как в psycopg2.
+    def __init__(self, conninfo=CONNINFO, pool_size=DEFAULT_POOL_SIZE):
+        self.__conninfo = conninfo
+        self.__pool = AsyncConnectionPool(
+            conninfo,
+            min_size=1,
+            max_size=pool_size,
+            open=False,
+            kwargs={'autocommit': True, 'cursor_factory': psycopg.AsyncClientCursor},
+            configure=self.__prepare_connection,
+        )
+        self.__stream_ids = itertools.count()
+
+    async def open(self):
+        # функции регистрируются до открытия пула: подготовленные операторы
+        # новых соединений ссылаются на них
+        try:
+            async with await psycopg.AsyncConnection.connect(self.__conninfo, autocommit=True,
+                                                             cursor_factory=psycopg.AsyncClientCursor) as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute(routines.REGISTERED_QUERY, routines.registered_query_params())
+                    for sql_query, params in routines.registration_statements(await cur.fetchall()):
+                        await cur.execute(sql_query, params)
+
+            await self.__pool.open(wait=True)
+        except Exception as e:
+            print(f"Error connecting to PostgreSQL: {e}")
+
+        return self
+
+    async def close(self):
+        if self.__pool.closed:
+            return
+        await self.__pool.close()
+        print("PostgreSQL connection pool closed\n")
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    @staticmethod
+    async def __prepare_connection(conn):
+        async with conn.cursor() as cur:
+            for sql_query in queries.prepare_queries():
+                await cur.execute(sql_query)
+
+    async def __sql_executor(self, sql_query, params=None):
+        # результат читается целиком до возврата соединения в пул
+        try:
+            async with self.__pool.connection() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute(sql_query, params)
+                    if cur.description is None:
+                        return [], []
+                    return await cur.fetchall(), [column.name for column in cur.description]
+        except Exception as e:
+            print(f"Error executing query: {e}")
+
+    @staticmethod
+    def __to_pandas_df(rows, columns):
+        df = pd.DataFrame(rows, columns=columns)
+        pd.set_option('display.max_columns', None)
+        pd.set_option('display.width', None)
+
+        return df
+
+    async def __report(self, sql_query, params=None):
+        result = await self.__sql_executor(sql_query, params)
+        if result is not None:
+            return self.__to_pandas_df(*result)
+
+    async def stream_query(self, sql_query, params=None, chunk_size=DEFAULT_CHUNK_SIZE, as_dataframe=True):
+        # серверный курсор живёт внутри транзакции на отдельном соединении пула
+        try:
+            async with self.__pool.connection() as conn:
+                async with conn.transaction(force_rollback=True):
+                    async with conn.cursor(name=f"stream_{id(self)}_{next(self.__stream_ids)}") as cur:
+                        await cur.execute(sql_query, params)
+                        columns = [column.name for column in cur.description]
+                        while True:
+                            rows = await cur.fetchmany(chunk_size)
+                            if not rows:
+                                break
+                            yield self.__to_pandas_df(rows, columns) if as_dataframe else rows
+        except Exception as e:
+            print(f"Error executing query: {e}")
+
+    async def users_statistic_chunks(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        async for chunk in self.stream_query(queries.USERS_STATISTIC, chunk_size=chunk_size):
+            yield chunk
+
+    async def user_viewing_stats_chunks(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        async for chunk in self.stream_query(queries.USER_VIEWING_STATS, chunk_size=chunk_size):
+            yield chunk
+
+    async def dashboard(self, reports=DASHBOARD_REPORTS):
+        # общее время равно времени самого долгого отчёта, а не сумме всех
+        results = await asyncio.gather(*(getattr(self, report)() for report in reports))
+        return dict(zip(reports, results))
+
+    # 1. Выполнить скалярный запрос
+    async def avg_movies_release_year(self):
+        result = await self.__sql_executor(queries.AVG_MOVIES_RELEASE_YEAR)
+        if result is not None:
+            rows, _ = result
+            return rows[0][0]
+
+    # 2. Выполнить запрос с несколькими соединениями
+    async def users_statistic(self):
+        return await self.__report(queries.USERS_STATISTIC)
+
+    # 3. Выполнить запрос с CTE и оконными функциями
+    async def movies_rating(self):
+        return await self.__report(queries.MOVIES_RATING)
+
+    # 4. Выполнить запрос к метаданным
+    async def table_columns_information(self):
+        return await self.__report(queries.TABLE_COLUMNS_INFORMATION)
+
+    # 5. Вызвать скалярную функцию
+    async def director_avg_rating(self):
+        return await self.__report(queries.execute_prepared('director_avg_rating'))
+
+    # 6. Вызвать многооператорную или табличную функцию
+    async def users_by_subscription(self, subscription_type):
+        params = (subscription_type,)
+        return await self.__report(queries.execute_prepared('users_by_subscription', params), params)
+
+    async def monthly_stats(self, year):
+        params = (year,)
+        return await self.__report(queries.execute_prepared('monthly_stats', params), params)
+
+    async def user_activity_periods(self, user_id):
+        params = (user_id,)
+        return await self.__report(queries.USER_ACTIVITY_PERIODS, params)
+
+    async def user_viewing_stats(self):
+        return await self.__report(queries.USER_VIEWING_STATS)
+
+    # 7. Вызвать хранимую процедуру
+    async def update_user_subscription(self, user_id, new_subscription_type):
+        if await self.__sql_executor(queries.UPDATE_USER_SUBSCRIPTION, (user_id, new_subscription_type)) is not None:
+            params = (user_id,)
+            return await self.__report(queries.execute_prepared('user_subscription', params), params)
+
+    # 8. Вызвать системную функцию или процедуру
+    async def database_size(self):
+        return await self.__report(queries.DATABASE_SIZE)
+
+    # 9. Создать таблицу в базе данных
+    async def create_review_table(self):
+        if await self.__sql_executor(queries.CREATE_REVIEW_TABLE) is not None:
+            print("Review table created")
+
+    # 10. Выполнить вставку данных в созданную таблицу с использованием инструкции INSERT или COPY
+    async def insert_user_review(self, count=user_reviews.DEFAULT_SAMPLE_SIZE):
+        pairs = await self.sample_review_pairs(count)
+        if pairs is not None:
+            df = await self.insert_user_reviews(user_reviews.generate_reviews(pairs))
+            if df is not None:
+                print("Data inserted\n")
+                return df
+
+    async def sample_review_pairs(self, count=user_reviews.DEFAULT_SAMPLE_SIZE):
+        result = await self.__sql_executor(queries.SAMPLE_REVIEW_PAIRS, user_reviews.sample_params(count))
+        if result is not None:
+            rows, _ = result
+            return rows
+
+    async def insert_user_reviews(self, reviews):
+        # как StreamingServiceDB.insert_user_reviews: COPY во временную таблицу и upsert
+        try:
+            async with self.__pool.connection() as conn:
+                async with conn.transaction():
+                    async with conn.cursor() as cur:
+                        await cur.execute(queries.CREATE_REVIEWS_STAGING)
+                        async with cur.copy(queries.COPY_REVIEWS_STAGING) as copy:
+                            for row in user_reviews.review_rows(reviews):
+                                await copy.write_row(row)
+
+                        await cur.execute(queries.UPSERT_USER_REVIEWS)
+                        upserted = await cur.fetchall()
+                        columns = [column.name for column in cur.description]
+        except Exception as e:
+            print(f"Error executing query: {e}")
+            return
+
+        inserted = [row[:-1] for row in upserted if row[-1]]
+        print(f"Reviews inserted: {len(inserted)}, updated: {len(upserted) - len(inserted)}")
+        return self.__to_pandas_df(inserted, columns[:-1])
+
+    # 11. DROP DATABASE
+    async def drop_database(self):
+        await self.close()
+
+        try:
+            async with await psycopg.AsyncConnection.connect(
+                self.__conninfo.replace("dbname=streaming_service", "dbname=postgres"), autocommit=True
+            ) as conn:
+                await conn.execute(queries.TERMINATE_CONNECTIONS)
+                await conn.execute(queries.DROP_DATABASE)
+                print("Database streaming_service dropped successfully")
+        except Exception as e:
+            print(f"Error dropping database: {e}")
+
+
+async def dashboard(reports=DASHBOARD_REPORTS):
+    async with AsyncStreamingServiceDB() as db:
+        return await db.dashboard(reports)
@@ -0,0 +1,433 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+import psycopg2
+
+import queries
+import routines
+from query_stats import percentile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lab_01', 'generate_data'))
+
+from generate_sharded import run_sharded
+from generate_viewing_history import HISTORY_START
+
+DB_PARAMS = {
+    'host': 'localhost',
+    'database': 'streaming_service',
+    'user': 'postgres',
+    'password': 'postgres',
+    'port': '5432'
+}
+
+DEFAULT_SCALES = (1000, 100000, 1000000)
+
+# рост p50 больше чем на долю tolerance и больше чем на MIN_REGRESSION секунд - регрессия
+DEFAULT_TOLERANCE = 0.2
+MIN_REGRESSION = 0.005
+
+TABLES = ('users', 'movies', 'devices', 'payment_methods', 'viewing_history')
+
+# год, на который приходятся сгенерированные просмотры
+STATS_YEAR = HISTORY_START.year
+
+# SQL-запросы отчётов, в том числе прежние версии для сравнения;
+# значение - текст запроса или пара (текст, параметры)
+BENCHMARKS = {
+    'users_statistic': queries.USERS_STATISTIC,
+    'users_statistic_legacy': queries.USERS_STATISTIC_LEGACY,
+    'movies_rating': queries.MOVIES_RATING,
+    'movies_rating_legacy': queries.MOVIES_RATING_LEGACY,
+    'user_viewing_stats': queries.USER_VIEWING_STATS,
+    'user_viewing_stats_legacy': "select * from pg_temp.get_user_viewing_stats_legacy()",
+    'monthly_stats': f"select * from get_monthly_stats({STATS_YEAR})",
+    'monthly_stats_legacy': f"select * from pg_temp.get_monthly_stats_legacy({STATS_YEAR})",
+    'user_activity_periods': (queries.USER_ACTIVITY_PERIODS, (1,)),
+    # прежний get_user_activity_periods из lab_04: агрегирование просмотров на каждый вызов
+    'user_activity_periods_legacy': ("""
+    select
+        date(start_time) as period_date,
+        count(*) as view_count,
+        sum(end_time - start_time) as total_duration,
+        avg(viewed_percentage) as avg_completion
+    from cinema.viewing_history
+    where user_id = %s
+    group by date(start_time)
+    order by period_date desc
+    """, (1,)),
+}
+
+# Прежние get_user_viewing_stats (временная таблица и запрос на каждого пользователя)
+# и generate_monthly_stats (соединение по EXTRACT, регистрации x просмотры за месяц)
+# создаются во временной схеме соединения бенчмарка, в базе не остаются
+LEGACY_ROUTINES = ("""
+    create function pg_temp.get_user_viewing_stats_legacy()
+    returns table (
+        user_id int,
+        full_name text,
+        total_views bigint,
+        total_watch_time interval,
+        favorite_device text
+    ) as $$
+    declare
+        user_record record;
+        fav_device text;
+    begin
+        create temp table temp_stats as
+        select
+            u.user_id,
+            u.full_name,
+            count(vh.view_id) as total_views,
+            sum(vh.end_time - vh.start_time) as total_watch_time,
+            null::text as favorite_device
+        from cinema.users u
+        left join cinema.viewing_history vh on u.user_id = vh.user_id
+        group by u.user_id, u.full_name;
+
+        for user_record in select * from temp_stats
+        loop
+            select d.device_name into fav_device
+            from cinema.devices d
+            join cinema.viewing_history vh on d.device_id = vh.device_id
+            where vh.user_id = user_record.user_id
+            group by d.device_id, d.device_name
+            order by count(*) desc
+            limit 1;
+
+            update temp_stats
+            set favorite_device = coalesce(fav_device, 'No views')
+            where temp_stats.user_id = user_record.user_id;
+        end loop;
+
+        return query select * from temp_stats;
+
+        drop table temp_stats;
+    end;
+    $$ language plpgsql
+""", """
+    create function pg_temp.get_monthly_stats_legacy(p_year int)
+    returns table (
+        month_num int,
+        month_name text,
+        new_users bigint,
+        total_views bigint
+    ) as $$
+        with recursive months as (
+            select 1 as month_num, 'January' as month_name
+            union all
+            select month_num + 1, to_char(make_date(p_year, month_num + 1, 1), 'FMMonth')
+            from months
+            where month_num < 12
+        )
+        select
+            m.month_num,
+            m.month_name,
+            count(distinct u.user_id) as new_users,
+            count(vh.view_id) as total_views
+        from months m
+        left join cinema.users u on extract(month from u.registration_date) = m.month_num
+                                 and extract(year from u.registration_date) = p_year
+        left join cinema.viewing_history vh on extract(month from vh.start_time) = m.month_num
+                                            and extract(year from vh.start_time) = p_year
+        group by m.month_num, m.month_name
+        order by m.month_num;
+    $$ language sql stable
+""")
+
+# Отчёты StreamingServiceDB целиком, вместе с выборкой и построением DataFrame.
+# Изменяющие методы (update_user_subscription, insert_user_review, ...) не входят:
+# они меняют данные между повторами.
+REPORTS = {
+    'avg_movies_release_year': lambda db: db.avg_movies_release_year(),
+    'users_statistic': lambda db: db.users_statistic(),
+    'movies_rating': lambda db: db.movies_rating(),
+    'table_columns_information': lambda db: db.table_columns_information(),
+    'director_avg_rating': lambda db: db.director_avg_rating(),
+    'users_by_subscription': lambda db: db.users_by_subscription('premium'),
+    'user_viewing_stats': lambda db: db.user_viewing_stats(),
+    'monthly_stats': lambda db: db.monthly_stats(STATS_YEAR),
+    'user_activity_periods': lambda db: db.user_activity_periods(1),
+    'database_size': lambda db: db.database_size(),
+}
+
+TOP_DIRECTOR = """
+    (select director from cinema.movies group by director order by count(*) desc, director limit 1)
+"""
+
+# Функции и процедуры lab_03/scripts.sql без побочных эффектов:
+# имя -> (сигнатура для проверки наличия, запрос)
+STORED_ROUTINES = {
+    'get_director_avg_rating': ('get_director_avg_rating(text)', f"""
+        select get_director_avg_rating({TOP_DIRECTOR})
+    """),
+    'get_users_by_subscription': ('get_users_by_subscription(text)', """
+        select * from get_users_by_subscription('premium')
+    """),
+    'get_user_viewing_stats': ('get_user_viewing_stats()', """
+        select * from get_user_viewing_stats()
+    """),
+    'get_movie_recommendations': ('get_movie_recommendations(integer, integer)', f"""
+        select * from get_movie_recommendations(
+            (select min(movie_id) from cinema.movies where director = {TOP_DIRECTOR})
+        )
+    """),
+    'get_monthly_stats': ('get_monthly_stats(integer)', f"""
+        select * from get_monthly_stats({STATS_YEAR})
+    """),
+    'generate_monthly_stats': ('generate_monthly_stats(integer)', f"""
+        call generate_monthly_stats({STATS_YEAR})
+    """),
+    'get_schema_metadata': ('get_schema_metadata()', """
+        call get_schema_metadata()
+    """),
+}
+
+
+def connect(timeout_seconds=None):
+    conn = psycopg2.connect(**DB_PARAMS)
+    conn.autocommit = True
+    if timeout_seconds is not None:
+        with conn.cursor() as cursor:
+            cursor.execute("set statement_timeout = %s", (timeout_seconds * 1000,))
+    return conn
+
+
+def seed_database(users_count, movies_count=1000, seed=42):
+    run_sharded(users_count, movies_count, seed, DB_PARAMS, fast_users=True)
+
+    conn = connect()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("analyze")
+    finally:
+        conn.close()
+
+
+def database_info():
+    conn = connect()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("show server_version")
+            server_version = cursor.fetchone()[0]
+            counts = {}
+            for table in TABLES:
+                cursor.execute(f"select count(*) from cinema.{table}")
+                counts[table] = cursor.fetchone()[0]
+    finally:
+        conn.close()
+
+    return server_version, counts
+
+
+def summarize(latencies, rows):
+    total = sum(latencies)
+    mean = statistics.mean(latencies)
+    return {
+        'rows': rows,
+        'runs': len(latencies),
+        'min': min(latencies),
+        'mean': mean,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'max': max(latencies),
+        'calls_per_second': len(latencies) / total if total else None,
+        'rows_per_second': rows / mean if mean else None,
+    }
+
+
+def time_calls(call, repeat=3, warmup=1):
+    # call() возвращает число строк результата; прогревочные вызовы не учитываются
+    for _ in range(warmup):
+        call()
+
+    latencies = []
+    rows = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = call()
+        latencies.append(time.perf_counter() - started)
+
+    return summarize(latencies, rows)
+
+
+def time_query(cursor, sql_query, params=None, repeat=3, warmup=1):
+    def call():
+        cursor.execute(sql_query, params)
+        return len(cursor.fetchall()) if cursor.description is not None else 0
+
+    return time_calls(call, repeat, warmup)
+
+
+def run_benchmarks(benchmarks, repeat=3, timeout_seconds=600, warmup=1):
+    results = {}
+    conn = connect(timeout_seconds)
+    try:
+        with conn.cursor() as cursor:
+            # на только что заполненной базе функций и агрегатов lab_06 ещё нет:
+            # их создаёт StreamingServiceDB, а отчёты запускаются после запросов
+            routines.register_routines(cursor)
+            for sql_query in LEGACY_ROUTINES:
+                cursor.execute(sql_query)
+            for name, benchmark in benchmarks.items():
+                sql_query, params = benchmark if isinstance(benchmark, tuple) else (benchmark, None)
+                try:
+                    results[name] = time_query(cursor, sql_query, params, repeat=repeat, warmup=warmup)
+                except psycopg2.errors.QueryCanceled:
+                    results[name] = {'error': f'timeout after {timeout_seconds} s'}
+                except psycopg2.Error as e:
+                    results[name] = {'error': str(e).strip()}
+                print_result(name, results[name])
+    finally:
+        conn.close()
+
+    return results
+
+
+def run_stored_routines(routines, repeat=3, timeout_seconds=600, warmup=1):
+    results = {}
+    conn = connect(timeout_seconds)
+    try:
+        with conn.cursor() as cursor:
+            for name, (signature, sql_query) in routines.items():
+                cursor.execute("select to_regprocedure(%s) is not null", (signature,))
+                if not cursor.fetchone()[0]:
+                    results[name] = {'error': 'not installed, run lab_03/scripts.sql'}
+                else:
+                    try:
+                        results[name] = time_query(cursor, sql_query, repeat=repeat, warmup=warmup)
+                    except psycopg2.errors.QueryCanceled:
+                        results[name] = {'error': f'timeout after {timeout_seconds} s'}
+                    except psycopg2.Error as e:
+                        results[name] = {'error': str(e).strip()}
+                print_result(name, results[name])
+    finally:
+        conn.close()
+
+    return results
+
+
+def run_reports(reports, repeat=3, timeout_seconds=600, warmup=1):
+    # ограничение времени передаётся всем соединениям пула через PGOPTIONS;
+    # после отчётов прежнее значение возвращается, чтобы оно не действовало
+    # на генерацию данных и следующие замеры
+    from streaming_service_db import StreamingServiceDB
+
+    previous_options = os.environ.get('PGOPTIONS')
+    os.environ['PGOPTIONS'] = f"-c statement_timeout={timeout_seconds * 1000}"
+    try:
+        db = StreamingServiceDB()
+        results = {}
+
+        for name, report in reports.items():
+            def call():
+                result = report(db)
+                if result is None:
+                    raise RuntimeError("report failed")
+                return len(result) if hasattr(result, '__len__') else 1
+
+            try:
+                results[name] = time_calls(call, repeat, warmup)
+            except RuntimeError as e:
+                results[name] = {'error': str(e)}
+            print_result(name, results[name])
+    finally:
+        if previous_options is None:
+            os.environ.pop('PGOPTIONS', None)
+        else:
+            os.environ['PGOPTIONS'] = previous_options
+
+    return results
+
+
+def print_result(name, result):
+    if 'error' in result:
+        print(f"  {name:<32} {result['error']}")
+    else:
+        print(f"  {name:<32} p50 {result['p50']:9.3f} s  p95 {result['p95']:9.3f} s  "
+              f"{result['calls_per_second']:8.2f} выз/с  rows {result['rows']}")
+
+
+def compare(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    # сравнение p50 с базовым отчётом; возвращает число регрессий
+    regressions = 0
+    print(f"\nСравнение с базовым отчётом (допуск {tolerance:.0%})")
+    for scale, scale_report in report['scales'].items():
+        base_scale = baseline.get('scales', {}).get(scale)
+        if base_scale is None:
+            continue
+
+        for group, results in scale_report['results'].items():
+            for name, result in results.items():
+                base = base_scale['results'].get(group, {}).get(name)
+                if base is None or 'error' in base or 'error' in result:
+                    continue
+
+                ratio = result['p50'] / base['p50'] if base['p50'] else float('inf')
+                regressed = ratio > 1 + tolerance and result['p50'] - base['p50'] > MIN_REGRESSION
+                regressions += regressed
+                mark = "РЕГРЕССИЯ" if regressed else ""
+                print(f"  {scale:>8} {group}/{name:<32} {base['p50']:9.3f} -> {result['p50']:9.3f} s "
+                      f"({ratio:5.2f}x) {mark}")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение запросов StreamingServiceDB на разных объёмах данных")
+    # генерация данных очищает таблицы базы DB_PARAMS, поэтому включается только явно
+    parser.add_argument('--reset', action='store_true',
+                        help="очистить таблицы и заполнить базу данными каждого масштаба из --scales")
+    parser.add_argument('--scales', type=int, nargs='+', default=list(DEFAULT_SCALES),
+                        help="число пользователей, только с --reset")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--warmup', type=int, default=1, help="прогревочные запуски, не входят в замер")
+    parser.add_argument('--timeout', type=int, default=600, help="ограничение на один запрос, с")
+    parser.add_argument('--output', help="файл для отчёта в формате json")
+    parser.add_argument('--baseline', help="отчёт json предыдущего запуска для сравнения")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help="допустимый рост p50, доля")
+    args = parser.parse_args()
+
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'repeat': args.repeat,
+        'warmup': args.warmup,
+        'scales': {},
+    }
+
+    scales = args.scales if args.reset else ['current']
+    for scale in scales:
+        print(f"\nМасштаб: {scale} пользователей")
+        if args.reset:
+            seed_database(scale)
+
+        server_version, counts = database_info()
+        report['server_version'] = server_version
+        results = {}
+        print("Запросы:")
+        results['queries'] = run_benchmarks(BENCHMARKS, args.repeat, args.timeout, args.warmup)
+        print("Отчёты StreamingServiceDB:")
+        results['reports'] = run_reports(REPORTS, args.repeat, args.timeout, args.warmup)
+        print("Функции и процедуры lab_03:")
+        results['routines'] = run_stored_routines(STORED_ROUTINES, args.repeat, args.timeout, args.warmup)
+        report['scales'][str(scale)] = {'tables': counts, 'results': results}
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as file:
+            baseline = json.load(file)
+        if compare(report, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF = 0.2
+MAX_BACKOFF = 5.0
+DEFAULT_ACQUIRE_TIMEOUT = 30.0
+
+# ошибки подключения; сломанное соединение определяется по conn.closed,
+# так как QueryCanceled тоже наследует OperationalError
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+class ConnectionSetupError(Exception):
+    # соединение открылось, но его подготовка (DDL, PREPARE) завершилась ошибкой
+    # на живом соединении; пул такую ошибку не повторяет
+    pass
+
+
+class PoolTimeoutError(Exception):
+    # за acquire_timeout секунд не освободилось ни одно соединение
+    pass
+
+
+class ConnectionPool:
+    # Ограниченный пул: не больше size соединений выдано одновременно,
+    # остальные потоки ждут на семафоре. Соединения создаются по требованию
+    # функцией connect; закрытые (сломанные) соединения при возврате
+    # выбрасываются, и следующий запрос открывает новое с повторными попытками.
+    # Ожидание соединения ограничено acquire_timeout секундами (None - без
+    # ограничения): поток, который уже держит все соединения, иначе ждал бы вечно.
+    def __init__(self, connect, size, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+                 acquire_timeout=DEFAULT_ACQUIRE_TIMEOUT):
+        self.size = size
+        self.retries = retries
+        self.backoff = backoff
+        self.acquire_timeout = acquire_timeout
+        self.__connect = connect
+        self.__slots = threading.BoundedSemaphore(size)
+        self.__idle = queue.LifoQueue()
+        self.__lock = threading.Lock()
+        self.__closed = False
+        self.__stats = {
+            'checkouts': 0,
+            'in_use': 0,
+            'peak_in_use': 0,
+            'total_wait': 0.0,
+            'max_wait': 0.0,
+            'connects': 0,
+            'connect_retries': 0,
+            'discarded': 0,
+            'timeouts': 0,
+        }
+
+    def __open(self):
+        for attempt in range(self.retries + 1):
+            try:
+                conn = self.__connect()
+                with self.__lock:
+                    self.__stats['connects'] += 1
+                return conn
+            except CONNECTION_ERRORS as e:
+                if attempt == self.retries:
+                    raise
+                delay = min(self.backoff * 2 ** attempt, MAX_BACKOFF)
+                print(f"Connection failed ({e.__class__.__name__}), retry in {delay:.1f} s")
+                with self.__lock:
+                    self.__stats['connect_retries'] += 1
+                time.sleep(delay)
+
+    def __discard(self, conn):
+        try:
+            conn.close()
+        finally:
+            with self.__lock:
+                self.__stats['discarded'] += 1
+
+    def getconn(self):
+        if self.__closed:
+            raise psycopg2.InterfaceError("connection pool is closed")
+
+        started = time.perf_counter()
+        if not self.__slots.acquire(timeout=self.acquire_timeout):
+            with self.__lock:
+                self.__stats['timeouts'] += 1
+            raise PoolTimeoutError(
+                f"no free connection after {self.acquire_timeout} s: all {self.size} connections are in use "
+                f"(an unfinished *_chunks generator keeps its connection until it is exhausted or closed)"
+            )
+        waited = time.perf_counter() - started
+
+        try:
+            try:
+                conn = self.__idle.get_nowait()
+            except queue.Empty:
+                conn = None
+            if conn is not None and conn.closed:
+                self.__discard(conn)
+                conn = None
+            if conn is None:
+                conn = self.__open()
+        except Exception:
+            self.__slots.release()
+            raise
+
+        with self.__lock:
+            stats = self.__stats
+            stats['checkouts'] += 1
+            stats['in_use'] += 1
+            stats['peak_in_use'] = max(stats['peak_in_use'], stats['in_use'])
+            stats['total_wait'] += waited
+            stats['max_wait'] = max(stats['max_wait'], waited)
+        return conn
+
+    def putconn(self, conn):
+        try:
+            if conn.closed or self.__closed:
+                self.__discard(conn)
+            else:
+                self.__idle.put(conn)
+        finally:
+            with self.__lock:
+                self.__stats['in_use'] -= 1
+            self.__slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def statistics(self):
+        with self.__lock:
+            stats = dict(self.__stats)
+        stats['size'] = self.size
+        stats['idle'] = self.__idle.qsize()
+        stats['avg_wait'] = stats['total_wait'] / stats['checkouts'] if stats['checkouts'] else 0.0
+        return stats
+
+    def close(self):
+        self.__closed = True
+        while True:
+            try:
+                self.__idle.get_nowait().close()
+            except queue.Empty:
+                break
@@ -1,5 +1,11 @@
+import asyncio
+
+from async_streaming_service_db import dashboard
 from streaming_service_db import StreamingServiceDB
 
+# отчёты меню повторно читаются из кэша, пока данные не изменились
+CACHE_TTL = 60
+
 
 def menu():
     print("\n----- MENU -----")
@@ -14,11 +20,15 @@ def menu():
     print("9. Create table in database")
     print("10. Insert data into created table using INSERT or COPY")
     print("11. Drop database")
+    print("12. Show dashboard (concurrent reports)")
+    print("13. Show query statistics")
+    print("14. Show monthly statistics")
+    print("15. Show user activity by day")
     print("0. Exit")
 
 
 def main():
-    db = StreamingServiceDB()
+    db = StreamingServiceDB(cache_ttl=CACHE_TTL)
 
     while True:
         menu()
@@ -78,6 +88,32 @@ def main():
         elif choice == "11":
             db.drop_database()
 
+        elif choice == "12":
+            res = asyncio.run(dashboard())
+            for name, report in res.items():
+                print(f"{name}\n")
+                print(report)
+
+        elif choice == "13":
+            print(f"Query statistics\n")
+            print(db.query_statistics())
+            for query in db.slow_queries():
+                print(f"\n{query['time']} {query['method']} {query['seconds']:.3f} s\n{query['query']}")
+                if query['plan']:
+                    print(query['plan'])
+
+        elif choice == "14":
+            year = int(input("Year: "))
+            res = db.monthly_stats(year)
+            print(f"Monthly statistics for {year}\n")
+            print(res)
+
+        elif choice == "15":
+            user_id = int(input("User id: "))
+            res = db.user_activity_periods(user_id)
+            print(f"Activity of user {user_id} by day\n")
+            print(res)
+
         elif choice == "0":
             print("Exit program")
             break
@@ -0,0 +1,270 @@
+AVG_MOVIES_RELEASE_YEAR = """
+    select
+        avg(release_year) as avg_release_year
+    from cinema.movies
+"""
+
+# Каждая таблица агрегируется по user_id отдельно и присоединяется одной строкой
+# на пользователя: нет размножения строк просмотры x устройства x способы оплаты
+USERS_STATISTIC = """
+    select
+        u.user_id,
+        u.full_name as user,
+        u.email as email,
+        u.subscription_type as subscription_type,
+        u.registration_date as registration_date,
+        coalesce(vh.total_views, 0) as total_views,
+        vh.avg_percentage_views,
+        coalesce(d.device_count, 0) as device_count,
+        coalesce(pm.payment_method_count, 0) as payment_method_count
+    from cinema.users u
+    left join (
+        select user_id, count(*) as total_views, avg(viewed_percentage) as avg_percentage_views
+        from cinema.viewing_history
+        group by user_id
+    ) vh on vh.user_id = u.user_id
+    left join (
+        select user_id, count(*) as device_count
+        from cinema.devices
+        where is_active = true
+        group by user_id
+    ) d on d.user_id = u.user_id
+    left join (
+        select user_id, count(*) as payment_method_count
+        from cinema.payment_methods
+        group by user_id
+    ) pm on pm.user_id = u.user_id
+    order by u.user_id
+"""
+
+# Прежняя версия с соединением всех таблиц и distinct по оконным функциям,
+# оставлена для сравнения в benchmark.py
+USERS_STATISTIC_LEGACY = """
+    select distinct
+        u.user_id,
+        u.full_name as user,
+        u.email as email,
+        u.subscription_type as subscription_type,
+        u.registration_date as registration_date,
+        count(vh.view_id) over(partition by u.user_id) as total_views,
+        avg(vh.viewed_percentage) over(partition by u.user_id) as avg_percentage_views,
+        count(d.device_id) over(partition by u.user_id) as device_count,
+        count(pm.payment_method_id) over(partition by u.user_id) as payment_method_count
+    from cinema.users u
+    left join cinema.viewing_history vh on u.user_id = vh.user_id
+    left join cinema.devices d on u.user_id = d.user_id and d.is_active = true
+    left join cinema.payment_methods pm on u.user_id = pm.user_id
+    order by u.user_id
+"""
+
+# Агрегаты по жанрам поддерживаются триггерами (aggregates.sql), отчёт - чтение
+# маленькой таблицы и ещё не перенесённых в неё изменений. Жанры нормализованы:
+# без пробелов и в нижнем регистре. Без pg_cron накопившиеся изменения
+# переносятся здесь же, когда их больше GENRE_STATISTICS_FOLD_THRESHOLD; отчёт
+# читает снимок до переноса, поэтому результат от переноса не зависит.
+GENRE_STATISTICS_FOLD_THRESHOLD = 10000
+
+MOVIES_RATING = f"""
+    with folded as materialized (
+        select cinema.fold_genre_statistics({GENRE_STATISTICS_FOLD_THRESHOLD})
+    )
+    select
+        genre,
+        movie_count,
+        round(sum_imdb_rating / nullif(rated_movie_count, 0), 2) as avg_imdb_rating,
+        round(sum_completion_rate / nullif(viewed_movie_count, 0), 2) as avg_completion_rate,
+        total_views
+    from cinema.genre_statistics_current
+    cross join folded
+    order by total_views desc, genre
+"""
+
+# Дневные итоги пользователя из user_daily_activity (aggregates.sql). Обычный
+# запрос, а не подготовленный: без скрипта агрегатов таблицы нет, и PREPARE
+# при подключении завершался бы ошибкой.
+USER_ACTIVITY_PERIODS = """
+    select
+        activity_date as period_date,
+        view_count,
+        case when timed_view_count > 0 then total_duration end as total_duration,
+        sum_viewed_percentage::numeric / view_count as avg_completion
+    from cinema.user_daily_activity
+    where user_id = %s
+    order by activity_date desc
+"""
+
+# Прежняя версия: полный проход по viewing_history на каждый вызов
+MOVIES_RATING_LEGACY = """
+    with movie_ratings as (
+        select
+            m.movie_id,
+            m.title,
+            m.director,
+            m.release_year,
+            m.genres,
+            m.imdb_rating,
+            count(vh.view_id) as total_views,
+            avg(vh.viewed_percentage) as avg_completion_rate
+        from cinema.movies m
+        left join cinema.viewing_history vh on m.movie_id = vh.movie_id
+        group by m.movie_id, m.title, m.director, m.release_year, m.genres, m.imdb_rating
+    ),
+    genre_analysis as (
+        select
+            genre,
+            count(*) as movie_count,
+            round(avg(imdb_rating), 2) as avg_imdb_rating,
+            round(avg(avg_completion_rate), 2) as avg_completion_rate,
+            sum(total_views) as total_views
+        from movie_ratings,
+        lateral unnest(string_to_array(genres, ',')) as genre
+        group by genre
+    )
+    select * from genre_analysis
+    where genre is not null and genre != ''
+    order by total_views desc
+"""
+
+# get_user_viewing_stats() из lab_03 в однопроходной версии (routines.py)
+USER_VIEWING_STATS = "select * from get_user_viewing_stats()"
+
+TABLE_COLUMNS_INFORMATION = """
+    select
+        table_name,
+        column_name,
+        data_type,
+        is_nullable,
+        column_default,
+        character_maximum_length,
+        numeric_precision,
+        numeric_scale
+    from information_schema.columns
+    where table_schema = 'cinema'
+    order by table_name, ordinal_position
+"""
+
+# CALL нельзя подготовить через PREPARE, но параметры передаются без f-строк
+UPDATE_USER_SUBSCRIPTION = "call update_user_subscription(%s, %s)"
+
+DATABASE_SIZE = """
+    select pg_size_pretty(pg_database_size('streaming_service')) as db_size
+"""
+
+CREATE_REVIEW_TABLE = """
+    drop table if exists cinema.user_reviews;
+
+    create table cinema.user_reviews (
+        review_id serial primary key,
+        user_id integer not null,
+        movie_id integer not null,
+        rating integer not null check (rating between 1 and 10),
+        review_text text,
+        created_at timestamp default current_timestamp,
+
+        constraint fk_user_review_user foreign key (user_id) references cinema.users(user_id) on delete cascade,
+        constraint fk_user_review_movie foreign key (movie_id) references cinema.movies(movie_id) on delete cascade,
+        constraint unique_user_movie_review unique (user_id, movie_id)
+    );
+"""
+
+# Случайные пары выбираются по диапазону ключей: id берутся равномерно между
+# min и max и проверяются по первичным ключам, без перебора users x movies
+SAMPLE_REVIEW_PAIRS = """
+    with bounds as (
+        select
+            (select min(user_id) from cinema.users) as min_user_id,
+            (select max(user_id) from cinema.users) as max_user_id,
+            (select min(movie_id) from cinema.movies) as min_movie_id,
+            (select max(movie_id) from cinema.movies) as max_movie_id
+    ),
+    candidates as materialized (
+        select
+            min_user_id + floor(random() * (max_user_id - min_user_id + 1))::integer as user_id,
+            min_movie_id + floor(random() * (max_movie_id - min_movie_id + 1))::integer as movie_id
+        from bounds, generate_series(1, %(candidates)s)
+    )
+    select distinct c.user_id, c.movie_id
+    from candidates c
+    join cinema.users u on u.user_id = c.user_id
+    join cinema.movies m on m.movie_id = c.movie_id
+    where not exists (
+        select 1
+        from cinema.user_reviews r
+        where r.user_id = c.user_id and r.movie_id = c.movie_id
+    )
+    limit %(count)s
+"""
+
+# Отзывы загружаются через COPY во временную таблицу и переносятся одним
+# запросом; при повторе пары (user_id, movie_id) побеждает последняя строка
+CREATE_REVIEWS_STAGING = """
+    create temp table user_reviews_staging (
+        line serial,
+        user_id integer,
+        movie_id integer,
+        rating integer,
+        review_text text
+    ) on commit drop
+"""
+
+COPY_REVIEWS_STAGING = "copy user_reviews_staging (user_id, movie_id, rating, review_text) from stdin"
+
+# inserted отличает новые строки от обновлённых (у новой версии xmax = 0)
+UPSERT_USER_REVIEWS = """
+    insert into cinema.user_reviews as r (user_id, movie_id, rating, review_text)
+    select distinct on (user_id, movie_id) user_id, movie_id, rating, review_text
+    from user_reviews_staging
+    order by user_id, movie_id, line desc
+    on conflict (user_id, movie_id) do update set
+        rating = excluded.rating,
+        review_text = excluded.review_text
+    returning r.*, (r.xmax = 0) as inserted
+"""
+
+TERMINATE_CONNECTIONS = """
+    select pg_terminate_backend(pg_stat_activity.pid)
+    from pg_stat_activity
+    where pg_stat_activity.datname = 'streaming_service'
+    and pid <> pg_backend_pid()
+"""
+
+DROP_DATABASE = "drop database if exists streaming_service"
+
+# Подготовленные операторы создаются один раз на соединение:
+# имя -> (типы параметров, текст запроса)
+PREPARED_STATEMENTS = {
+    'director_avg_rating': ((), """
+    select
+        director,
+        get_director_avg_rating(director) as avg_rating
+    from cinema.movies
+    group by director
+    """),
+    'users_by_subscription': (('text',), """
+    select * from get_users_by_subscription($1)
+    """),
+    'monthly_stats': (('integer',), """
+    select * from get_monthly_stats($1)
+    """),
+    'user_subscription': (('integer',), """
+    select user_id, subscription_type
+    from cinema.users
+    where user_id = $1
+    """),
+}
+
+
+def prepare_queries():
+    for name, (types, sql_query) in PREPARED_STATEMENTS.items():
+        arguments = f"({', '.join(types)})" if types else ""
+        yield f"prepare {name}{arguments} as {sql_query}"
+
+
+def prepare_statements(cursor):
+    for sql_query in prepare_queries():
+        cursor.execute(sql_query)
+
+
+def execute_prepared(name, params=()):
+    arguments = f"({', '.join(['%s'] * len(params))})" if params else ""
+    return f"execute {name}{arguments}"
@@ -0,0 +1,104 @@
+import statistics
+import threading
+import time
+from collections import deque
+
+import pandas as pd
+
+# сколько последних замеров хранится на метод для перцентилей
+HISTORY_SIZE = 1000
+SLOW_LOG_SIZE = 100
+# по стольким строкам оценивается объём результата
+BYTES_SAMPLE_ROWS = 100
+
+# EXPLAIN ANALYZE повторно выполняет запрос, поэтому снимается только для чтения
+EXPLAINABLE_PREFIXES = ('select', 'with', 'execute')
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def estimate_bytes(rows):
+    # текстовый размер значений по выборке строк, масштабированный на весь результат
+    if not rows:
+        return 0
+    sample = rows[:BYTES_SAMPLE_ROWS]
+    sample_bytes = sum(len(str(value)) for row in sample for value in row if value is not None)
+    return sample_bytes * len(rows) // len(sample)
+
+
+def is_explainable(sql_query):
+    return sql_query.lstrip().lower().startswith(EXPLAINABLE_PREFIXES)
+
+
+class QueryStats:
+    # Замеры запросов по методам StreamingServiceDB: время, строки, оценка
+    # байтов и журнал медленных запросов с планами выполнения.
+    def __init__(self, slow_query_threshold=None, explain_slow_queries=False):
+        self.slow_query_threshold = slow_query_threshold
+        self.explain_slow_queries = explain_slow_queries
+        self.__lock = threading.Lock()
+        self.__methods = {}
+        self.__slow_log = deque(maxlen=SLOW_LOG_SIZE)
+
+    def is_slow(self, seconds):
+        return self.slow_query_threshold is not None and seconds >= self.slow_query_threshold
+
+    def record(self, method, seconds, rows, size):
+        with self.__lock:
+            stats = self.__methods.get(method)
+            if stats is None:
+                stats = self.__methods[method] = {
+                    'calls': 0, 'rows': 0, 'bytes': 0, 'total': 0.0, 'latencies': deque(maxlen=HISTORY_SIZE),
+                }
+            stats['calls'] += 1
+            stats['rows'] += rows
+            stats['bytes'] += size
+            stats['total'] += seconds
+            stats['latencies'].append(seconds)
+
+    def log_slow(self, method, seconds, sql_query, plan=None):
+        with self.__lock:
+            self.__slow_log.append({
+                'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'method': method,
+                'seconds': seconds,
+                'query': sql_query,
+                'plan': plan,
+            })
+
+    def slow_queries(self):
+        with self.__lock:
+            return list(self.__slow_log)
+
+    def summary(self):
+        with self.__lock:
+            methods = {method: dict(stats, latencies=list(stats['latencies']))
+                       for method, stats in self.__methods.items()}
+
+        rows = []
+        for method, stats in methods.items():
+            latencies = stats['latencies']
+            rows.append({
+                'method': method,
+                'calls': stats['calls'],
+                'rows': stats['rows'],
+                'bytes': stats['bytes'],
+                'total_s': stats['total'],
+                'mean_s': statistics.mean(latencies),
+                'p50_s': percentile(latencies, 50),
+                'p95_s': percentile(latencies, 95),
+                'p99_s': percentile(latencies, 99),
+                'max_s': max(latencies),
+            })
+
+        columns = ['method', 'calls', 'rows', 'bytes', 'total_s', 'mean_s', 'p50_s', 'p95_s', 'p99_s', 'max_s']
+        return pd.DataFrame(rows, columns=columns).sort_values('total_s', ascending=False, ignore_index=True)
+
+    def reset(self):
+        with self.__lock:
+            self.__methods.clear()
+            self.__slow_log.clear()
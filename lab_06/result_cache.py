@@ -0,0 +1,112 @@
+import functools
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_CACHE_SIZE = 128
+
+# зависимость от любой таблицы (например, размер базы)
+ANY_TABLE = '*'
+
+
+class ResultCache:
+    # Результаты отчётов по ключу (метод, параметры). Запись живёт ttl секунд,
+    # при переполнении вытесняется давно не использованная (LRU). Изменения,
+    # сделанные в обход StreamingServiceDB, кэш не видит - их ограничивает TTL.
+    def __init__(self, ttl, max_entries=DEFAULT_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0, 'invalidated': 0}
+
+    def get(self, key):
+        now = time.monotonic()
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self.__entries[key]
+                self.__stats['expired'] += 1
+                entry = None
+
+            if entry is None:
+                self.__stats['misses'] += 1
+                return False, None
+
+            self.__entries.move_to_end(key)
+            self.__stats['hits'] += 1
+            return True, entry[1]
+
+    def put(self, key, value, tables):
+        with self.__lock:
+            self.__entries[key] = (time.monotonic() + self.ttl, value, frozenset(tables))
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_entries:
+                self.__entries.popitem(last=False)
+                self.__stats['evicted'] += 1
+
+    def invalidate(self, tables):
+        tables = set(tables)
+        with self.__lock:
+            stale = [key for key, (_, _, depends_on) in self.__entries.items()
+                     if ANY_TABLE in tables or ANY_TABLE in depends_on or depends_on & tables]
+            for key in stale:
+                del self.__entries[key]
+            self.__stats['invalidated'] += len(stale)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+
+    def statistics(self):
+        with self.__lock:
+            stats = dict(self.__stats)
+            stats['size'] = len(self.__entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+
+def _copy(value):
+    # DataFrame изменяем, вызывающий код получает копию
+    return value.copy() if hasattr(value, 'copy') else value
+
+
+def cached(*tables):
+    # Метод объекта с атрибутом cache (ResultCache или None); tables - таблицы,
+    # от которых зависит результат. Неудачные запросы (None) не кэшируются.
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            cache = self.cache
+            if cache is None:
+                return method(self, *args, **kwargs)
+
+            key = (method.__name__, args, tuple(sorted(kwargs.items())))
+            hit, value = cache.get(key)
+            if not hit:
+                value = method(self, *args, **kwargs)
+                if value is None:
+                    return None
+                cache.put(key, value, tables)
+            return _copy(value)
+
+        return wrapper
+
+    return decorator
+
+
+def invalidates(*tables):
+    # Метод изменяет таблицы: после него устаревшие результаты удаляются из кэша
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                if self.cache is not None:
+                    self.cache.invalidate(tables)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,197 @@
+import hashlib
+import os
+
+# Серверные функции и процедуры, которые использует StreamingServiceDB.
+# Версия объекта - хэш его DDL в комментарии в начале тела функции: при
+# подключении выполняется DDL только новых и изменённых объектов. Те же функции
+# создаёт lab_03/scripts.sql; CREATE OR REPLACE заменяет тело вместе с версией
+# (COMMENT ON бы сохранился), поэтому клиент затем пересоздаёт свою версию. Таблицы агрегатов с триггерами
+# (movies_rating, user_activity_periods) создаёт и заполняет aggregates.sql:
+# если их нет в базе, скрипт выполняется при регистрации. Индексы сюда не
+# входят, их строит lab_03/scripts.sql.
+AGGREGATES_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'aggregates.sql')
+AGGREGATES = 'aggregates.sql'
+ROUTINES = [
+    ('public.get_director_avg_rating(text)', """
+    create or replace function public.get_director_avg_rating(director_name text)
+    returns decimal as $$
+    declare
+        avg_rating decimal;
+    begin
+        select avg(imdb_rating) into avg_rating
+        from cinema.movies
+        where director = director_name;
+
+        return coalesce(avg_rating, 0);
+    end;
+    $$ language plpgsql;
+    """),
+    ('public.get_users_by_subscription(text)', """
+    create or replace function public.get_users_by_subscription(sub_type text)
+    returns table (
+        user_id int,
+        email text,
+        full_name text,
+        registration_date date
+    ) as $$
+    begin
+        return query
+        select u.user_id, u.email, u.full_name, u.registration_date
+        from cinema.users u
+        where u.subscription_type = sub_type
+        order by u.registration_date desc;
+    end;
+    $$ language plpgsql;
+    """),
+    ('public.update_user_subscription(integer, text)', """
+    create or replace procedure public.update_user_subscription(
+        p_user_id int,
+        p_new_subscription text
+    ) as $$
+    begin
+        if p_new_subscription not in ('basic', 'standard', 'premium') then
+            raise exception 'invalid subscription type: %', p_new_subscription;
+        end if;
+
+        update cinema.users
+        set subscription_type = p_new_subscription
+        where user_id = p_user_id;
+
+        raise notice 'subscription updated for user % to %', p_user_id, p_new_subscription;
+    end;
+    $$ language plpgsql;
+    """),
+    ('public.get_user_viewing_stats()', """
+    create or replace function public.get_user_viewing_stats()
+    returns table (
+        user_id int,
+        full_name text,
+        total_views bigint,
+        total_watch_time interval,
+        favorite_device text
+    ) as $$
+        with device_views as (
+            select
+                vh.user_id,
+                vh.device_id,
+                count(*) as views,
+                sum(vh.end_time - vh.start_time) as watch_time
+            from cinema.viewing_history vh
+            group by vh.user_id, vh.device_id
+        ),
+        user_views as (
+            select
+                dv.user_id,
+                sum(dv.views)::bigint as total_views,
+                sum(dv.watch_time) as total_watch_time
+            from device_views dv
+            group by dv.user_id
+        ),
+        favorite_devices as (
+            select distinct on (dv.user_id)
+                dv.user_id,
+                d.device_name::text as device_name
+            from device_views dv
+            join cinema.devices d on d.device_id = dv.device_id
+            order by dv.user_id, dv.views desc, dv.device_id
+        )
+        select
+            u.user_id,
+            u.full_name,
+            coalesce(uv.total_views, 0),
+            uv.total_watch_time,
+            coalesce(fd.device_name, 'No views')
+        from cinema.users u
+        left join user_views uv on uv.user_id = u.user_id
+        left join favorite_devices fd on fd.user_id = u.user_id
+        order by u.user_id;
+    $$ language sql stable;
+    """),
+    ('public.get_monthly_stats(integer)', """
+    -- регистрации и просмотры агрегируются отдельно по месяцам с условием
+    -- на полуоткрытый диапазон года; индексы для него строит lab_03/scripts.sql
+    create or replace function public.get_monthly_stats(p_year int)
+    returns table (
+        month_num int,
+        month_name text,
+        new_users bigint,
+        total_views bigint
+    ) as $$
+        with recursive months as (
+            select 1 as month_num, make_date(p_year, 1, 1)::timestamp as month_start
+            union all
+            select month_num + 1, month_start + interval '1 month'
+            from months
+            where month_num < 12
+        ),
+        registrations as (
+            select date_trunc('month', registration_date::timestamp) as month_start, count(*) as new_users
+            from cinema.users
+            where registration_date >= make_date(p_year, 1, 1)
+              and registration_date < make_date(p_year + 1, 1, 1)
+            group by 1
+        ),
+        views as (
+            select date_trunc('month', start_time) as month_start, count(*) as total_views
+            from cinema.viewing_history
+            where start_time >= make_date(p_year, 1, 1)
+              and start_time < make_date(p_year + 1, 1, 1)
+            group by 1
+        )
+        select
+            m.month_num,
+            to_char(m.month_start, 'FMMonth'),
+            coalesce(r.new_users, 0),
+            coalesce(v.total_views, 0)
+        from months m
+        left join registrations r on r.month_start = m.month_start
+        left join views v on v.month_start = m.month_start
+        order by m.month_num;
+    $$ language sql stable;
+    """),
+]
+
+REGISTERED_QUERY = f"""
+select r.signature, coalesce(strpos(p.prosrc, r.version) > 0, false)
+from unnest(%s::text[], %s::text[]) as r(signature, version)
+left join pg_proc p on p.oid = to_regprocedure(r.signature)
+union all
+select '{AGGREGATES}',
+       to_regclass('cinema.genre_statistics_current') is not null
+       and to_regclass('cinema.user_daily_activity') is not null
+       and to_regprocedure('cinema.fold_genre_statistics(integer)') is not null
+"""
+
+
+def routine_version(ddl):
+    return f"streaming_service_db routine {hashlib.sha256(ddl.encode('utf-8')).hexdigest()[:16]}"
+
+
+def versioned_ddl(ddl):
+    return ddl.replace('$$', f"$$\n    -- {routine_version(ddl)}", 1)
+
+
+def registration_statements(registered_rows):
+    # registered_rows - результат REGISTERED_QUERY; отдаёт (sql, параметры)
+    # для объектов, которых нет в базе или которые устарели
+    registered = {signature for signature, is_current in registered_rows if is_current}
+
+    for signature, ddl in ROUTINES:
+        if signature not in registered:
+            yield versioned_ddl(ddl), None
+
+    # заполнение агрегатов читает всю историю просмотров, поэтому скрипт
+    # выполняется, только если его объектов нет
+    if AGGREGATES not in registered:
+        with open(AGGREGATES_SCRIPT, encoding='utf-8') as script:
+            yield script.read(), None
+
+
+def registered_query_params():
+    return [signature for signature, _ in ROUTINES], [routine_version(ddl) for _, ddl in ROUTINES]
+
+
+def register_routines(cursor):
+    cursor.execute(REGISTERED_QUERY, registered_query_params())
+    for sql_query, params in registration_statements(cursor.fetchall()):
+        cursor.execute(sql_query, params)
@@ -1,330 +1,411 @@
+import io
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
 import psycopg2
 import pandas as pd
 
+import queries
+import routines
+import user_reviews
+from connection_pool import ConnectionPool, ConnectionSetupError, CONNECTION_ERRORS, DEFAULT_ACQUIRE_TIMEOUT
+from query_stats import QueryStats, estimate_bytes, is_explainable
+from result_cache import ANY_TABLE, DEFAULT_CACHE_SIZE, ResultCache, cached, invalidates
+
+DEFAULT_CHUNK_SIZE = 10000
+
+DB_PARAMS = {
+    'host': 'localhost',
+    'database': 'streaming_service',
+    'user': 'postgres',
+    'password': 'postgres',
+    'port': '5432',
+}
+
 
 class StreamingServiceDB:
-    def __init__(self):
+    # Каждый метод берёт соединение из ограниченного пула на время запроса,
+    # поэтому один объект можно использовать из нескольких потоков.
+    # pool_size=1 соответствует прежнему режиму с одним соединением.
+    # Потоковые выборки (*_chunks) держат соединение, пока генератор не
+    # исчерпан, поэтому берут его из отдельного пула на stream_pool_size
+    # соединений: запросы во время итерации не ждут сами себя. Если свободного
+    # соединения нет acquire_timeout секунд, запрос завершается ошибкой.
+    # cache_ttl включает кэш результатов отчётов (секунды жизни записи).
+    # Запросы дольше slow_query_threshold секунд попадают в журнал медленных,
+    # с explain_slow_queries - вместе с планом EXPLAIN (ANALYZE, BUFFERS).
+    def __init__(self, pool_size=1, cache_ttl=None, cache_size=DEFAULT_CACHE_SIZE,
+                 slow_query_threshold=None, explain_slow_queries=False,
+                 stream_pool_size=1, acquire_timeout=DEFAULT_ACQUIRE_TIMEOUT):
+        self.__pool = None
+        self.__stream_pool = None
+        self.cache = ResultCache(cache_ttl, cache_size) if cache_ttl is not None else None
+        self.stats = QueryStats(slow_query_threshold, explain_slow_queries)
+        self.__stream_ids = itertools.count()
+        self.__routines_lock = threading.Lock()
+        self.__routines_registered = False
+
         try:
-            self.__conn = psycopg2.connect(
-                host="localhost",
-                database="streaming_service",
-                user="postgres",
-                password="postgres",
-                port="5432",
-            )
-            self.__conn.autocommit = True
-            self.__cur = self.__conn.cursor()
+            self.__pool = ConnectionPool(self.__connect, pool_size, acquire_timeout=acquire_timeout)
+            # соединения потокового пула открываются при первой выборке
+            self.__stream_pool = ConnectionPool(self.__connect, stream_pool_size, acquire_timeout=acquire_timeout)
+            # первое соединение открывается сразу, чтобы ошибки подключения были видны здесь
+            with self.__cursor():
+                pass
         except Exception as e:
             print(f"Error connecting to PostgreSQL: {e}")
 
     def __del__(self):
-        if self.__conn:
-            self.__cur.close()
-            self.__conn.close()
-            print("PostgreSQL connection closed\n")
-
-    def __sql_executor(self, sql_query):
+        self.__close_pool("PostgreSQL connection closed\n")
+
+    def __close_pool(self, message):
+        stream_pool = getattr(self, '_StreamingServiceDB__stream_pool', None)
+        if stream_pool is not None:
+            stream_pool.close()
+            self.__stream_pool = None
+        pool = getattr(self, '_StreamingServiceDB__pool', None)
+        if pool is not None:
+            pool.close()
+            self.__pool = None
+            print(message)
+
+    def __connect(self):
+        # функции регистрируются один раз, подготовленные операторы - на каждом соединении
+        # пул повторяет только ошибки подключения: QueryCanceled при регистрации
+        # тоже OperationalError, но соединение при этом живо, и повтор не поможет
+        conn = psycopg2.connect(**DB_PARAMS)
         try:
-            self.__cur.execute(sql_query)
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                with self.__routines_lock:
+                    if not self.__routines_registered:
+                        routines.register_routines(cursor)
+                        self.__routines_registered = True
+                queries.prepare_statements(cursor)
         except Exception as e:
-            print(f"Error executing query: {e}")
-            return
+            lost = conn.closed
+            conn.close()
+            if lost:
+                raise
+            raise ConnectionSetupError(f"connection setup failed: {e}") from e
+        return conn
+
+    @contextmanager
+    def __cursor(self):
+        if self.__pool is None:
+            raise psycopg2.InterfaceError("no connection to streaming_service")
+
+        with self.__pool.connection() as conn:
+            with conn.cursor() as cursor:
+                yield cursor
+
+    def pool_statistics(self):
+        return self.__pool.statistics() if self.__pool is not None else {}
+
+    def stream_pool_statistics(self):
+        return self.__stream_pool.statistics() if self.__stream_pool is not None else {}
+
+    def cache_statistics(self):
+        return self.cache.statistics() if self.cache is not None else {}
 
-        return sql_query
+    def query_statistics(self):
+        return self.stats.summary()
 
-    def __to_pandas_df(self, rows):
-        columns = [desc[0] for desc in self.__cur.description]
+    def slow_queries(self):
+        return self.stats.slow_queries()
 
+    def __instrument(self, cursor, method, sql_query, params, seconds, rows):
+        self.stats.record(method, seconds, len(rows), estimate_bytes(rows))
+        if not self.stats.is_slow(seconds):
+            return
+
+        query = cursor.mogrify(sql_query, params).decode()
+        plan = None
+        if self.stats.explain_slow_queries and is_explainable(sql_query):
+            try:
+                cursor.execute("explain (analyze, buffers) " + sql_query, params)
+                plan = "\n".join(row[0] for row in cursor.fetchall())
+            except Exception as e:
+                plan = f"explain failed: {e}"
+        self.stats.log_slow(method, seconds, query, plan)
+
+    def __sql_executor(self, method, sql_query, params=None, retry=True):
+        # При обрыве соединения запрос повторяется на новом соединении.
+        # Изменяющие запросы передают retry=False: они могли успеть выполниться.
+        # Замеры записываются под именем method - публичного метода клиента.
+        attempts = self.__pool.retries + 1 if self.__pool is not None and retry else 1
+        for attempt in range(attempts):
+            try:
+                with self.__cursor() as cursor:
+                    started = time.perf_counter()
+                    try:
+                        cursor.execute(sql_query, params)
+                    except CONNECTION_ERRORS:
+                        if cursor.connection.closed and attempt + 1 < attempts:
+                            continue
+                        raise
+
+                    rows = cursor.fetchall() if cursor.description is not None else []
+                    columns = [desc[0] for desc in cursor.description or ()]
+                    self.__instrument(cursor, method, sql_query, params, time.perf_counter() - started, rows)
+                    return rows, columns
+            except Exception as e:
+                print(f"Error executing query: {e}")
+                return
+
+    def __to_pandas_df(self, rows, columns):
         df = pd.DataFrame(rows, columns=columns)
         pd.set_option('display.max_columns', None)
         pd.set_option('display.width', None)
 
         return df
 
+    def stream_query(self, sql_query, params=None, chunk_size=DEFAULT_CHUNK_SIZE, as_dataframe=True,
+                     method='stream_query'):
+        # Именованный (серверный) курсор отдаёт результат порциями по chunk_size строк,
+        # поэтому в памяти клиента одновременно находится не больше одной порции.
+        # Серверный курсор живёт только внутри транзакции, на время итерации
+        # соединение из потокового пула работает без автокоммита.
+        try:
+            if self.__stream_pool is None:
+                raise psycopg2.InterfaceError("no connection to streaming_service")
+
+            with self.__stream_pool.connection() as conn:
+                conn.autocommit = False
+                cursor = conn.cursor(name=f"stream_{id(self)}_{next(self.__stream_ids)}")
+                cursor.itersize = chunk_size
+                # в замер входит только время запроса и выборок, без обработки порций
+                seconds, total_rows, total_bytes = 0.0, 0, 0
+                try:
+                    started = time.perf_counter()
+                    cursor.execute(sql_query, params)
+                    while True:
+                        rows = cursor.fetchmany(chunk_size)
+                        seconds += time.perf_counter() - started
+                        if not rows:
+                            break
+                        total_rows += len(rows)
+                        total_bytes += estimate_bytes(rows)
+                        # у именованного курсора description заполняется после первой выборки
+                        columns = [desc[0] for desc in cursor.description]
+                        yield self.__to_pandas_df(rows, columns) if as_dataframe else rows
+                        started = time.perf_counter()
+                finally:
+                    self.stats.record(method, seconds, total_rows, total_bytes)
+                    if not conn.closed:
+                        cursor.close()
+                        conn.rollback()
+                        conn.autocommit = True
+        except Exception as e:
+            print(f"Error executing query: {e}")
+
+    def users_statistic_chunks(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        yield from self.stream_query(queries.USERS_STATISTIC, chunk_size=chunk_size, method='users_statistic_chunks')
+
+    def user_viewing_stats_chunks(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        yield from self.stream_query(queries.USER_VIEWING_STATS, chunk_size=chunk_size,
+                                     method='user_viewing_stats_chunks')
+
     # 1. Выполнить скалярный запрос
+    @cached('movies')
     def avg_movies_release_year(self):
-        sql_query = """
-        select 
-            avg(release_year) as avg_release_year
-        from cinema.movies
-        """
+        sql_query = queries.AVG_MOVIES_RELEASE_YEAR
 
-        if self.__sql_executor(sql_query):
-            row = self.__cur.fetchone()
-            return row[0]
+        result = self.__sql_executor('avg_movies_release_year', sql_query)
+        if result is not None:
+            rows, _ = result
+            return rows[0][0]
 
     # 2. Выполнить запрос с несколькими соединениями
+    @cached('users', 'viewing_history', 'devices', 'payment_methods')
     def users_statistic(self):
-        sql_query = """
-        select distinct
-            u.user_id,
-            u.full_name as user,
-            u.email as email,
-            u.subscription_type as subscription_type,
-            u.registration_date as registration_date,
-            count(vh.view_id) over(partition by u.user_id) as total_views,
-            avg(vh.viewed_percentage) over(partition by u.user_id) as avg_percentage_views,
-            count(d.device_id) over(partition by u.user_id) as device_count,
-            count(pm.payment_method_id) over(partition by u.user_id) as payment_method_count
-        from cinema.users u
-        left join cinema.viewing_history vh on u.user_id = vh.user_id
-        left join cinema.devices d on u.user_id = d.user_id and d.is_active = true
-        left join cinema.payment_methods pm on u.user_id = pm.user_id
-        order by u.user_id
-        """
-
-        if self.__sql_executor(sql_query):
-            rows = self.__cur.fetchall()
-            df = self.__to_pandas_df(rows)
+        sql_query = queries.USERS_STATISTIC
+
+        result = self.__sql_executor('users_statistic', sql_query)
+        if result is not None:
+            df = self.__to_pandas_df(*result)
 
             return df
 
     # 3. Выполнить запрос с CTE и оконными функциями
+    @cached('movies', 'viewing_history')
     def movies_rating(self):
-        sql_query = """
-        with movie_ratings as (
-            select
-                m.movie_id,
-                m.title,
-                m.director,
-                m.release_year,
-                m.genres,
-                m.imdb_rating,
-                count(vh.view_id) as total_views,
-                avg(vh.viewed_percentage) as avg_completion_rate
-            from cinema.movies m
-            left join cinema.viewing_history vh on m.movie_id = vh.movie_id
-            group by m.movie_id, m.title, m.director, m.release_year, m.genres, m.imdb_rating
-        ),
-        genre_analysis as (
-            select
-                genre,
-                count(*) as movie_count,
-                round(avg(imdb_rating), 2) as avg_imdb_rating,
-                round(avg(avg_completion_rate), 2) as avg_completion_rate,
-                sum(total_views) as total_views
-            from movie_ratings,
-            lateral unnest(string_to_array(genres, ',')) as genre
-            group by genre
-        )
-        select * from genre_analysis
-        where genre is not null and genre != ''
-        order by total_views desc
-        """
-
-        if self.__sql_executor(sql_query):
-            rows = self.__cur.fetchall()
-            df = self.__to_pandas_df(rows)
+        sql_query = queries.MOVIES_RATING
+
+        result = self.__sql_executor('movies_rating', sql_query)
+        if result is not None:
+            df = self.__to_pandas_df(*result)
 
             return df
 
     # 4. Выполнить запрос к метаданным
+    @cached('schema')
     def table_columns_information(self):
-        sql_query = """
-        select 
-            table_name,
-            column_name,
-            data_type,
-            is_nullable,
-            column_default,
-            character_maximum_length,
-            numeric_precision,
-            numeric_scale
-        from information_schema.columns 
-        where table_schema = 'cinema'
-        order by table_name, ordinal_position;
-        """
-
-        if self.__sql_executor(sql_query):
-            rows = self.__cur.fetchall()
-            df = self.__to_pandas_df(rows)
+        sql_query = queries.TABLE_COLUMNS_INFORMATION
+
+        result = self.__sql_executor('table_columns_information', sql_query)
+        if result is not None:
+            df = self.__to_pandas_df(*result)
 
             return df
 
     # 5. Вызвать скалярную функцию
+    @cached('movies')
     def director_avg_rating(self):
-        sql_query = """
-        create or replace function get_director_avg_rating(director_name text)
-        returns decimal as $$
-        declare
-            avg_rating decimal;
-        begin
-            select avg(imdb_rating) into avg_rating
-            from cinema.movies 
-            where director = director_name;
-            
-            return coalesce(avg_rating, 0);
-        end;
-        $$ language plpgsql;
-        
-        select 
-            director,
-            get_director_avg_rating(director) as avg_rating
-        from cinema.movies 
-        group by director
-        """
+        sql_query = queries.execute_prepared('director_avg_rating')
 
-        if self.__sql_executor(sql_query):
-            rows = self.__cur.fetchall()
-            df = self.__to_pandas_df(rows)
+        result = self.__sql_executor('director_avg_rating', sql_query)
+        if result is not None:
+            df = self.__to_pandas_df(*result)
 
             return df
 
     # 6. Вызвать многооператорную или табличную функцию
+    @cached('users')
     def users_by_subscription(self, subscription_type):
-        sql_query = f"""
-        create or replace function get_users_by_subscription(sub_type text)
-        returns table (
-            user_id int,
-            email text,
-            full_name text,
-            registration_date date
-        ) as $$
-        begin
-            return query
-            select u.user_id, u.email, u.full_name, u.registration_date
-            from cinema.users u
-            where u.subscription_type = sub_type
-            order by u.registration_date desc;
-        end;
-        $$ language plpgsql;
-        
-        select * from get_users_by_subscription('{subscription_type}')
-        """
+        params = (subscription_type,)
+        sql_query = queries.execute_prepared('users_by_subscription', params)
 
-        if self.__sql_executor(sql_query):
-            rows = self.__cur.fetchall()
-            df = self.__to_pandas_df(rows)
+        result = self.__sql_executor('users_by_subscription', sql_query, params)
+        if result is not None:
+            df = self.__to_pandas_df(*result)
+            return df
+
+    @cached('users', 'viewing_history')
+    def monthly_stats(self, year):
+        params = (year,)
+        sql_query = queries.execute_prepared('monthly_stats', params)
+
+        result = self.__sql_executor('monthly_stats', sql_query, params)
+        if result is not None:
+            df = self.__to_pandas_df(*result)
+            return df
+
+    @cached('viewing_history')
+    def user_activity_periods(self, user_id):
+        params = (user_id,)
+        sql_query = queries.USER_ACTIVITY_PERIODS
+
+        result = self.__sql_executor('user_activity_periods', sql_query, params)
+        if result is not None:
+            df = self.__to_pandas_df(*result)
+            return df
+
+    @cached('users', 'viewing_history', 'devices')
+    def user_viewing_stats(self):
+        sql_query = queries.USER_VIEWING_STATS
+
+        result = self.__sql_executor('user_viewing_stats', sql_query)
+        if result is not None:
+            df = self.__to_pandas_df(*result)
             return df
 
     # 7. Вызвать хранимую процедуру
+    @invalidates('users')
     def update_user_subscription(self, user_id, new_subscription_type):
-        sql_query = f"""
-        create or replace procedure update_user_subscription(
-            p_user_id int,
-            p_new_subscription text
-        ) as $$
-        begin
-            if p_new_subscription not in ('basic', 'standard', 'premium') then
-                raise exception 'invalid subscription type: %', p_new_subscription;
-            end if;
-            
-            update cinema.users 
-            set subscription_type = p_new_subscription
-            where user_id = p_user_id;
-            
-            raise notice 'subscription updated for user % to %', p_user_id, p_new_subscription;            
-        end;
-        $$ language plpgsql;
-        
-        call update_user_subscription({1}, '{new_subscription_type}');
-        
-        select user_id, subscription_type
-        from cinema.users
-        where user_id = {user_id};
-        """
-
-        if self.__sql_executor(sql_query):
-            rows = self.__cur.fetchall()
-            df = self.__to_pandas_df(rows)
-            return df
+        sql_query = queries.UPDATE_USER_SUBSCRIPTION
+
+        params = (user_id, new_subscription_type)
+        if self.__sql_executor('update_user_subscription', sql_query, params, retry=False) is not None:
+            params = (user_id,)
+            sql_query = queries.execute_prepared('user_subscription', params)
+
+            result = self.__sql_executor('update_user_subscription', sql_query, params)
+            if result is not None:
+                df = self.__to_pandas_df(*result)
+                return df
 
     # 8. Вызвать системную функцию или процедуру
+    @cached(ANY_TABLE)
     def database_size(self):
-        sql_query = """
-        select pg_size_pretty(pg_database_size('streaming_service')) as db_size
-        """
+        sql_query = queries.DATABASE_SIZE
 
-        if self.__sql_executor(sql_query):
-            rows = self.__cur.fetchall()
-            df = self.__to_pandas_df(rows)
+        result = self.__sql_executor('database_size', sql_query)
+        if result is not None:
+            df = self.__to_pandas_df(*result)
             return df
 
     # 9. Создать таблицу в базе данных
+    @invalidates('user_reviews', 'schema')
     def create_review_table(self):
-        sql_query = """
-        drop table if exists cinema.user_reviews;
-        
-        create table cinema.user_reviews (
-            review_id serial primary key,
-            user_id integer not null,
-            movie_id integer not null,
-            rating integer not null check (rating between 1 and 10),
-            review_text text,
-            created_at timestamp default current_timestamp,
-                        
-            constraint fk_user_review_user foreign key (user_id) references cinema.users(user_id) on delete cascade,
-            constraint fk_user_review_movie foreign key (movie_id) references cinema.movies(movie_id) on delete cascade,
-            constraint unique_user_movie_review unique (user_id, movie_id)
-        );
-        """
-
-        if self.__sql_executor(sql_query):
+        sql_query = queries.CREATE_REVIEW_TABLE
+
+        if self.__sql_executor('create_review_table', sql_query) is not None:
             print("Review table created")
 
     # 10. Выполнить вставку данных в созданную таблицу с использованием инструкции INSERT или COPY
-    def insert_user_review(self):
-        sql_query = """
-        insert into cinema.user_reviews (user_id, movie_id, rating, review_text)
-        select 
-            u.user_id,
-            m.movie_id,
-            (random() * 9 + 1)::integer as rating,
-            case 
-                when random() > 0.3 then 
-                    case (random() * 5)::integer
-                        when 0 then 'Отличный фильм!'
-                        when 1 then 'Очень понравилось'
-                        when 2 then 'Неплохо, но есть недостатки'
-                        when 3 then 'Разочарован'
-                        when 4 then 'Шедевр!'
-                    end
-                else null
-            end as review_text
-        from 
-            cinema.users u
-        cross join 
-            cinema.movies m
-        where 
-            random() < 0.1
-        limit 50;
-        """
-
-        if self.__sql_executor(sql_query):
-            print("Data inserted\n")
-
-            sql_query = "select * from cinema.user_reviews;"
-            if self.__sql_executor(sql_query):
-                rows = self.__cur.fetchall()
-                df = self.__to_pandas_df(rows)
+    @invalidates('user_reviews')
+    def insert_user_review(self, count=user_reviews.DEFAULT_SAMPLE_SIZE):
+        pairs = self.sample_review_pairs(count)
+        if pairs is not None:
+            df = self.insert_user_reviews(user_reviews.generate_reviews(pairs))
+            if df is not None:
+                print("Data inserted\n")
                 return df
 
+    def sample_review_pairs(self, count=user_reviews.DEFAULT_SAMPLE_SIZE):
+        sql_query = queries.SAMPLE_REVIEW_PAIRS
+
+        result = self.__sql_executor('sample_review_pairs', sql_query, user_reviews.sample_params(count))
+        if result is not None:
+            rows, _ = result
+            return rows
+
+    @invalidates('user_reviews')
+    def insert_user_reviews(self, reviews, chunk_size=user_reviews.DEFAULT_COPY_CHUNK_SIZE):
+        # reviews - итерируемые отзывы (см. user_reviews.review_rows), передаются
+        # порциями через COPY. Существующие пары (user_id, movie_id) обновляются,
+        # возвращаются только вставленные строки.
+        started = time.perf_counter()
+        copied = 0
+        try:
+            with self.__pool.connection() as conn:
+                conn.autocommit = False
+                try:
+                    with conn.cursor() as cursor:
+                        cursor.execute(queries.CREATE_REVIEWS_STAGING)
+                        rows = user_reviews.review_rows(reviews)
+                        for chunk in iter(lambda: list(itertools.islice(rows, chunk_size)), []):
+                            data = user_reviews.copy_text(chunk)
+                            cursor.copy_expert(queries.COPY_REVIEWS_STAGING, io.StringIO(data))
+                            copied += len(data)
+
+                        cursor.execute(queries.UPSERT_USER_REVIEWS)
+                        upserted = cursor.fetchall()
+                        columns = [desc[0] for desc in cursor.description]
+                    conn.commit()
+                except Exception:
+                    if not conn.closed:
+                        conn.rollback()
+                    raise
+                finally:
+                    if not conn.closed:
+                        conn.autocommit = True
+        except Exception as e:
+            print(f"Error executing query: {e}")
+            return
+
+        self.stats.record('insert_user_reviews', time.perf_counter() - started, len(upserted), copied)
+        inserted = [row[:-1] for row in upserted if row[-1]]
+        print(f"Reviews inserted: {len(inserted)}, updated: {len(upserted) - len(inserted)}")
+
+        df = self.__to_pandas_df(inserted, columns[:-1])
+        return df
+
     # 11. DROP DATABASE
+    @invalidates(ANY_TABLE)
     def drop_database(self):
-        if self.__conn:
-            self.__cur.close()
-            self.__conn.close()
-            print("Connection to streaming_service closed")
+        self.__close_pool("Connection to streaming_service closed")
         
         try:
-            conn = psycopg2.connect(
-                host="localhost",
-                database="postgres",
-                user="postgres",
-                password="postgres",
-                port="5432",
-            )
+            conn = psycopg2.connect(**dict(DB_PARAMS, database='postgres'))
             conn.autocommit = True
             cur = conn.cursor()
             
-            cur.execute("""
-                SELECT pg_terminate_backend(pg_stat_activity.pid)
-                FROM pg_stat_activity
-                WHERE pg_stat_activity.datname = 'streaming_service'
-                AND pid <> pg_backend_pid();
-            """)
-            
-            cur.execute("DROP DATABASE IF EXISTS streaming_service;")
+            cur.execute(queries.TERMINATE_CONNECTIONS)
+            cur.execute(queries.DROP_DATABASE)
             print("Database streaming_service dropped successfully")
             
             cur.close()
@@ -0,0 +1,48 @@
+import random
+
+REVIEW_COLUMNS = ('user_id', 'movie_id', 'rating', 'review_text')
+
+REVIEW_TEXTS = (
+    'Отличный фильм!',
+    'Очень понравилось',
+    'Неплохо, но есть недостатки',
+    'Разочарован',
+    'Шедевр!',
+)
+
+DEFAULT_SAMPLE_SIZE = 50
+DEFAULT_COPY_CHUNK_SIZE = 10000
+# случайные id попадают в пропуски ключей и в уже оценённые пары,
+# поэтому кандидатов берётся с запасом
+SAMPLE_OVERSAMPLING = 4
+
+
+def sample_params(count):
+    return {'count': count, 'candidates': count * SAMPLE_OVERSAMPLING}
+
+
+def generate_reviews(pairs):
+    # те же оценки и тексты, что раньше выдавал INSERT ... SELECT
+    for user_id, movie_id in pairs:
+        review_text = random.choice(REVIEW_TEXTS) if random.random() > 0.3 else None
+        yield user_id, movie_id, random.randint(1, 10), review_text
+
+
+def review_rows(reviews):
+    # отзывы - словари с ключами REVIEW_COLUMNS или кортежи в том же порядке
+    for review in reviews:
+        if isinstance(review, dict):
+            yield tuple(review.get(column) for column in REVIEW_COLUMNS)
+        else:
+            yield tuple(review)
+
+
+def copy_value(value):
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def copy_text(rows):
+    return ''.join('\t'.join(copy_value(value) for value in row) + '\n' for row in rows)